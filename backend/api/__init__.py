@@ -1,26 +1,55 @@
 # -*- encoding: utf-8 -*-
 
-import os, json
+import os
 
 from flask import Flask
 from flask_cors import CORS
 
-from .routes import rest_api
-from .models import db
+from .routes import rest_api, menu_cache, SECTOR_MODELS
+from .models import db, FactData
+from .caching import result_cache
+from .llm import chart_cache, template_cache
+from .facets import facet_store
+from .search import series_search
+from .upstream import upstreams
+from .replicas import replicas
+from . import auth, errors, metrics
+from .schema import upgrade
 
 app = Flask(__name__)
 
 app.config.from_object('api.config.BaseConfig')
 
 db.init_app(app)
+replicas.init_app(app)
 rest_api.init_app(app)
+errors.init_app(app)
 CORS(app)
 
-# Setup database
-@app.before_first_request
-def initialize_database():
+
+def cache_gauges():
+    """Cache, upstream and replica statistics as gauges for /metrics."""
+    for name, value in result_cache.stats().items():
+        if isinstance(value, (int, float)):
+            yield f'cdri_result_cache_{name}', (), value
+    for name, value in chart_cache.stats().items():
+        yield f'cdri_chart_cache_{name}', (), value
+    for name, value in template_cache.stats().items():
+        yield f'cdri_chart_template_cache_{name}', (), value
+    for upstream in upstreams.values():
+        for name, value in upstream.stats().items():
+            yield f'cdri_upstream_{name}', (('upstream', upstream.name),), value
+    for replica, stats in replicas.stats().items():
+        for name, value in stats.items():
+            yield f'cdri_replica_{name}', (('replica', replica),), value
+
+# Server-Timing headers, /metrics and the X-Profile profiler
+metrics.init_app(app, collect=[cache_gauges])
+
+# Setup database: `flask migrate` before starting the server, or AUTO_MIGRATE=1 for development
+def migrate_database():
     try:
-        db.create_all()
+        upgrade()
     except Exception as e:
 
         print('> Error: DBMS Exception: ' + str(e) )
@@ -28,25 +57,48 @@ def initialize_database():
         # fallback to SQLite
         BASE_DIR = os.path.abspath(os.path.dirname(__file__))
         app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3')
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = app.config['SQLITE_ENGINE_OPTIONS']
 
         print('> Fallback to SQLite ')
-        db.create_all()
+        upgrade()
+
+_started = False
 
-"""
-   Custom responses
-"""
 
-@app.after_request
-def after_request(response):
+def start_worker():
     """
-       Sends back a custom error with {"success", "msg"} format
+       Per-process startup: AUTO_MIGRATE, the replica health checks, the
+       revocation set, the columnar snapshots and the menu, search and facet
+       indexes. gunicorn runs it in each worker before the worker accepts
+       connections (post_worker_init in gunicorn.conf.py), so no request
+       pays for it; other servers (flask run) run it on the first request.
     """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    if app.config['AUTO_MIGRATE']:
+        migrate_database()
 
-    if int(response.status_code) >= 400:
-        response_data = json.loads(response.get_data())
-        if "errors" in response_data:
-            response_data = {"success": False,
-                             "msg": list(response_data["errors"].items())[0][1]}
-            response.set_data(json.dumps(response_data))
-        response.headers.add('Content-Type', 'application/json')
-    return response
\ No newline at end of file
+    # Health-check the read replicas before any read is routed to them
+    replicas.start(app)
+
+    # The menu, search and facet indexes, which requests would otherwise build on first use
+    menu_cache.refresh()
+    models = [FactData] if app.config['DATA_STORAGE'] == 'unified' else SECTOR_MODELS
+    series_search.get(models)
+    for model in models:
+        facet_store.get(model)
+
+    # Revoked tokens in memory, so token_required needs no query
+    auth.start(app)
+
+    if app.config['DATA_ENGINE'] == 'columnar':
+        from .columnar import snapshots
+        snapshots.start(app, models)
+
+@app.before_first_request
+def initialize_database():
+    # A no-op under gunicorn, whose workers have started already
+    start_worker()
@@ -0,0 +1,208 @@
+# -*- encoding: utf-8 -*-
+"""
+   Index advisor for the sector tables.
+
+   /api/query-data records the filter combinations it receives (QueryLog).
+   The advisor replays each combination through get_data, captures the SQL
+   it runs and reports the EXPLAIN plan of every statement, counting full
+   table scans against index lookups (SQLite and PostgreSQL).
+"""
+
+import json, logging, threading, time
+from collections import Counter
+from logging.handlers import MemoryHandler
+
+from flask import current_app
+from sqlalchemy import event
+
+from .models import db
+from .replicas import replicas
+
+
+class BatchHandler(MemoryHandler):
+    """MemoryHandler that also writes its batch out once the oldest line is `interval` seconds old."""
+
+    def __init__(self, capacity, interval, target):
+        super().__init__(capacity, flushLevel=logging.CRITICAL + 1, target=target)
+        self.interval = interval
+        self.started = 0
+
+    def shouldFlush(self, record):
+        if len(self.buffer) == 1:
+            self.started = record.created
+        return super().shouldFlush(record) or record.created - self.started >= self.interval
+
+
+class QueryLog():
+    """
+       Appends the filter combinations received by /api/query-data to
+       QUERY_LOG_PATH as JSON lines so the advisor can replay production
+       traffic offline. Lines are buffered and written QUERY_LOG_BATCH at a
+       time (or QUERY_LOG_FLUSH_SECONDS after the first one, and at exit).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('cdri.query_log')
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._handler = None
+        self._path = None
+
+    def record(self, table_name, filters):
+        config = current_app.config
+        path = config.get('QUERY_LOG_PATH')
+        if not path:
+            return
+        if self._path != path:
+            self.open(path, config['QUERY_LOG_BATCH'], config['QUERY_LOG_FLUSH_SECONDS'])
+        self._logger.info(json.dumps({"table": table_name, "filters": canonical_filters(filters)}))
+
+    def open(self, path, batch, interval):
+        with self._lock:
+            if self._path == path:
+                return
+            self.close()
+            self._handler = BatchHandler(batch, interval, logging.FileHandler(path, delay=True))
+            self._logger.addHandler(self._handler)
+            self._path = path
+
+    def flush(self):
+        if self._handler is not None:
+            self._handler.flush()
+
+    def close(self):
+        if self._handler is not None:
+            self._logger.removeHandler(self._handler)
+            target = self._handler.target
+            self._handler.close()
+            target.close()
+            self._handler = self._path = None
+
+
+query_log = QueryLog()
+
+
+def canonical_filters(filters):
+    """The non-empty filters of a get_data call, extra dimensions (`filters`) included."""
+    canonical = {column: value for column, value in filters.items() if value and column != "filters"}
+    extra = {key: value for key, value in (filters.get("filters") or {}).items() if value}
+    if extra:
+        canonical["filters"] = extra
+    return canonical
+
+
+def query_shape(table_name, filters):
+    """(table, filters as canonical JSON): one hashable key per combination."""
+    return table_name, json.dumps(canonical_filters(filters), sort_keys=True)
+
+
+def load_query_log(path):
+    counts = Counter()
+    with open(path) as log_file:
+        for line in log_file:
+            if line.strip():
+                entry = json.loads(line)
+                counts[query_shape(entry['table'], entry['filters'])] += 1
+    return counts
+
+
+def capture_statements(fn):
+    """Runs `fn` and returns the (statement, parameters) pairs it sent to the primary or a replica."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engines = [db.get_engine()] + [replica.engine for replica in replicas.replicas]
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        fn()
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def explain(statement, parameters):
+    """Returns the plan lines of `statement` for the current backend."""
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+
+    if dialect == 'sqlite':
+        return [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+    if dialect == 'postgresql':
+        return [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters)]
+
+    raise ValueError(f"EXPLAIN is not supported for {dialect}")
+
+
+def classify(line):
+    """'scan' for a full table (or index) scan, 'index' for an index lookup, None otherwise."""
+    line = line.strip().lstrip('-> ')
+
+    # SQLite: "SCAN education_data [USING (COVERING) INDEX ...]" reads every entry,
+    # only "SEARCH education_data USING INDEX ..." looks rows up
+    if line.startswith('SCAN '):
+        return None if 'SUBQUERY' in line or line.startswith('SCAN CONSTANT') else 'scan'
+    if line.startswith('SEARCH ') and 'INDEX' in line:
+        return 'index'
+
+    # PostgreSQL
+    if line.startswith('Seq Scan'):
+        return 'scan'
+    if line.startswith(('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')):
+        return 'index'
+    return None
+
+
+def advise(query_counts, models):
+    """
+       Replays every recorded combination and returns one report entry per
+       combination, most frequent first.
+    """
+    models_by_table = {model.__tablename__: model for model in models}
+    report = []
+
+    for (table_name, shape), count in query_counts.most_common():
+        model = models_by_table.get(table_name)
+        if model is None:
+            continue
+        filters = json.loads(shape)
+
+        started = time.perf_counter()
+        statements = capture_statements(lambda: model.get_data(**filters))
+        elapsed = time.perf_counter() - started
+
+        plans = [explain(statement, parameters) for statement, parameters in statements]
+        kinds = Counter(classify(line) for plan in plans for line in plan)
+
+        report.append({
+            "table": table_name,
+            "filters": filters,
+            "requests": count,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "statements": len(statements),
+            "full_scans": kinds['scan'],
+            "index_lookups": kinds['index'],
+            "plans": plans
+        })
+
+    return report
+
+
+def format_report(report, verbose=False):
+    lines = []
+    for entry in report:
+        filters = ', '.join(f"{column}={value!r}" for column, value in entry['filters'].items()) or '(no filters)'
+        lines.append(f"{entry['table']} [{filters}] x{entry['requests']}: "
+                     f"{entry['statements']} statements, {entry['full_scans']} full scans, "
+                     f"{entry['index_lookups']} index lookups, {entry['elapsed_ms']} ms")
+        for plan in entry['plans']:
+            if verbose or any(classify(line) == 'scan' for line in plan):
+                lines.extend('    ' + line for line in plan)
+
+    total_scans = sum(entry['full_scans'] for entry in report)
+    lines.append(f"{len(report)} combinations replayed, {total_scans} full table scans")
+    return '\n'.join(lines)
@@ -0,0 +1,219 @@
+# -*- encoding: utf-8 -*-
+"""
+   Database-free fast path for token_required.
+
+   Revoked tokens are kept in memory as sha256 digests (optionally in a
+   shared Redis sorted set), filled from jwt_token_blocklist at startup and
+   topped up incrementally by a background thread. Users are served from a
+   short-TTL cache. An authenticated request therefore touches the
+   database zero times; the same thread purges blocklist rows (and digests)
+   whose tokens have expired anyway.
+"""
+
+import hashlib, threading, time
+from datetime import datetime, timezone
+
+import jwt
+from sqlalchemy import event, inspect
+
+from .config import BaseConfig
+from .models import db, Users, JWTTokenBlocklist
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def timestamp(expires_at):
+    """Unix timestamp of a blocklist expiry (stored as naive UTC), or None."""
+    if expires_at is None:
+        return None
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at.timestamp()
+
+
+class RevocationSet():
+    """
+       Hashes of revoked tokens, with the time each token expires anyway.
+       Local by default; with AUTH_REVOCATION_URL set, membership is also
+       checked in a Redis sorted set shared by all workers (scored by
+       expiry), so a logout is seen everywhere at once rather than after the
+       next sync. purge() drops the expired ones from both.
+    """
+
+    key = 'cdri:revocations'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # digest -> expiry as a Unix timestamp (None: never expires)
+        self._hashes = {}
+        self.last_id = 0
+        self.redis = None
+
+    def configure(self, redis_client=None):
+        self.redis = redis_client
+
+    def add(self, digest, expires=None):
+        with self._lock:
+            self._hashes[digest] = expires
+        if self.redis is not None:
+            self.redis.zadd(self.key, {digest: float('inf') if expires is None else expires})
+
+    def contains(self, digest):
+        if digest in self._hashes:
+            return True
+        if self.redis is not None:
+            expires = self.redis.zscore(self.key, digest)
+            if expires is not None:
+                with self._lock:
+                    self._hashes[digest] = None if expires == float('inf') else expires
+                return True
+        return False
+
+    def sync(self):
+        """Adds blocklist rows written since the last sync (by any worker)."""
+        for row_id, digest, token, expires_at in JWTTokenBlocklist.get_since(self.last_id):
+            self.add(digest or token_hash(token), timestamp(expires_at))
+            self.last_id = row_id
+
+    def purge(self, now):
+        """Forgets tokens that expired before `now` (a Unix timestamp); they no longer decode anyway."""
+        with self._lock:
+            # Built aside and swapped in, so a check never sees a half-empty set
+            self._hashes = {digest: expires for digest, expires in self._hashes.items()
+                            if expires is None or expires >= now}
+        if self.redis is not None:
+            self.redis.zremrangebyscore(self.key, '-inf', f'({now}')
+
+    def reset(self):
+        with self._lock:
+            self._hashes = {}
+            self.last_id = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+class UserCache():
+    """
+       Detached Users rows by email with a short TTL. get() merges the
+       cached row into the current session without a SELECT, so views can
+       still modify and save it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+
+    def get(self, email):
+        entry = self._users.get(email)
+        if entry is not None and entry[0] > time.monotonic():
+            return db.session.merge(entry[1], load=False)
+
+        user = Users.get_by_email(email)
+        if user is None:
+            return None
+
+        # Cache the row detached; callers get a session-bound copy
+        db.session.expunge(user)
+        with self._lock:
+            self._users[email] = (time.monotonic() + BaseConfig.AUTH_USER_CACHE_TTL, user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, email):
+        with self._lock:
+            self._users.pop(email, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+revoked_tokens = RevocationSet()
+user_cache = UserCache()
+
+
+@event.listens_for(Users, 'after_update')
+@event.listens_for(Users, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    """Any write to a user drops it from this process's cache (old email included)."""
+    for email in (target.email, *inspect(target).attrs.email.history.deleted):
+        user_cache.invalidate(email)
+
+
+def revoke(token, payload):
+    """Blocklists `token` in the database and in this process's revocation set."""
+    digest = token_hash(token)
+    expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc) if 'exp' in payload else None
+
+    JWTTokenBlocklist(jwt_token=token, token_hash=digest, created_at=datetime.now(timezone.utc),
+                      expires_at=expires_at).save()
+    revoked_tokens.add(digest, timestamp(expires_at))
+
+
+def backfill_token_expiry():
+    """
+       Sets expires_at (and token_hash) on blocklist rows written before
+       those columns existed, from the `exp` of the stored token, so they can
+       be purged too. A token that does not decode can never authenticate:
+       it expires at created_at. Returns the number of rows updated.
+    """
+    updated = 0
+    for row in JWTTokenBlocklist.get_without_expiry():
+        try:
+            payload = jwt.decode(row.jwt_token, options={"verify_signature": False})
+            if 'exp' not in payload:
+                continue
+            row.expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc)
+        except (jwt.InvalidTokenError, TypeError, ValueError, OverflowError):
+            row.expires_at = row.created_at
+        row.token_hash = row.token_hash or token_hash(row.jwt_token)
+        revoked_tokens.add(row.token_hash, timestamp(row.expires_at))
+        updated += 1
+
+    db.session.commit()
+    return updated
+
+
+def purge_expired_tokens():
+    """Deletes blocklist rows whose tokens have expired; they can no longer be decoded anyway."""
+    backfill_token_expiry()
+    now = datetime.now(timezone.utc)
+    deleted = JWTTokenBlocklist.purge_expired(now)
+    # Also when nothing was deleted here: another worker may have purged the rows
+    revoked_tokens.purge(now.timestamp())
+    return deleted
+
+
+_thread = None
+
+
+def start(app):
+    """Fills the revocation set now and keeps it in sync (and purged) from a daemon thread."""
+    global _thread
+
+    if app.config.get('AUTH_REVOCATION_URL'):
+        import redis
+        revoked_tokens.configure(redis.Redis.from_url(app.config['AUTH_REVOCATION_URL']))
+    revoked_tokens.sync()
+
+    if _thread is not None:
+        return
+
+    def run():
+        last_purge = time.monotonic()
+        while True:
+            time.sleep(app.config['AUTH_REVOCATION_SYNC_SECONDS'])
+            try:
+                with app.app_context():
+                    if time.monotonic() - last_purge >= app.config['AUTH_PURGE_INTERVAL_SECONDS']:
+                        purge_expired_tokens()
+                        last_purge = time.monotonic()
+                    revoked_tokens.sync()
+                    db.session.remove()
+            except Exception as e:
+                print('> Error: revocation sync failed: ' + str(e))
+
+    _thread = threading.Thread(target=run, name='auth-revocations', daemon=True)
+    _thread.start()
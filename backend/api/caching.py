@@ -0,0 +1,272 @@
+# -*- encoding: utf-8 -*-
+
+import hashlib, json, threading, time
+from collections import OrderedDict
+
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+
+from .encoding import dumps
+from .models import DataVersion
+
+
+class DataVersions():
+    """
+       In-process view of the `data_version` table.
+
+       Reads are served from memory and re-checked against the database at
+       most every DATA_VERSION_POLL_SECONDS, so other workers' writes are seen
+       within that window. Commits made by this process invalidate it at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        self._checked_at = 0.0
+
+    def get(self):
+        poll_seconds = current_app.config.get('DATA_VERSION_POLL_SECONDS', 2)
+
+        with self._lock:
+            if self._versions is None or time.monotonic() - self._checked_at >= poll_seconds:
+                self._versions = DataVersion.get_versions()
+                self._checked_at = time.monotonic()
+            return self._versions
+
+    def stamp(self, table_names):
+        """Version stamp of a set of tables, usable as a cache key."""
+        versions = self.get()
+        return tuple((table_name, versions.get(table_name, 0)) for table_name in sorted(table_names))
+
+    def invalidate(self):
+        with self._lock:
+            self._versions = None
+
+
+data_versions = DataVersions()
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def invalidate_data_versions(session):
+    if session.info.pop('changed_tables', None):
+        data_versions.invalidate()
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+
+class VersionedCache():
+    """
+       Holds one pre-serialized JSON document derived from the sector tables
+       (and the value it was serialized from).
+
+       The document is rebuilt only when the version stamp of `table_names`
+       changes; in between, get() is a dictionary lookup. The ETag is the hash
+       of the body, so clients can revalidate with If-None-Match.
+    """
+
+    def __init__(self, build, table_names):
+        self.build = build
+        self.table_names = table_names
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def get(self):
+        stamp = data_versions.stamp(self.table_names)
+        entry = self._entry
+        if entry is not None and entry['stamp'] == stamp:
+            return entry
+
+        with self._lock:
+            # Another thread may have rebuilt it while we waited
+            if self._entry is None or self._entry['stamp'] != stamp:
+                self._entry = self._make_entry(stamp)
+            return self._entry
+
+    def refresh(self):
+        """Rebuilds eagerly, e.g. at startup or right after an ingest."""
+        data_versions.invalidate()
+        with self._lock:
+            self._entry = self._make_entry(data_versions.stamp(self.table_names))
+        return self._entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+    def _make_entry(self, stamp):
+        value = self.build()
+        body = dumps(value)
+        return {
+            'stamp': stamp,
+            'value': value,
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest()
+        }
+
+
+class MemoryBackend():
+    """In-process LRU bounded by entry count, total body size and TTL."""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._discard(key)
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._discard(key)
+            # A body larger than the whole budget would only flush everything else
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.size += len(value)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.size, "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend():
+    """
+       Shared backend for several workers/hosts. Entries expire after `ttl`;
+       size is bounded by the server's maxmemory / allkeys-lru policy.
+    """
+
+    def __init__(self, url=None, ttl=300, prefix='cdri:result:', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @property
+    def evictions(self):
+        """Keys the server evicted (INFO stats, server-wide), or None if it does not say."""
+        from redis.exceptions import ResponseError
+        try:
+            return int(self.client.info('stats')['evicted_keys'])
+        except (ResponseError, KeyError):
+            return None
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def stats(self):
+        # No entry count: counting the prefix means a SCAN of the whole keyspace
+        evictions = self.evictions
+        return {"evictions": evictions} if evictions is not None else {}
+
+
+class ResultCache():
+    """
+       Response cache for /api/query-data. Entries are keyed on the table,
+       its data version and the canonicalized filter set, and hold the
+       encoded (and compressed) body, so a hit costs one lookup and no encoding.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def configure(self, backend):
+        self.backend = backend
+
+    def get_backend(self):
+        if self.backend is None:
+            config = current_app.config
+            kind = config.get('RESULT_CACHE_BACKEND', 'memory')
+            if kind == 'redis':
+                self.backend = RedisBackend(config['RESULT_CACHE_URL'], ttl=config['RESULT_CACHE_TTL'])
+            elif kind == 'memory':
+                self.backend = MemoryBackend(config['RESULT_CACHE_MAX_ENTRIES'], config['RESULT_CACHE_MAX_BYTES'],
+                                             ttl=config['RESULT_CACHE_TTL'])
+        return self.backend
+
+    @staticmethod
+    def make_key(table_name, filters):
+        canonical = {column: value for column, value in filters.items() if value}
+        stamp = data_versions.stamp([table_name])
+        return hashlib.sha1(json.dumps([stamp, canonical], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get_or_compute(self, table_name, filters, compute):
+        """
+           Returns the cached body for this filter set, calling compute() on a
+           miss. compute() returns the encoded body (bytes), so `filters` must
+           include anything that changes the encoding.
+        """
+        backend = self.get_backend()
+        if backend is None:
+            return compute()
+
+        key = self.make_key(table_name, filters)
+        body = backend.get(key)
+        with self._lock:
+            if body is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if body is not None:
+            return body
+
+        body = compute()
+        backend.set(key, body)
+        return body
+
+    def stats(self):
+        backend = self.get_backend()
+        stats = {
+            "backend": type(backend).__name__ if backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+        if backend is not None:
+            stats.update(backend.stats())
+        return stats
+
+
+result_cache = ResultCache()
@@ -0,0 +1,311 @@
+# -*- encoding: utf-8 -*-
+"""
+   Columnar in-memory engine for the read-only sector tables (DATA_ENGINE=columnar).
+
+   Each table is loaded once into NumPy arrays: string columns are
+   dictionary-encoded (one small integer code per row plus a category
+   array), numeric columns are stored as-is. get_data() then answers with
+   vectorized masks and np.unique over codes and never touches SQL; a
+   background thread reloads a table when its data_version changes and
+   swaps the new snapshot in atomically.
+"""
+
+import json, threading, time
+
+import numpy as np
+from sqlalchemy import select
+
+from .models import db, DataVersion
+
+
+class EncodedColumn():
+    """A dictionary-encoded string column. Code 0 is always None."""
+
+    def __init__(self, values):
+        lookup = {None: 0}
+        codes = np.fromiter((lookup.setdefault(value, len(lookup)) for value in values),
+                            dtype=np.int64, count=len(values))
+
+        self.categories = np.empty(len(lookup), dtype=object)
+        for value, code in lookup.items():
+            self.categories[code] = value
+
+        self.lookup = lookup
+        self.codes = codes.astype(np.min_scalar_type(len(lookup)))
+        self.empty = np.array([value is None or value == '' for value in self.categories], dtype=bool)
+
+    def equals(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+    def has_values(self, index):
+        return not self.empty[self.codes[index]].all()
+
+    def unique(self, index):
+        codes = np.unique(self.codes[index])
+        codes = codes[~self.empty[codes]]
+        return sorted(self.categories[codes].tolist(), key=str)
+
+    def take(self, index):
+        return self.categories[self.codes[index]].tolist()
+
+
+class NumericColumn():
+
+    def __init__(self, values, dtype):
+        if dtype == np.float64:
+            self.values = np.array([np.nan if value is None else value for value in values], dtype=dtype)
+        else:
+            self.values = np.array(values, dtype=dtype)
+
+    def equals(self, value):
+        try:
+            return self.values == float(value)
+        except (TypeError, ValueError):
+            return np.zeros(len(self.values), dtype=bool)
+
+    def has_values(self, index):
+        values = self.values[index]
+        # 0 counts as empty, same as BaseModel.is_empty()
+        return bool(np.any((values != 0) & ~np.isnan(values)))
+
+    def unique(self, index):
+        values = np.unique(self.values[index])
+        return [value for value in values.tolist() if value == value and value != 0]
+
+    def take(self, index):
+        return [None if value != value else value for value in self.values[index].tolist()]
+
+
+class TableSnapshot():
+    """An immutable columnar copy of one sector table."""
+
+    def __init__(self, model, version):
+        self.model = model
+        self.version = version
+
+        column_names = model.data_columns + ['filters']
+        query = select(*[getattr(model, column_name) for column_name in column_names]).order_by(model.id)
+        rows = db.session.execute(query).all()
+        values = list(zip(*rows)) if rows else [()] * len(column_names)
+
+        self.size = len(rows)
+        self.columns = {}
+        for column_name, column_values in zip(column_names, values):
+            column_type = getattr(model, column_name).type
+            if isinstance(column_type, db.Integer):
+                self.columns[column_name] = NumericColumn(column_values, np.int64)
+            elif isinstance(column_type, db.Float):
+                self.columns[column_name] = NumericColumn(column_values, np.float64)
+            else:
+                self.columns[column_name] = EncodedColumn(column_values)
+
+        # The JSON `filters` column is decoded once per distinct string
+        filters = self.columns['filters']
+        self.extra_filters = [json.loads(raw) if raw else {} for raw in filters.categories]
+
+    def select(self, filters):
+        mask = np.ones(self.size, dtype=bool)
+        for column, value in filters.items():
+            if value and column != "filters":
+                mask &= self.columns[column].equals(value)
+
+        # Extra dimensions match the same way as BaseModel.get_conditions()
+        for key, value in (filters.get("filters") or {}).items():
+            if self.model.is_empty(value):
+                continue
+            matches = {json.dumps(value), value} if isinstance(value, str) else {json.dumps(value)}
+            codes = [code for code, extra in enumerate(self.extra_filters)
+                     if key in extra and json.dumps(extra[key]) in matches]
+            mask &= np.isin(self.columns['filters'].codes, codes)
+        return np.flatnonzero(mask)
+
+    def get_data(self, fields=None, **filters):
+        model = self.model
+        index = self.select(filters)
+
+        # Remove columns where all values are empty or None
+        columns = [column_name for column_name in model.data_columns
+                   if len(index) and self.columns[column_name].has_values(index)]
+        if not columns:
+            return {
+                'data': [],
+                'filters': {}
+            }
+
+        # Facets of the JSON `filters` keys, from the distinct codes of the selection
+        extra_values = {}
+        for code in np.unique(self.columns['filters'].codes[index]).tolist():
+            for key, value in self.extra_filters[code].items():
+                if not model.is_empty(value) and not isinstance(value, (list, dict)):
+                    extra_values.setdefault(key, set()).add(value)
+        extra_values = {key: sorted(values, key=str) for key, values in extra_values.items()}
+
+        # Retrieve unique values for every facet column left in the result
+        unique_values = {column_name: self.columns[column_name].unique(index)
+                         for column_name in columns if column_name not in model.exclude_column}
+        unique_values.update(extra_values)
+
+        # Project onto `fields` only now, facets cover the whole selection
+        if fields:
+            columns = [column_name for column_name in columns if column_name in fields]
+            extra_values = {key: values for key, values in extra_values.items() if key in fields}
+
+        # Build the rows column by column
+        values = [self.columns[column_name].take(index) for column_name in columns]
+        filter_codes = self.columns['filters'].codes[index].tolist()
+        result = []
+        for row, code in zip(zip(*values), filter_codes):
+            entry = dict(zip(columns, row))
+            if code:
+                entry.update((key, value) for key, value in self.extra_filters[code].items() if key in extra_values)
+            result.append(entry)
+
+        return {
+            'data': result,
+            'filters': {key: value for key, value in unique_values.items() if value}
+        }
+
+
+    def aggregate(self, group_by, measures, **filters):
+        """Same result as BaseModel.aggregate(), from grouped bincounts over the encoded columns."""
+        index = self.select(filters)
+        values = self.columns['indicator_value'].values[index]
+        valid = ~np.isnan(values)
+
+        if group_by:
+            codes = np.stack([self.columns[column_name].codes[index].astype(np.int64) for column_name in group_by],
+                             axis=1)
+            keys, groups = np.unique(codes, axis=0, return_inverse=True)
+            groups = groups.reshape(-1)
+        else:
+            # A single group over the whole selection, even an empty one (like SQL without GROUP BY)
+            keys, groups = np.zeros((1, 0), dtype=np.int64), np.zeros(len(index), dtype=np.int64)
+
+        count = np.bincount(groups, weights=valid, minlength=len(keys)).astype(np.int64)
+        total = np.bincount(groups, weights=np.where(valid, values, 0), minlength=len(keys))
+        computed = {'count': count, 'sum': total, 'avg': total / np.maximum(count, 1)}
+        for measure, reduce, start in (('min', np.minimum, np.inf), ('max', np.maximum, -np.inf)):
+            if measure in measures:
+                computed[measure] = np.full(len(keys), start)
+                reduce.at(computed[measure], groups[valid], values[valid])
+
+        result = {column_name: self.columns[column_name].categories[keys[:, i]].tolist()
+                  for i, column_name in enumerate(group_by)}
+        for measure in measures:
+            if measure == 'count':
+                result[measure] = count.tolist()
+            else:
+                result[measure] = [value if n else None for value, n in zip(computed[measure].tolist(), count)]
+
+        # Groups come out in code order; sort them by value like ORDER BY (NULL first, as on SQLite)
+        order = sorted(range(len(keys)),
+                       key=lambda g: [(result[column_name][g] is not None, result[column_name][g] or '')
+                                      for column_name in group_by])
+        return {name: [column[g] for g in order] for name, column in result.items()}
+
+    def select_bbox(self, bbox, filters):
+        """Indexes of the selected rows inside bbox = (west, south, east, north), in id order."""
+        west, south, east, north = bbox
+        index = self.select(filters)
+        latitude = self.columns['latitude'].values[index]
+        longitude = self.columns['longitude'].values[index]
+        if west > east:
+            inside_lon = (longitude >= west) | (longitude <= east)
+        else:
+            inside_lon = (longitude >= west) & (longitude <= east)
+        # NaN (no location) compares False everywhere
+        return index[(latitude >= south) & (latitude <= north) & inside_lon]
+
+    def get_points(self, bbox, names, limit, **filters):
+        """Same result as BaseModel.get_points()."""
+        index = self.select_bbox(bbox, filters)
+        if limit:
+            index = index[:limit]
+        return {name: self.columns[name].take(index) for name in names}
+
+    def get_clusters(self, bbox, cell_size, **filters):
+        """Same result as BaseModel.get_clusters(), from np.unique over the cell of each point."""
+        index = self.select_bbox(bbox, filters)
+        latitude = self.columns['latitude'].values[index]
+        longitude = self.columns['longitude'].values[index]
+        cells = np.stack([np.floor((latitude + 90) / cell_size), np.floor((longitude + 180) / cell_size)],
+                         axis=1).astype(np.int64)
+        keys, groups = np.unique(cells.reshape(-1, 2), axis=0, return_inverse=True)
+        groups = groups.reshape(-1)
+
+        count = np.bincount(groups, minlength=len(keys))
+        values = self.columns['indicator_value'].values[index]
+        valid = ~np.isnan(values)
+        valued = np.bincount(groups, weights=valid, minlength=len(keys))
+        total = np.bincount(groups, weights=np.where(valid, values, 0), minlength=len(keys))
+        return {
+            'cell_lat': keys[:, 0].tolist(),
+            'cell_lon': keys[:, 1].tolist(),
+            'count': count.tolist(),
+            'latitude': (np.bincount(groups, weights=latitude, minlength=len(keys)) / count).tolist(),
+            'longitude': (np.bincount(groups, weights=longitude, minlength=len(keys)) / count).tolist(),
+            'indicator_value': [value if n else None for value, n in zip((total / np.maximum(valued, 1)).tolist(),
+                                                                         valued)],
+        }
+
+
+class SnapshotStore():
+    """
+       Holds the current snapshot of each table. Readers grab a reference
+       and never block; reloads build a new snapshot off to the side and
+       replace the reference in one assignment.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, model):
+        snapshot = self._snapshots.get(model.__tablename__)
+        if snapshot is None:
+            # Not loaded yet in this process (e.g. a request before start())
+            snapshot = self.reload(model)
+        return snapshot
+
+    def reload(self, model, version=None):
+        with self._lock:
+            if version is None:
+                version = DataVersion.get_versions().get(model.__tablename__, 0)
+            snapshot = TableSnapshot(model, version)
+            self._snapshots[model.__tablename__] = snapshot
+            return snapshot
+
+    def refresh(self, models):
+        """Reloads every table whose data_version moved since its snapshot was taken."""
+        versions = DataVersion.get_versions()
+        for model in models:
+            version = versions.get(model.__tablename__, 0)
+            snapshot = self._snapshots.get(model.__tablename__)
+            if snapshot is None or snapshot.version != version:
+                self.reload(model, version)
+        db.session.remove()
+
+    def start(self, app, models):
+        """Loads every table now and keeps them fresh from a daemon thread."""
+        self.refresh(models)
+        if self._thread is not None:
+            return
+
+        def poll():
+            while True:
+                time.sleep(app.config.get('DATA_VERSION_POLL_SECONDS', 2))
+                try:
+                    with app.app_context():
+                        self.refresh(models)
+                except Exception as e:
+                    print('> Error: snapshot reload failed: ' + str(e))
+
+        self._thread = threading.Thread(target=poll, name='columnar-snapshots', daemon=True)
+        self._thread.start()
+
+
+snapshots = SnapshotStore()
@@ -1,6 +1,8 @@
 import os, random, string
 from datetime import timedelta
 
+from sqlalchemy.pool import QueuePool
+
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
 class BaseConfig():
@@ -22,6 +24,97 @@ class BaseConfig():
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Create/upgrade the schema on the first request instead of with `flask migrate` (development only)
+    AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', '0') == '1'
+
+    # token_required fast path: users are cached this long, revocations synced from the
+    # blocklist this often (or shared at once through a Redis set), expired rows purged hourly
+    AUTH_USER_CACHE_TTL          = float(os.getenv('AUTH_USER_CACHE_TTL', 30))
+    AUTH_REVOCATION_SYNC_SECONDS = float(os.getenv('AUTH_REVOCATION_SYNC_SECONDS', 5))
+    AUTH_PURGE_INTERVAL_SECONDS  = float(os.getenv('AUTH_PURGE_INTERVAL_SECONDS', 3600))
+    AUTH_REVOCATION_URL          = os.getenv('AUTH_REVOCATION_URL', None)
+
+    # No "did you mean" suggestions on API 404s: errors carry only the {"success", "msg"} envelope,
+    # and matching the path against every rule is wasted work on 404-heavy traffic
+    RESTX_ERROR_404_HELP = False
+
+    # Server-Timing headers and Prometheus metrics at /metrics; PROFILING_ENABLED lets a request
+    # with `X-Profile: 1` (cProfile) or `X-Profile: pyinstrument` get its profile back (keep it off in public)
+    METRICS_ENABLED   = os.getenv('METRICS_ENABLED', '1') == '1'
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+
+    # /api/query-data keyset pages: default and maximum `limit`
+    QUERY_PAGE_SIZE     = int(os.getenv('QUERY_PAGE_SIZE', 1000))
+    QUERY_PAGE_MAX_SIZE = int(os.getenv('QUERY_PAGE_MAX_SIZE', 10000))
+
+    # Rows fetched per server-side cursor round trip when /api/query-data streams
+    STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1000))
+
+    # How often a worker re-reads the data_version table to notice writes made by other processes
+    DATA_VERSION_POLL_SECONDS = float(os.getenv('DATA_VERSION_POLL_SECONDS', 2))
+
+    # 'sql' queries the database per request; 'columnar' answers get_data, aggregates and map
+    # queries from in-memory NumPy snapshots of the sector tables (requires numpy). Streamed
+    # (?stream=) and paged (limit/after_id/cursor) /api/query-data responses still read through
+    # SQL, so a cursor sees writes at once rather than after the next snapshot reload
+    DATA_ENGINE = os.getenv('DATA_ENGINE', 'sql')
+
+    # 'tables' keeps one table per sector; 'unified' serves every sector from the fact_data
+    # table (fill it with `flask unify-sectors`), where any sector in the `sectors` registry
+    # is valid and requests without a sector span all of them
+    DATA_STORAGE = os.getenv('DATA_STORAGE', 'tables')
+
+    # /api/search: default and maximum number of results
+    SEARCH_LIMIT     = int(os.getenv('SEARCH_LIMIT', 20))
+    SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 100))
+
+    # /api/map-points: below MAP_CLUSTER_MAX_ZOOM points are clustered on a grid of MAP_CLUSTER_GRID
+    # cells per tile width, and so is any view holding more than MAP_MAX_POINTS
+    MAP_CLUSTER_MAX_ZOOM = int(os.getenv('MAP_CLUSTER_MAX_ZOOM', 11))
+    MAP_CLUSTER_GRID     = int(os.getenv('MAP_CLUSTER_GRID', 4))
+    MAP_MAX_POINTS       = int(os.getenv('MAP_MAX_POINTS', 5000))
+
+    # /api/query-data response cache: 'memory' (per process, bounded by entry count and body bytes),
+    # 'redis' (shared, RESULT_CACHE_URL, bounded by the server's maxmemory) or 'none'
+    RESULT_CACHE_BACKEND     = os.getenv('RESULT_CACHE_BACKEND', 'memory')
+    RESULT_CACHE_URL         = os.getenv('RESULT_CACHE_URL', 'redis://localhost:6379/0')
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 256))
+    RESULT_CACHE_MAX_BYTES   = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    RESULT_CACHE_TTL         = int(os.getenv('RESULT_CACHE_TTL', 300))
+
+    # /api/chat: 'gemini' or 'fake' (offline FakeGeminiClient for tests and benchmarks)
+    CHAT_CLIENT = os.getenv('CHAT_CLIENT', 'gemini')
+    CHAT_MODEL  = os.getenv('CHAT_MODEL', 'gemini-2.0-flash')
+
+    # Chart queries that name a series of the hub are drawn from its data, the model only writes a template
+    CHAT_GROUNDED = os.getenv('CHAT_GROUNDED', '1') == '1'
+
+    # Offline client latency in seconds (load tests only)
+    CHAT_FAKE_LATENCY = float(os.getenv('CHAT_FAKE_LATENCY', 0))
+
+    # Upstream calls run on small bounded pools; beyond the limit requests get a 503, past the timeout a 504.
+    # Requests waiting on an identical chat prompt already in flight are capped too (503 past the cap)
+    CHAT_MAX_CONCURRENCY  = int(os.getenv('CHAT_MAX_CONCURRENCY', 4))
+    CHAT_MAX_FOLLOWERS    = int(os.getenv('CHAT_MAX_FOLLOWERS', 4))
+    CHAT_TIMEOUT          = float(os.getenv('CHAT_TIMEOUT', 30))
+    OAUTH_MAX_CONCURRENCY = int(os.getenv('OAUTH_MAX_CONCURRENCY', 8))
+    OAUTH_TIMEOUT         = float(os.getenv('OAUTH_TIMEOUT', 10))
+
+    GITHUB_TOKEN_URL    = os.getenv('GITHUB_TOKEN_URL', 'https://github.com/login/oauth/access_token')
+    GITHUB_USER_URL     = os.getenv('GITHUB_USER_URL', 'https://api.github.com/user')
+    GOOGLE_TOKEN_URL    = os.getenv('GOOGLE_TOKEN_URL', 'https://oauth2.googleapis.com/token')
+    GOOGLE_USERINFO_URL = os.getenv('GOOGLE_USERINFO_URL', 'https://www.googleapis.com/oauth2/v2/userinfo')
+
+    # Serve a cached chart for a query whose word-shingle similarity to a cached one is at least this (1 = exact only)
+    CHAT_CACHE_SIMILARITY = float(os.getenv('CHAT_CACHE_SIMILARITY', 1.0))
+
+    # Append every /api/query-data filter combination here (JSON lines) for `flask index-advisor`
+    QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH', None)
+
+    # Write the query log this many lines at a time, or this many seconds after the first buffered line
+    QUERY_LOG_BATCH         = int(os.getenv('QUERY_LOG_BATCH', 100))
+    QUERY_LOG_FLUSH_SECONDS = float(os.getenv('QUERY_LOG_FLUSH_SECONDS', 10))
+
     DB_ENGINE   = os.getenv('DB_ENGINE'   , None)
     DB_USERNAME = os.getenv('DB_USERNAME' , None)
     DB_PASS     = os.getenv('DB_PASS'     , None)
@@ -56,4 +149,54 @@ class BaseConfig():
     if USE_SQLITE:
 
         # This will create a file in <app> FOLDER
-        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'data.db')
\ No newline at end of file
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'data.db')
+
+    # An explicit URI (e.g. a scratch SQLite file for benchmarks) wins over the settings above
+    SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI', SQLALCHEMY_DATABASE_URI)
+
+    # Connection pooling. SQLite gets a small pool of long-lived WAL-mode connections
+    # (SQLITE_PRAGMAS are applied once per new connection, see models.py); a DBMS gets a
+    # pool sized for gunicorn's threads, checked on checkout and recycled before server timeouts
+    DB_POOL_SIZE    = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'temp_store': 'memory',
+        'mmap_size': 134217728
+    }
+
+    # Flask-SQLAlchemy would pick NullPool (a new connection per checkout) for SQLite files
+    SQLITE_ENGINE_OPTIONS = {
+        'poolclass': QueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'connect_args': {'check_same_thread': False}
+    }
+
+    DBMS_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_pre_ping': True,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_timeout': 10
+    }
+
+    if SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        SQLALCHEMY_ENGINE_OPTIONS = SQLITE_ENGINE_OPTIONS
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = DBMS_ENGINE_OPTIONS
+
+    # Read replicas for the data tables, comma-separated: PostgreSQL standbys or read-only copies of the
+    # SQLite file (sqlite:///file:/srv/replica.db?mode=ro&uri=true, or immutable=1 for a copy that never
+    # changes while it is served). Users, tokens and all writes stay on SQLALCHEMY_DATABASE_URI
+    DB_REPLICA_URIS = [uri.strip() for uri in os.getenv('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+
+    # Replicas are health-checked this often; a PostgreSQL standby more than DB_REPLICA_MAX_LAG
+    # seconds behind is skipped like a failed one until it catches up
+    DB_REPLICA_CHECK_SECONDS = float(os.getenv('DB_REPLICA_CHECK_SECONDS', 5))
+    DB_REPLICA_MAX_LAG       = float(os.getenv('DB_REPLICA_MAX_LAG', 30))
@@ -0,0 +1,163 @@
+# -*- encoding: utf-8 -*-
+"""
+   Response encoding for the data endpoints.
+
+   JSON goes through orjson (a requirement; the stdlib json module is only
+   a fallback for environments without it). /api/query-data and
+   /api/aggregate negotiate the format from `?format=` or the Accept header:
+
+     json     application/json                       the regular document
+     columns  application/vnd.cdri.columns+json      {"columns": {name: [values]}, ...}
+     msgpack  application/msgpack                    the columns document, MessagePack
+     arrow    application/vnd.apache.arrow.stream    Arrow IPC stream, metadata in the schema
+     parquet  application/vnd.apache.parquet         Parquet file (zstd), metadata in the schema
+
+   and the content encoding (br, gzip) from Accept-Encoding. pyarrow,
+   msgpack and brotli are optional and imported on first use.
+"""
+
+import gzip, io, json
+from decimal import Decimal
+
+from flask import make_response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FORMATS = {
+    'json': 'application/json',
+    'columns': 'application/vnd.cdri.columns+json',
+    'msgpack': 'application/msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def default(value):
+    # NUMERIC aggregates come back as Decimal on PostgreSQL
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """obj as UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default).encode('utf-8')
+
+
+def output_json(data, code, headers=None):
+    """flask-restx representation for application/json, using dumps()."""
+    response = make_response(dumps(data), code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+    return response
+
+
+def negotiate_format(request):
+    """The requested format name, or None if the client asked for one we do not have."""
+    requested = request.args.get('format')
+    if requested:
+        return requested if requested in FORMATS else None
+
+    best = request.accept_mimetypes.best_match(list(FORMATS.values()), default=FORMATS['json'])
+    return {mimetype: name for name, mimetype in FORMATS.items()}[best]
+
+
+def negotiate_encoding(request, format_name):
+    """'br', 'gzip' or None. Parquet is compressed internally already."""
+    if format_name == 'parquet':
+        return None
+
+    accepted = request.accept_encodings
+    if accepted['br'] and accepted['br'] >= accepted['gzip']:
+        try:
+            import brotli  # noqa: F401
+            return 'br'
+        except ImportError:
+            pass
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def rows_to_columns(rows):
+    """[{name: value}] -> {name: [values]}; rows without a key (extra dimensions) get None."""
+    names = {}
+    for row in rows:
+        for name in row:
+            names.setdefault(name, None)
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def arrow_table(columns, meta):
+    import pyarrow as pa
+
+    arrays = {}
+    for name, values in columns.items():
+        try:
+            array = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Extra dimensions can mix types across rows; fall back to text
+            array = pa.array([None if value is None else str(value) for value in values], pa.string())
+        # Dimension columns repeat a handful of values; send each once
+        arrays[name] = array.dictionary_encode() if pa.types.is_string(array.type) else array
+
+    table = pa.table(arrays) if arrays else pa.table({})
+    return table.replace_schema_metadata({'cdri': dumps(meta)})
+
+
+def encode_columns(columns, meta, format_name):
+    """
+       Encodes a column-oriented result: `columns` is {name: [values]},
+       `meta` the rest of the document (facets, group_by, ...).
+    """
+    if format_name in ('json', 'columns'):
+        return dumps(dict(meta, columns=columns))
+
+    if format_name == 'msgpack':
+        import msgpack
+        return msgpack.packb(dict(meta, columns=columns), default=default)
+
+    table = arrow_table(columns, meta)
+    sink = io.BytesIO()
+    if format_name == 'arrow':
+        import pyarrow as pa
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table, sink, compression='zstd')
+    return sink.getvalue()
+
+
+def encode_data(result, format_name):
+    """Encodes a get_data() result: rows as objects for json, columns for every other format."""
+    if format_name == 'json':
+        return dumps(result)
+    return encode_columns(rows_to_columns(result['data']), {'filters': result['filters']}, format_name)
+
+
+def compress(body, content_encoding):
+    """
+       Always compresses when asked, even tiny bodies, so the encoding of a
+       cached body follows from its cache key alone.
+    """
+    if content_encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=5)
+    if content_encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def make_data_response(body, format_name, content_encoding):
+    response = make_response(body)
+    response.mimetype = FORMATS[format_name]
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+"""
+   Error responses of the API.
+
+   Every error raised under rest_api (payload validation, abort(), 404/405
+   on API routes, unhandled exceptions) is answered with the same
+   {"success": False, "msg"} envelope the resources return themselves, and
+   so are 404/405 on the app's other paths (init_app). The envelope is
+   built from the exception, so no response body is ever parsed again
+   after the fact.
+"""
+
+from http import HTTPStatus
+
+from flask_restx import Api
+from werkzeug.exceptions import HTTPException
+
+
+def error_message(e):
+    """The `msg` for exception `e`: the first validation error, else its description."""
+    data = getattr(e, 'data', None)
+    if isinstance(data, dict):
+        if data.get('errors'):
+            return list(data['errors'].values())[0]
+        if 'msg' in data:
+            return data['msg']
+        if 'message' in data:
+            return data['message']
+
+    if isinstance(e, HTTPException):
+        return e.description or HTTPStatus(e.code).phrase
+    return HTTPStatus.INTERNAL_SERVER_ERROR.phrase
+
+
+class EnvelopeApi(Api):
+    """
+       flask-restx Api whose error responses use the {"success", "msg"}
+       envelope. Bodies are produced by the API's own representations, so
+       they are serialized once, and successful (large or streamed)
+       responses are never touched.
+    """
+
+    def handle_error(self, e):
+        data = getattr(e, 'data', None)
+        if not (isinstance(data, dict) and data.get('success') is False):
+            try:
+                e.data = {"success": False, "msg": error_message(e)}
+            except AttributeError:
+                # Exceptions with __slots__; Api falls back to {"message"}
+                pass
+        return super().handle_error(e)
+
+
+def init_app(app):
+    """Answers 404 and 405 outside rest_api's resources (e.g. /nope) with the envelope too."""
+
+    @app.errorhandler(404)
+    @app.errorhandler(405)
+    def envelope_error(e):
+        headers = {'Allow': ', '.join(e.valid_methods)} if getattr(e, 'valid_methods', None) else None
+        return {"success": False, "msg": error_message(e)}, e.code, headers
@@ -0,0 +1,160 @@
+# -*- encoding: utf-8 -*-
+"""
+   Precomputed facet counts for cascading filters (/api/facets).
+
+   For every table, each prefix of the sector > subsector_1 > subsector_2 >
+   series_name hierarchy maps to its row count, the non-empty values of
+   each data column, the values (and row counts) of the deeper hierarchy
+   levels and of every facet: the facet columns of get_data and the extra
+   dimensions. A few GROUP BY queries build it and it is held in memory,
+   rebuilt per table when its data_version moves (an ingest, an ORM
+   write), so dropdowns and their counts are answered without touching
+   the data rows. select_data() also takes its columns
+   and facet values from here when a selection only filters on the
+   hierarchy.
+"""
+
+import json, threading
+from collections import Counter, defaultdict
+
+from sqlalchemy import func, select
+
+from .caching import data_versions
+from .models import db
+
+HIERARCHY = ['sector', 'subsector_1', 'subsector_2', 'series_name']
+
+
+class Node():
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = Counter()
+        self.values = defaultdict(Counter)
+        self.facets = defaultdict(Counter)
+        self.extra = defaultdict(Counter)
+
+
+class FacetIndex():
+    """The facet counts of one table, by hierarchy prefix."""
+
+    def __init__(self, model, version):
+        self.model = model
+        self.version = version
+        self.facet_columns = [column_name for column_name in model.data_columns
+                              if column_name not in model.exclude_column]
+        # levels[depth][(sector, ...)] for the prefixes of `depth` hierarchy values
+        self.levels = [defaultdict(Node) for _ in range(len(HIERARCHY) + 1)]
+
+        path = [getattr(model, column_name) for column_name in HIERARCHY]
+        count = func.count()
+
+        query = select(*path, count, *model.non_empty_counts()) \
+            .select_from(model.from_clause(model.data_columns)) \
+            .group_by(*path)
+        for row in db.session.execute(query):
+            self.add_rows(row[:len(path)], row[len(path)], row[len(path) + 1:])
+
+        for column_name in self.facet_columns:
+            column = getattr(model, column_name)
+            query = select(*path, column, count) \
+                .select_from(model.from_clause(HIERARCHY + [column_name])) \
+                .group_by(*path, column)
+            for row in db.session.execute(query):
+                self.add_facet(row[:len(path)], column_name, row[-2], row[-1])
+
+        dimensions = model.dimensions
+        query = select(*path, dimensions.c.key, dimensions.c.value, count) \
+            .select_from(model.from_clause(HIERARCHY).join(dimensions, model.id == dimensions.c.row_id)) \
+            .group_by(*path, dimensions.c.key, dimensions.c.value)
+        for row in db.session.execute(query):
+            value = json.loads(row[-2]) if row[-2] else None
+            if not isinstance(value, (list, dict)):
+                self.add_facet(row[:len(path)], row[-3], value, row[-1], extra=True)
+
+    def add_rows(self, path, count, non_empty):
+        for depth in range(len(HIERARCHY) + 1):
+            node = self.levels[depth][tuple(path[:depth])]
+            node.rows += count
+            node.columns.update(dict(zip(self.model.data_columns, non_empty)))
+            for column_name, value in zip(HIERARCHY[depth:], path[depth:]):
+                if not self.model.is_empty(value):
+                    node.values[column_name][value] += count
+
+    def add_facet(self, path, name, value, count, extra=False):
+        if self.model.is_empty(value):
+            return
+        for depth in range(len(HIERARCHY) + 1):
+            node = self.levels[depth][tuple(path[:depth])]
+            (node.extra if extra else node.facets)[name][value] += count
+
+    @staticmethod
+    def covers(filters):
+        """Whether a filter set only selects along the hierarchy (what this index can answer)."""
+        return all(key in HIERARCHY for key, value in filters.items() if value)
+
+    def lookup(self, filters):
+        """
+           The Node of the rows matching `filters` (hierarchy columns only).
+           A prefix of the hierarchy is one dictionary lookup; skipping a
+           level (a series without its subsectors) merges the matching nodes.
+        """
+        wanted = [filters.get(column_name) or None for column_name in HIERARCHY]
+        depth = max([i + 1 for i, value in enumerate(wanted) if value is not None], default=0)
+        if None not in wanted[:depth]:
+            return self.levels[depth].get(tuple(wanted[:depth])) or Node()
+
+        merged = Node()
+        for path, node in self.levels[depth].items():
+            if all(value is None or value == part for value, part in zip(wanted, path)):
+                merged.rows += node.rows
+                merged.columns.update(node.columns)
+                # The skipped levels are still choices, e.g. the subsectors a series appears in
+                for column_name, value, part in zip(HIERARCHY, wanted, path):
+                    if value is None and not self.model.is_empty(part):
+                        merged.values[column_name][part] += node.rows
+                for source, target in ((node.values, merged.values), (node.facets, merged.facets),
+                                       (node.extra, merged.extra)):
+                    for name, counts in source.items():
+                        target[name].update(counts)
+        return merged
+
+    def describe(self, filters):
+        """/api/facets document: row count, hierarchy levels left to pick and facets, each [{value, count}]."""
+        node = self.lookup(filters)
+        # Extra dimensions win over a column of the same name, as in get_data
+        facets = dict(node.facets, **node.extra)
+        return {
+            'rows': node.rows,
+            'levels': {column_name: value_counts(node.values[column_name])
+                       for column_name in HIERARCHY if not filters.get(column_name) and node.values.get(column_name)},
+            'facets': {name: value_counts(counts) for name, counts in sorted(facets.items()) if counts},
+        }
+
+
+def value_counts(counts):
+    """[{value, count}] sorted by value as in get_data's facets."""
+    return [{'value': value, 'count': counts[value]} for value in sorted(counts, key=str)]
+
+
+class FacetStore():
+    """The FacetIndex of each table, rebuilt when the table's data_version moves."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def get(self, model):
+        version = dict(data_versions.stamp([model.__tablename__]))[model.__tablename__]
+        index = self._indexes.get(model.__tablename__)
+        if index is not None and index.version == version:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(model.__tablename__)
+            if index is None or index.version != version:
+                index = self._indexes[model.__tablename__] = FacetIndex(model, version)
+            return index
+
+
+facet_store = FacetStore()
@@ -0,0 +1,317 @@
+# -*- encoding: utf-8 -*-
+"""
+   Bulk loader for the sector tables and the unified fact table (`flask ingest`).
+
+   Files are read in chunks (CSV, Excel, Parquet), validated and coerced with
+   vectorized pandas operations and upserted on a natural key with one bulk
+   statement per chunk: INSERT ... ON CONFLICT on SQLite, COPY into a temp
+   table + INSERT ... ON CONFLICT on PostgreSQL. Each chunk commits together
+   with its checkpoint, so an interrupted load resumes where it stopped.
+"""
+
+import hashlib, io, json, os, time
+from datetime import datetime
+
+from sqlalchemy import select, text
+
+from .models import db, DataVersion, IngestCheckpoint
+
+# Columns of the natural key: one observation of one series
+KEY_COLUMNS = ['series_code', 'series_name', 'subsector_1', 'subsector_2', 'province', 'year', 'indicator', 'filters']
+
+STRING_COLUMNS = ['province', 'series_name', 'indicator', 'series_code', 'sector', 'subsector_1', 'subsector_2',
+                  'source', 'indicator_unit', 'tag']
+
+LOAD_COLUMNS = STRING_COLUMNS + ['indicator_value', 'year', 'latitude', 'longitude', 'filters', 'row_key']
+
+
+def import_pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise RuntimeError("flask ingest requires pandas (and pyarrow for Parquet, openpyxl for Excel)")
+    return pandas
+
+
+def file_fingerprint(path):
+    """Identifies one version of a source file without reading it."""
+    stat = os.stat(path)
+    key = f'{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def read_chunks(path, chunk_size, file_format=None):
+    """Yields DataFrames of at most `chunk_size` rows, every cell as a string."""
+    pd = import_pandas()
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+
+    if file_format in ('csv', 'txt'):
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+    elif file_format == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas().astype('string')
+
+    elif file_format in ('xlsx', 'xls'):
+        # Excel has no streaming reader; load the sheet once and slice it
+        frame = pd.read_excel(path, dtype=str, keep_default_na=False)
+        for start in range(0, len(frame), chunk_size):
+            yield frame.iloc[start:start + chunk_size]
+
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+
+def coerce_chunk(frame, sector=None):
+    """
+       Validates and coerces one chunk. Columns the model does not have are
+       folded into the `filters` JSON as extra dimensions. Returns
+       (rows as dicts, number of rejected rows).
+    """
+    pd = import_pandas()
+
+    frame = frame.rename(columns=lambda name: str(name).strip().lower().replace(' ', '_'))
+    frame = frame.drop(columns=[name for name in ('id', 'row_key') if name in frame])
+    frame = frame.astype('string').apply(lambda column: column.str.strip()).replace('', pd.NA)
+
+    out = pd.DataFrame(index=frame.index)
+    for column in STRING_COLUMNS:
+        out[column] = frame[column] if column in frame else pd.Series(pd.NA, index=frame.index, dtype='string')
+    if sector:
+        out['sector'] = out['sector'].fillna(sector)
+
+    # year: four digits ("2019" or "2019.0"); anything else rejects the row
+    raw_year = frame['year'] if 'year' in frame else pd.Series(pd.NA, index=frame.index, dtype='string')
+    out['year'] = raw_year.str.extract(r'^(\d{4})(?:\.0*)?$', expand=False)
+    invalid = raw_year.notna() & out['year'].isna()
+
+    # indicator_value: float; unparseable values reject the row
+    raw_value = frame['indicator_value'] if 'indicator_value' in frame else pd.Series(pd.NA, index=frame.index)
+    out['indicator_value'] = pd.to_numeric(raw_value, errors='coerce')
+    invalid |= raw_value.notna() & out['indicator_value'].isna()
+
+    # latitude/longitude: numeric and in range, otherwise dropped to NULL
+    for column, limit in (('latitude', 90), ('longitude', 180)):
+        raw = frame[column] if column in frame else pd.Series(pd.NA, index=frame.index)
+        numeric = pd.to_numeric(raw, errors='coerce')
+        out[column] = numeric.where(numeric.abs() <= limit)
+
+    invalid |= out['series_name'].isna()
+
+    # Without an explicit `filters` column, extra columns become the `filters` JSON
+    extra_columns = [column for column in frame.columns if column not in out.columns and column != 'filters']
+    if 'filters' in frame:
+        out['filters'] = frame['filters']
+    elif extra_columns:
+        extras = frame[extra_columns].astype(object).where(frame[extra_columns].notna(), None)
+        out['filters'] = [json.dumps({key: value for key, value in row.items() if value is not None}, sort_keys=True)
+                          for row in extras.to_dict('records')]
+        out['filters'] = out['filters'].replace('{}', None)
+    else:
+        out['filters'] = None
+
+    out = out[~invalid]
+
+    keys = out[KEY_COLUMNS].astype('string').fillna('\x00')
+    key_parts = keys[KEY_COLUMNS[0]].str.cat([keys[column] for column in KEY_COLUMNS[1:]], sep='\x1f')
+    out['row_key'] = [hashlib.sha1(key.encode('utf-8')).hexdigest() for key in key_parts]
+
+    out = out.astype(object).where(out.notna(), None)
+
+    return out[LOAD_COLUMNS].to_dict('records'), int(invalid.sum())
+
+
+def upsert_rows(connection, model, rows):
+    """
+       Inserts `rows`, replacing existing rows with the same row_key. When
+       the chunk itself repeats a row_key the last row wins, as it would
+       across chunks (PostgreSQL's ON CONFLICT refuses to touch a row twice
+       in one statement). Returns the rows as written to the model's
+       storage table.
+    """
+    table, rows = model.load_rows(connection, rows)
+    rows = list({row['row_key']: row for row in rows}.values())
+    columns = list(rows[0])
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        copy_upsert(connection, table, columns, rows)
+
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['row_key'],
+            set_={column: statement.excluded[column] for column in columns if column != 'row_key'})
+        connection.execute(statement, rows)
+
+    else:
+        keys = [row['row_key'] for row in rows]
+        connection.execute(table.delete().where(table.c.row_key.in_(keys)))
+        connection.execute(table.insert(), rows)
+
+    return rows
+
+
+def copy_field(value):
+    """
+       One field of COPY's csv format. NULL is the unquoted \\N; every
+       string is quoted, so an empty string (or a literal \\N) stays a string.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def copy_buffer(rows, columns):
+    """The COPY ... FROM STDIN WITH (FORMAT csv, NULL '\\N') input of `rows`."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(copy_field(row[column]) for column in columns) + '\n')
+    buffer.seek(0)
+    return buffer
+
+
+def copy_upsert(connection, table, columns, rows):
+    """PostgreSQL: COPY the chunk into a temp table, then one INSERT ... ON CONFLICT."""
+    staging = f'staging_{table.name}'
+    column_list = ', '.join(columns)
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns if column != 'row_key')
+
+    connection.exec_driver_sql(
+        f'CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                       copy_buffer(rows, columns))
+
+    connection.exec_driver_sql(
+        f'INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging} '
+        f'ON CONFLICT (row_key) DO UPDATE SET {updates}')
+
+
+def ingest_file(path, model, chunk_size=5000, file_format=None, sector=None, resume=True, report=print):
+    """
+       Loads `path` into `model`'s table. Returns a summary dict with the
+       number of rows loaded and rejected and the overall rows/sec.
+    """
+    fingerprint = file_fingerprint(path)
+    checkpoint = IngestCheckpoint.get_latest(fingerprint, model.__tablename__) if resume else None
+
+    if checkpoint is not None and checkpoint.completed:
+        report(f"{path} was already loaded into {model.__tablename__}; nothing to do")
+        return {"rows": 0, "rejected": 0, "seconds": 0.0, "rows_per_second": 0.0}
+
+    if checkpoint is None:
+        checkpoint = IngestCheckpoint(source=os.path.abspath(path), fingerprint=fingerprint,
+                                      table_name=model.__tablename__, rows_done=0, chunks_done=0)
+        checkpoint.save()
+    elif checkpoint.rows_done:
+        report(f"Resuming {path} after row {checkpoint.rows_done}")
+
+    started = time.perf_counter()
+    loaded = rejected = offset = 0
+
+    for frame in read_chunks(path, chunk_size, file_format):
+        start, offset = offset, offset + len(frame)
+
+        # Skip whatever an earlier run already committed
+        if offset <= checkpoint.rows_done:
+            continue
+        frame = frame.iloc[max(checkpoint.rows_done - start, 0):]
+
+        chunk_started = time.perf_counter()
+        rows, chunk_rejected = coerce_chunk(frame, sector)
+
+        connection = db.session.connection()
+        if rows:
+            written = upsert_rows(connection, model, rows)
+            model.sync_dimensions([model.row_key.in_([row['row_key'] for row in written])], connection=connection)
+            # Readers see the chunk as soon as it commits
+            DataVersion.bump([model.__tablename__], connection=connection)
+
+        checkpoint.rows_done = offset
+        checkpoint.chunks_done += 1
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        loaded += len(rows)
+        rejected += chunk_rejected
+        elapsed = time.perf_counter() - chunk_started
+        report(f"chunk {checkpoint.chunks_done}: {len(rows)} rows ({chunk_rejected} rejected) "
+               f"in {elapsed:.2f}s, {len(rows) / elapsed if elapsed else 0:.0f} rows/s")
+
+    checkpoint.completed = True
+    db.session.commit()
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": loaded,
+        "rejected": rejected,
+        "seconds": round(seconds, 2),
+        "rows_per_second": round(loaded / seconds, 1) if seconds else 0.0
+    }
+
+
+def unify_tables(sectors, chunk_size=5000, report=print):
+    """
+       Copies the per-sector tables into the unified fact table (`flask
+       unify-sectors`). `sectors` maps each sector name to its model; the
+       rows of a table are filed under that name, as the API serves them.
+       Rows are upserted on their row_key (rows loaded without one are keyed
+       by their source table and id, as several may share a natural key), so
+       running it again refreshes the copy instead of duplicating it.
+       Returns the number of rows copied.
+    """
+    from .models import FactData
+
+    total = 0
+    for name, model in sectors.items():
+        started = time.perf_counter()
+        copied, last_id = 0, 0
+        columns = [getattr(model, column) for column in LOAD_COLUMNS]
+
+        while True:
+            chunk = db.session.execute(select(model.id, *columns)
+                                       .where(model.id > last_id)
+                                       .order_by(model.id)
+                                       .limit(chunk_size)).all()
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+
+            rows = []
+            for row in chunk:
+                row_id, row = row[0], dict(zip(LOAD_COLUMNS, row[1:]), sector=name)
+                if not row['row_key']:
+                    row['row_key'] = hashlib.sha1(f'{model.__tablename__}:{row_id}'.encode('utf-8')).hexdigest()
+                rows.append(row)
+
+            connection = db.session.connection()
+            written = upsert_rows(connection, FactData, rows)
+            FactData.sync_dimensions([FactData.row_key.in_([row['row_key'] for row in written])],
+                                     connection=connection)
+            DataVersion.bump([FactData.__tablename__], connection=connection)
+            db.session.commit()
+            copied += len(rows)
+
+        report(f"{model.__tablename__} -> {FactData.__tablename__} ({name}): {copied} rows "
+               f"in {time.perf_counter() - started:.2f}s")
+        total += copied
+
+    return total
+
+
+def analyze(models):
+    """Refreshes planner statistics after a load."""
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('ANALYZE'))
+    elif connection.dialect.name == 'postgresql':
+        for model in models:
+            connection.execute(text(f'ANALYZE {model.__tablename__}'))
+    db.session.commit()
+
@@ -0,0 +1,485 @@
+# -*- encoding: utf-8 -*-
+"""
+   Chart generation for /api/chat.
+
+   A query that names a series of the hub is grounded: the series is
+   resolved through the search index, its data read through the aggregate
+   path, and the model only writes a small chart template (cached by chart
+   type and shape, so one serves every series) that the server fills in.
+   Other queries get a whole chart with sample data from the model.
+
+   One model client per process, a chart-config cache keyed on the
+   normalized query (with optional near-duplicate matching on word
+   shingles), single-flight coalescing of identical concurrent prompts and
+   persistence of validated configs and templates in the
+   chart_config_cache table.
+"""
+
+import hashlib, json, re, threading, time
+from collections import defaultdict
+
+from sqlalchemy.exc import IntegrityError
+
+from .config import BaseConfig
+from .models import db, ChartConfigCache
+from .search import series_search
+from .upstream import UpstreamBusy, UpstreamTimeout, upstreams
+
+PROMPT = """
+            You are an expert in generating ECharts configuration code for charts. Based on the user's query, generate an ECharts option object as a valid JSON string, compatible with echarts-for-react. Include sample data since no external data is provided. Return ONLY the JSON object as a string, without markdown (e.g., no ```json or ```), without explanations, and without any extra text or whitespace outside the JSON.
+
+            User Query:
+            {query}
+            """
+
+
+class GeminiClient():
+    """Thin wrapper so the rest of the module does not depend on the SDK."""
+
+    def __init__(self, api_key, model_name):
+        # The SDK alone takes most of the API's import time; load it on the first /api/chat call
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt, request_options={'timeout': BaseConfig.CHAT_TIMEOUT}).text
+
+
+class FakeGeminiClient():
+    """
+       Offline stand-in for tests and benchmarks: answers with a small,
+       deterministic ECharts option (or template, for template prompts)
+       after `latency` seconds and counts calls.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        chart_type = re.search(r'Chart type: (\w+)', prompt)
+        if chart_type:
+            # A template prompt: structure only
+            kind = chart_type.group(1) if chart_type.group(1) in ('line', 'bar', 'pie', 'area', 'scatter') else 'line'
+            template = {"title": {"left": "center"}, "tooltip": {"trigger": "item" if kind == 'pie' else "axis"},
+                        "series": [{"type": kind}]}
+            if kind != 'pie':
+                template.update({"grid": {"containLabel": True}, "xAxis": {"type": "category"},
+                                 "yAxis": {"type": "value"}})
+            return json.dumps(template)
+
+        title = prompt.strip().splitlines()[-1].strip()[:80]
+        return json.dumps({
+            "title": {"text": title},
+            "xAxis": {"type": "category", "data": ["2019", "2020", "2021", "2022"]},
+            "yAxis": {"type": "value"},
+            "series": [{"type": "line", "data": [120, 132, 101, 134]}]
+        })
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_chat_client():
+    """The process-wide model client, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if BaseConfig.CHAT_CLIENT == 'fake':
+                    _client = FakeGeminiClient(latency=BaseConfig.CHAT_FAKE_LATENCY)
+                else:
+                    _client = GeminiClient(BaseConfig.GOOGLE_API_KEY, BaseConfig.CHAT_MODEL)
+    return _client
+
+
+def set_chat_client(client):
+    """Swaps the model client, e.g. for a FakeGeminiClient in tests."""
+    global _client
+    _client = client
+
+
+def parse_chart_config(response_text):
+    """Extracts the JSON option from a model answer; raises json.JSONDecodeError if invalid."""
+    response_text = response_text.strip()
+    json_pattern = r'```json\s*(.*?)\s*```'
+    match = re.match(json_pattern, response_text, re.DOTALL)
+    if match:
+        json_str = match.group(1).strip()
+    else:
+        json_str = response_text
+
+    chart_config = json.loads(json_str)
+    if not isinstance(chart_config, dict):
+        raise json.JSONDecodeError("Chart configuration is not an object", json_str, 0)
+    return chart_config
+
+
+def normalize_query(query):
+    return ' '.join(re.findall(r'[a-z0-9]+', query.lower()))
+
+
+def shingles(normalized, size=2):
+    words = normalized.split()
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class SingleFlight():
+    """
+       Runs one call per key at a time; concurrent callers with the same key
+       share its result, waiting at most `timeout` seconds for it. At most
+       `max_followers` callers wait at once, past that they fail fast with
+       UpstreamBusy: waiting holds a request thread just like calling does.
+    """
+
+    def __init__(self, timeout=None, max_followers=None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._followers = threading.BoundedSemaphore(max_followers) if max_followers else None
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+
+        if not leader:
+            if self._followers is not None and not self._followers.acquire(blocking=False):
+                raise UpstreamBusy("chat is busy, try again shortly")
+            try:
+                done = call["done"].wait(self.timeout)
+            finally:
+                if self._followers is not None:
+                    self._followers.release()
+            if not done:
+                raise UpstreamTimeout(f"chat did not answer within {self.timeout}s")
+        else:
+            try:
+                call["result"] = fn()
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call["done"].set()
+
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+
+class ChartCache():
+    """
+       Validated chart configs by normalized query. Lookups are exact first,
+       then (if CHAT_CACHE_SIMILARITY < 1) the most similar cached query by
+       Jaccard similarity of word shingles, via a shingle -> keys index.
+
+       A `namespace` keeps other entries (chart templates) apart in the same
+       table: they are stored as "namespace:key" and matched exactly only.
+    """
+
+    def __init__(self, namespace=None):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._configs = {}
+        self._shingles = {}
+        self._index = defaultdict(set)
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Fills the in-memory cache from the database once per process."""
+        if self._loaded:
+            return
+        for entry in ChartConfigCache.query.all():
+            namespace, _, normalized = entry.normalized_query.rpartition(':')
+            if namespace == (self.namespace or ''):
+                self._remember(normalized, json.loads(entry.chart_config))
+        self._loaded = True
+
+    def stored_key(self, normalized):
+        return f'{self.namespace}:{normalized}' if self.namespace else normalized
+
+    def _remember(self, normalized, chart_config):
+        with self._lock:
+            self._configs[normalized] = chart_config
+            self._shingles[normalized] = shingles(normalized)
+            for shingle in self._shingles[normalized]:
+                self._index[shingle].add(normalized)
+
+    def lookup(self, normalized):
+        self.load()
+        chart_config = self._configs.get(normalized)
+        if chart_config is not None:
+            self.hits += 1
+            return chart_config
+
+        threshold = BaseConfig.CHAT_CACHE_SIMILARITY
+        if threshold < 1 and not self.namespace:
+            query_shingles = shingles(normalized)
+            candidates = set().union(*(self._index.get(shingle, ()) for shingle in query_shingles))
+            best, best_score = None, threshold
+            for candidate in candidates:
+                candidate_shingles = self._shingles[candidate]
+                score = len(query_shingles & candidate_shingles) / len(query_shingles | candidate_shingles)
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is not None:
+                self.near_hits += 1
+                return self._configs[best]
+
+        # Another worker may have generated it since we loaded
+        entry = ChartConfigCache.get_by_key(query_key(self.stored_key(normalized)))
+        if entry is not None:
+            chart_config = json.loads(entry.chart_config)
+            self._remember(normalized, chart_config)
+            self.hits += 1
+            return chart_config
+
+        self.misses += 1
+        return None
+
+    def store(self, normalized, query, chart_config):
+        self._remember(normalized, chart_config)
+        try:
+            ChartConfigCache(query_key=query_key(self.stored_key(normalized)),
+                             normalized_query=self.stored_key(normalized), query_text=query,
+                             chart_config=json.dumps(chart_config)).save()
+        except IntegrityError:
+            # Another worker stored the same query first
+            db.session.rollback()
+
+    def stats(self):
+        return {"entries": len(self._configs), "hits": self.hits, "near_hits": self.near_hits,
+                "misses": self.misses}
+
+
+def query_key(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+chart_cache = ChartCache()
+template_cache = ChartCache(namespace='template')
+single_flight = SingleFlight(timeout=BaseConfig.CHAT_TIMEOUT, max_followers=BaseConfig.CHAT_MAX_FOLLOWERS)
+
+# Chart types a query can ask for, and words that describe the chart rather than the data
+CHART_TYPES = {'line': 'line', 'trend': 'line', 'bar': 'bar', 'column': 'bar', 'pie': 'pie', 'share': 'pie',
+               'area': 'area', 'scatter': 'scatter'}
+CHART_WORDS = {'chart', 'graph', 'plot', 'visualize', 'visualise', 'show', 'draw', 'create', 'generate', 'make',
+               'me', 'over', 'time', 'year', 'years', 'yearly', 'annual', 'province', 'provinces', 'provincial',
+               'compare', 'comparison', 'please'}
+PROVINCE_WORDS = {'province', 'provinces', 'provincial'}
+# Series averaged rather than summed across rows
+AVERAGE_WORDS = {'average', 'mean', 'rate', 'ratio', 'percent', 'percentage', 'share', 'index', 'per'}
+
+# A series must match at least this well (a slightly misspelled series name word) to ground a chart
+MIN_SERIES_SCORE = 2.0
+MAX_CHART_SERIES = 8
+
+
+def resolve_query(query, models, resolve_sector):
+    """
+       The data selection a chat query asks for, or None when no series of
+       the hub matches it: the best series from the search index (built from
+       the same distinct sector/subsector/series values as get_menu), the
+       model and filters serving it, the dimension to chart along, the
+       measure and the indicators the query named.
+    """
+    words = re.findall(r'\w+', query.casefold())
+    described = [word for word in words if word not in CHART_WORDS and word not in CHART_TYPES]
+    if not described:
+        return None
+
+    results = series_search.search(models, ' '.join(described), 1)
+    if not results or results[0]['score'] < MIN_SERIES_SCORE:
+        return None
+    series = results[0]
+
+    model, scope = resolve_sector(series['sector'])
+    if model is None:
+        return None
+
+    chart_type = next((CHART_TYPES[word] for word in words if word in CHART_TYPES), None)
+    series_words = set(re.findall(r'\w+', series['series_name'].casefold()))
+    return {
+        'model': model,
+        'filters': dict(scope, series_name=series['series_name']),
+        'sector': series['sector'],
+        'series_name': series['series_name'],
+        'dimension': 'province' if PROVINCE_WORDS.intersection(words) else 'year',
+        'measure': 'avg' if AVERAGE_WORDS.intersection(words) or AVERAGE_WORDS & series_words else 'sum',
+        'indicators': series['matches'].get('indicator', []),
+        'chart_type': chart_type,
+    }
+
+
+def fetch_series(selection):
+    """
+       The selection's data through the aggregate path: categories along the
+       dimension and one list of values per indicator, plus the unit.
+    """
+    model, filters, dimension = selection['model'], selection['filters'], selection['dimension']
+    measure = selection['measure']
+    columns = model.aggregate([dimension, 'indicator'], [measure], **filters)
+
+    values = defaultdict(dict)
+    for category, indicator, value in zip(columns[dimension], columns['indicator'], columns[measure]):
+        if category is not None and value is not None:
+            values[indicator or selection['series_name']][category] = value
+    if selection['indicators']:
+        values = {indicator: values[indicator] for indicator in selection['indicators'] if indicator in values}
+
+    categories = sorted({category for by_category in values.values() for category in by_category}, key=str)
+    names = sorted(values, key=lambda name: (name != 'Total', str(name)))[:MAX_CHART_SERIES]
+    series = [(name, [round(float(values[name][category]), 4) if category in values[name] else None
+                      for category in categories]) for name in names]
+
+    units = model.aggregate(['indicator_unit'], ['count'], **filters)
+    unit = max(zip(units['count'], units['indicator_unit']), default=(0, None), key=lambda entry: entry[0])[1]
+    return categories, series, unit
+
+
+TEMPLATE_PROMPT = """
+            You are an expert in ECharts. Write an ECharts option object as a valid JSON string, compatible with echarts-for-react, for a chart the server fills with data afterwards.
+            Chart type: {chart_type}
+            Categories: {dimension}
+            Series: {series}
+            Return ONLY the styling and structure (title, tooltip, legend, grid, axes, and one "series" entry with its "type"), with no data, no axis categories, no series names and no title text. No markdown, no explanations, no text outside the JSON.
+            """
+
+
+def template_key(selection, series_count):
+    return ' '.join([selection['chart_type'] or 'auto', selection['dimension'],
+                     'single' if series_count == 1 else 'multiple'])
+
+
+def fill_template(template, title, dimension, categories, series, unit):
+    """An ECharts option from a template: the categories, series data and names and the title filled in."""
+    chart = json.loads(json.dumps(template))
+    chart['title'] = dict(chart['title'] if isinstance(chart.get('title'), dict) else {}, text=title)
+
+    entries = [entry for entry in chart.get('series') or [] if isinstance(entry, dict)] or [{'type': 'line'}]
+    for entry in entries:
+        entry.pop('data', None)
+
+    if entries[0].get('type') == 'pie':
+        # One slice per category, from the first series
+        name, values = series[0]
+        chart['series'] = [dict(entries[0], name=name,
+                                data=[{'name': category, 'value': value}
+                                      for category, value in zip(categories, values) if value is not None])]
+        chart.pop('xAxis', None)
+        chart.pop('yAxis', None)
+        return chart
+
+    for name in ('xAxis', 'yAxis'):
+        axis = chart.get(name)
+        if isinstance(axis, list):
+            # Only the first axis of each direction is used
+            axis = axis[0] if axis else None
+        chart[name] = dict(axis) if isinstance(axis, dict) else {}
+    # Horizontal bars put the categories on the y axis
+    category_axis, value_axis = (chart['yAxis'], chart['xAxis']) if chart['yAxis'].get('type') == 'category' \
+        else (chart['xAxis'], chart['yAxis'])
+    category_axis.update(type='category', data=categories)
+    category_axis.setdefault('name', dimension)
+    value_axis['type'] = 'value'
+    if unit:
+        value_axis.setdefault('name', unit)
+
+    chart['series'] = []
+    for i, (name, values) in enumerate(series):
+        entry = dict(entries[min(i, len(entries) - 1)], name=name, data=values)
+        if entry.get('type') == 'area':
+            # ECharts has no area type: a line with an area style
+            entry['type'] = 'line'
+            entry.setdefault('areaStyle', {})
+        chart['series'].append(entry)
+    if len(series) > 1:
+        chart['legend'] = dict(chart['legend'] if isinstance(chart.get('legend'), dict) else {},
+                               data=[name for name, _ in series])
+    return chart
+
+
+def get_template(key, selection, series_count):
+    """The chart template for `key`, asking the model only the first time."""
+    template = template_cache.lookup(key)
+    if template is not None:
+        return template
+
+    def call_model():
+        prompt = TEMPLATE_PROMPT.format(
+            chart_type=selection['chart_type'] or 'the best fit for the data',
+            dimension='years, in order' if selection['dimension'] == 'year' else 'provinces of Cambodia',
+            series='one' if series_count == 1 else 'several, compared')
+        template = parse_chart_config(upstreams['chat'].call(get_chat_client().generate, prompt))
+        template_cache.store(key, key, template)
+        return template
+
+    return single_flight.do('template:' + key, call_model)
+
+
+def grounded_chart(selection):
+    """(chart, source) for a resolved selection, or None if it has no data."""
+    categories, series, unit = fetch_series(selection)
+    if not categories:
+        return None
+
+    template = get_template(template_key(selection, len(series)), selection, len(series))
+    title = selection['series_name']
+    if len(series) == 1 and series[0][0] != title:
+        # A single indicator, e.g. "Female"
+        title += f" ({series[0][0]})"
+    chart = fill_template(template, title, selection['dimension'], categories, series, unit)
+    source = {'sector': selection['sector'],
+              'series_name': selection['series_name'],
+              'group_by': selection['dimension'],
+              'measure': selection['measure'],
+              'indicators': [name for name, _ in series]}
+    return chart, source
+
+
+def generate_chart(query, models=(), resolve_sector=None):
+    """
+       Returns (ECharts option, source) for `query`. When the query names a
+       series of the hub (`models` are the tables serving data,
+       `resolve_sector` maps a sector to its model) the chart shows that
+       series' real data, filled into a small template from the model, and
+       `source` describes the selection. Otherwise the model writes the
+       whole chart with sample data and `source` is None; those charts are
+       cached by query.
+    """
+    if models and BaseConfig.CHAT_GROUNDED:
+        selection = resolve_query(query, models, resolve_sector)
+        grounded = grounded_chart(selection) if selection is not None else None
+        if grounded is not None:
+            return grounded
+
+    normalized = normalize_query(query)
+
+    chart_config = chart_cache.lookup(normalized)
+    if chart_config is not None:
+        return chart_config, None
+
+    def call_model():
+        response_text = upstreams['chat'].call(get_chat_client().generate, PROMPT.format(query=query))
+        chart_config = parse_chart_config(response_text)
+        chart_cache.store(normalized, query, chart_config)
+        return chart_config
+
+    return single_flight.do(normalized, call_model), None
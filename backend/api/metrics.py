@@ -0,0 +1,239 @@
+# -*- encoding: utf-8 -*-
+"""
+   Per-request instrumentation.
+
+   Every request gets a RequestMetrics on `g`: named phase timings (the
+   `phase()` blocks in the data path), the SQL statements run and their
+   time (from SQLAlchemy engine events), the rows materialized and the
+   response size. The after_request hook turns them into a Server-Timing
+   header (not on streamed responses, whose SQL runs after the headers are
+   sent and is missing from their counters too) and folds them into
+   process-wide counters and histograms, served in the Prometheus text
+   format at /metrics (one series set per worker process; label by
+   instance when scraping several).
+
+   With PROFILING_ENABLED, a request carrying `X-Profile: 1` (cProfile) or
+   `X-Profile: pyinstrument` is profiled and answered with the report
+   instead of its body; the original status is kept in X-Profile-Status.
+"""
+
+import io, threading, time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Request duration histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics():
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.profiler = None
+
+
+def current():
+    """The RequestMetrics of the current request, or None outside requests."""
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+@contextmanager
+def phase(name):
+    """Times a block of the current request under `name` (no-op outside requests)."""
+    metrics = current()
+    if metrics is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.phases[name] += time.perf_counter() - started
+
+
+def record_rows(count):
+    metrics = current()
+    if metrics is not None:
+        metrics.rows += count
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        # Kept on the statement's own context, so one that fails leaves nothing behind
+        context.cdri_statement_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'cdri_statement_started', None)
+    metrics = current()
+    if metrics is not None and started is not None:
+        metrics.sql_count += 1
+        metrics.sql_seconds += time.perf_counter() - started
+
+
+class Registry():
+    """Process-wide counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(lambda: [0] * (len(BUCKETS) + 1) + [0.0])
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self.histograms[(name, labels)]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[len(BUCKETS)] += 1
+            histogram[-1] += value
+
+    def render(self, extra=()):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(value)) for key, value in self.histograms.items())
+
+        for kind, series in (('counter', [(name, labels, value) for (name, labels), value in counters]),
+                             ('gauge', sorted(extra))):
+            seen = set()
+            for name, labels, value in series:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))} {count}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram[len(BUCKETS)]}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram[len(BUCKETS)]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(histogram[-1])}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in labels) + '}'
+
+
+registry = Registry()
+
+
+def start_profiler(kind):
+    if kind == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        return ('pyinstrument', profiler)
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return ('cprofile', profiler)
+
+
+def profile_response(profiler, response):
+    kind, profiler = profiler
+    if kind == 'pyinstrument':
+        profiler.stop()
+        report = Response(profiler.output_html(), mimetype='text/html')
+    else:
+        import pstats
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(60)
+        report = Response(out.getvalue(), mimetype='text/plain')
+
+    report.headers['X-Profile-Status'] = str(response.status_code)
+    for name in ('Server-Timing', 'Access-Control-Allow-Origin'):
+        if name in response.headers:
+            report.headers[name] = response.headers[name]
+    return report
+
+
+def after_request(response):
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return response
+
+    total = time.perf_counter() - metrics.started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('endpoint', endpoint), ('method', request.method), ('status', response.status_code))
+    phase_labels = (('endpoint', endpoint),)
+
+    registry.inc('cdri_requests_total', labels)
+    registry.observe('cdri_request_duration_seconds', phase_labels, total)
+    registry.inc('cdri_sql_statements_total', phase_labels, metrics.sql_count)
+    registry.inc('cdri_sql_seconds_total', phase_labels, metrics.sql_seconds)
+    registry.inc('cdri_rows_materialized_total', phase_labels, metrics.rows)
+    if not response.is_streamed and response.content_length is not None:
+        registry.inc('cdri_response_bytes_total', phase_labels, response.content_length)
+    for name, seconds in metrics.phases.items():
+        registry.inc('cdri_phase_seconds_total', phase_labels + (('phase', name),), seconds)
+
+    # A streamed body runs its SQL after the headers are sent: no Server-Timing rather than a partial one
+    if not response.is_streamed:
+        timings = ['total;dur=%.1f' % (total * 1000),
+                   'sql;dur=%.1f;desc="%d statements"' % (metrics.sql_seconds * 1000, metrics.sql_count)]
+        timings += ['%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in metrics.phases.items()]
+        if metrics.rows:
+            timings.append('materialized;desc="%d rows"' % metrics.rows)
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+    if metrics.profiler is not None:
+        return profile_response(metrics.profiler, response)
+    return response
+
+
+def init_app(app, collect=()):
+    """
+       Wires the hooks and /metrics into `app`. `collect` yields extra
+       (name, labels, value) gauges at scrape time, e.g. cache statistics.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        metrics = g.request_metrics = RequestMetrics()
+
+        header = request.headers.get('X-Profile')
+        if header and app.config.get('PROFILING_ENABLED', False):
+            metrics.profiler = start_profiler(header)
+
+    # Flask runs after_request hooks in reverse order of registration. This one is registered
+    # after CORS(app), so it runs before CORS: a profile response still gets the CORS headers,
+    # and the time CORS takes is not in `total`
+    app.after_request(after_request)
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(registry.render([gauge for collector in collect for gauge in collector()]),
+                        mimetype='text/plain; version=0.0.4')
@@ -1,14 +1,42 @@
 from datetime import datetime
 
-import json
+import hashlib, json, sqlite3
 
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_sqlalchemy import SQLAlchemy
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
 from datetime import datetime
-from sqlalchemy import distinct
+from sqlalchemy import cast, distinct, event, func, inspect, literal, literal_column, or_, select, union_all
+from sqlalchemy.sql import column as sql_column, table as sql_table
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import column_property, declared_attr
 from collections import defaultdict
 
-db = SQLAlchemy()
+from .config import BaseConfig
+from .metrics import phase, record_rows
+from .replicas import RoutingSQLAlchemy
+
+# Reads of the data tables go to the read replicas (DB_REPLICA_URIS) when there are any, see replicas.py
+db = RoutingSQLAlchemy()
+
+# Table arguments marking a data table as served from the replicas
+REPLICATED = {'info': {'replicated': True}}
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL mode and friends, once per new SQLite connection (the pool keeps them open)."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    for name, value in BaseConfig.SQLITE_PRAGMAS.items():
+        try:
+            cursor.execute(f'PRAGMA {name}={value}')
+        except sqlite3.OperationalError:
+            # A read-only replica (mode=ro) cannot switch its journal mode and keeps the file's own
+            pass
+    cursor.close()
 
 
 class Users(db.Model):
@@ -67,13 +95,17 @@ class Users(db.Model):
 
     def toJSON(self):
 
-        return self.to_dict()
+        return self.toDICT()
 
 
 class JWTTokenBlocklist(db.Model):
     id = db.Column(db.Integer(), primary_key=True)
     jwt_token = db.Column(db.String(), nullable=False)
+    # sha256 of jwt_token: revocation checks look this up instead of the full token
+    token_hash = db.Column(db.String(64), nullable=True, index=True)
     created_at = db.Column(db.DateTime(), nullable=False)
+    # When the token would have expired anyway; rows past it can be purged
+    expires_at = db.Column(db.DateTime(), nullable=True, index=True)
 
     def __repr__(self):
         return f"Expired Token: {self.jwt_token}"
@@ -82,127 +114,666 @@ class JWTTokenBlocklist(db.Model):
         db.session.add(self)
         db.session.commit()
 
-class BaseModel(db.Model):
-    __abstract__ = True
+    @classmethod
+    def get_since(cls, last_id):
+        """(id, token_hash, jwt_token, expires_at) of rows added after `last_id`, oldest first."""
+        return db.session.query(cls.id, cls.token_hash, cls.jwt_token, cls.expires_at) \
+            .filter(cls.id > last_id).order_by(cls.id).all()
 
-    id = db.Column(db.Integer, primary_key=True)
-    province = db.Column(db.String(255), nullable=True)
-    series_name = db.Column(db.String(255), nullable=True)
-    indicator_value = db.Column(db.Float, nullable=True)
-    indicator = db.Column(db.String(255), nullable=True)
-    year = db.Column(db.String(4), nullable=True)
-    series_code = db.Column(db.String(255), nullable=True)
-    sector = db.Column(db.String(255), nullable=True)
-    subsector_1 = db.Column(db.String(255), nullable=True)
-    subsector_2 = db.Column(db.String(255), nullable=True)
-    source = db.Column(db.String(255), nullable=True)
-    latitude = db.Column(db.String(255), nullable=True)
-    longitude = db.Column(db.String(255), nullable=True)
-    indicator_unit = db.Column(db.String(255), nullable=True)
-    tag = db.Column(db.String(255), nullable=True)
-    filters = db.Column(db.String(255), nullable=True)
+    @classmethod
+    def get_without_expiry(cls):
+        """Rows with no expires_at: written before the column existed, or for a token without `exp`."""
+        return cls.query.filter(cls.expires_at.is_(None)).all()
+
+    @classmethod
+    def purge_expired(cls, now):
+        deleted = cls.query.filter(cls.expires_at < now).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+class ChartConfigCache(db.Model):
+    """Validated /api/chat chart configs, so a restart does not empty the chart cache."""
+    __tablename__ = 'chart_config_cache'
+
+    id = db.Column(db.Integer(), primary_key=True)
+    query_key = db.Column(db.String(40), nullable=False, unique=True, index=True)
+    normalized_query = db.Column(db.Text(), nullable=False)
+    query_text = db.Column(db.Text(), nullable=False)
+    chart_config = db.Column(db.Text(), nullable=False)
+    created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"Chart Config {self.normalized_query}"
 
     def save(self):
-        """Save instance to DB."""
         db.session.add(self)
         db.session.commit()
 
     @classmethod
-    def get_by_id(cls, id):
-        return cls.query.get_or_404(id)
+    def get_by_key(cls, query_key):
+        return cls.query.filter_by(query_key=query_key).first()
+
+
+class DataVersion(db.Model):
+    """
+       One row per sector table, bumped whenever that table's rows change.
+       Caches derived from the data key themselves on these versions.
+    """
+    __table_args__ = REPLICATED
+
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer(), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"Data Version {self.table_name}: {self.version}"
 
     @classmethod
-    def get_by_province(cls, province):
-        return cls.query.filter_by(province=province).all()
+    def get_versions(cls):
+        return dict(db.session.execute(select(cls.table_name, cls.version)).all())
 
     @classmethod
-    def get_data(cls, **filters):
-        query = cls.query
-        for column, value in filters.items():
-            if value and column != "filters":
-                query = query.filter(getattr(cls, column) == value)
+    def bump(cls, table_names, connection=None):
+        """Increments the version of every table in `table_names` on `connection` (default: the session)."""
+        execute = connection.execute if connection is not None else db.session.execute
+        table = cls.__table__
 
-        # Convert data to dictionary format
-        result = [entry.to_dict() for entry in query.all()]
-        
-        # Remove columns where all values are empty or None
-        if result:  # Only process if there are results
-            columns_to_remove = []
-            # Check each column
-            for column in result[0].keys():
-                # Check if all values in this column are empty/None
-                if all(not entry[column] or entry[column] == "" for entry in result):
-                    columns_to_remove.append(column)
-            
-            # Remove identified columns from all entries
-            for entry in result:
-                for column in columns_to_remove:
-                    del entry[column]
-
-        # Specify the columns you want to retrieve unique values from
-        exclude_column = ['sector', 'subsector_1', 'subsector_2', 'id', 'indicator_value', 'series_code', 'series_name', 'source', 'latitude', 'longitude', 'indicator_unit', 'tag']
-        unique_values = {}
-
-        for column_name in result[0].keys():
-            if column_name in exclude_column:
+        for table_name in sorted(set(table_names)):
+            updated = execute(table.update()
+                              .where(table.c.table_name == table_name)
+                              .values(version=table.c.version + 1, updated_at=datetime.utcnow()))
+            if not updated.rowcount:
+                execute(table.insert().values(table_name=table_name, version=1, updated_at=datetime.utcnow()))
+
+
+class IngestCheckpoint(db.Model):
+    """
+       Progress of one bulk load. Updated in the same transaction as each
+       chunk, so an interrupted load resumes after the last committed chunk.
+    """
+    id = db.Column(db.Integer(), primary_key=True)
+    source = db.Column(db.String(512), nullable=False)
+    fingerprint = db.Column(db.String(40), nullable=False)
+    table_name = db.Column(db.String(64), nullable=False)
+    rows_done = db.Column(db.Integer(), nullable=False, default=0)
+    chunks_done = db.Column(db.Integer(), nullable=False, default=0)
+    completed = db.Column(db.Boolean(), nullable=False, default=False)
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"Ingest {self.source} -> {self.table_name}: {self.rows_done} rows"
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
+
+    @classmethod
+    def get_latest(cls, fingerprint, table_name):
+        return cls.query.filter_by(fingerprint=fingerprint, table_name=table_name) \
+            .order_by(cls.id.desc()).first()
+
+
+def dimension_table(table_name):
+    """
+       Key/value side table holding the extra dimensions of a sector table's
+       `filters` JSON, one row per (row, key). Values are stored as JSON
+       literals so their types survive the round trip.
+    """
+    return db.Table(
+        f'{table_name}_dimension', db.metadata,
+        db.Column('row_id', db.Integer(), db.ForeignKey(f'{table_name}.id', ondelete='CASCADE'), primary_key=True),
+        db.Column('key', db.String(64), primary_key=True),
+        db.Column('value', db.String(255), nullable=True),
+        db.Index(f'ix_{table_name}_dimension_key_value', 'key', 'value', 'row_id'),
+        **REPLICATED
+    )
+
+
+def rtree_table(table_name):
+    """The R-tree schema.ensure_spatial_indexes() builds next to a located table on SQLite."""
+    return sql_table(f'{table_name}_rtree', sql_column('id'), sql_column('min_lat'), sql_column('max_lat'),
+                     sql_column('min_lon'), sql_column('max_lon'))
+
+
+# (database url, table name) of the R-trees seen to exist; a missing one is looked up again next time
+_rtrees = set()
+
+
+def has_rtree(table_name):
+    key = (str(db.engine.url), table_name)
+    if key not in _rtrees:
+        found = db.session.execute(db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                   {'name': f'{table_name}_rtree'}).first()
+        if not found:
+            return False
+        _rtrees.add(key)
+    return True
+
+
+def grid_cell(value, cell_size, dialect):
+    """floor(value / cell_size) as an integer, for a non-negative `value`."""
+    if dialect == 'sqlite':
+        # CAST truncates, which is floor for non-negative values
+        return cast(value / cell_size, db.Integer)
+    return cast(func.floor(value / cell_size), db.Integer)
+
+
+class DataQueries():
+    """
+       The read path shared by the sector tables (BaseModel) and the unified
+       fact table (FactData): everything is written against the mapped
+       column attributes, so it works whether they are plain columns or the
+       dimension columns of a join.
+    """
+
+    # Columns returned by get_data, in payload order
+    data_columns = ['id', 'sector', 'subsector_1', 'subsector_2', 'series_name', 'indicator_value', 'indicator',
+                    'province', 'year', 'series_code', 'source', 'latitude', 'longitude', 'indicator_unit', 'tag']
+
+    # Columns that are never offered as filter facets
+    exclude_column = ['sector', 'subsector_1', 'subsector_2', 'id', 'indicator_value', 'series_code', 'series_name',
+                      'source', 'latitude', 'longitude', 'indicator_unit', 'tag']
+
+    # Dimensions /api/aggregate can group by, and the measures it computes over indicator_value
+    group_columns = ['sector', 'subsector_1', 'subsector_2', 'series_name', 'series_code', 'indicator', 'province',
+                     'year', 'source', 'indicator_unit', 'tag']
+    aggregate_functions = {'sum': func.sum, 'avg': func.avg, 'min': func.min, 'max': func.max, 'count': func.count}
+
+    @staticmethod
+    def is_empty(value):
+        return not value or value == ""
+
+    @classmethod
+    def from_clause(cls, column_names):
+        """The FROM of a query that uses the attributes `column_names`."""
+        return cls.__table__
+
+    @classmethod
+    def get_conditions(cls, filters):
+        """
+           Build the WHERE clause list for a get_data filter set. The optional
+           `filters` entry is a {key: value} dict matched against the extra
+           dimensions through the side table.
+        """
+        conditions = [getattr(cls, column) == value
+                      for column, value in filters.items()
+                      if value and column != "filters"]
+
+        dimensions = cls.dimensions
+        for key, value in (filters.get("filters") or {}).items():
+            if cls.is_empty(value):
                 continue
+            # Accept the JSON literal and, for values sent as strings, the bare text ("1" matches 1)
+            matches = {json.dumps(value), value} if isinstance(value, str) else {json.dumps(value)}
+            conditions.append(cls.id.in_(select(dimensions.c.row_id)
+                                         .where(dimensions.c.key == key, dimensions.c.value.in_(matches))))
+        return conditions
+
+    @classmethod
+    def non_empty_counts(cls):
+        """COUNT() of the non-empty values of each data column, in data_columns order."""
+        counts = []
+        for column_name in cls.data_columns:
+            column = getattr(cls, column_name)
+            # 0 and '' count as empty, same as is_empty()
+            empty = 0 if isinstance(column.type, (db.Integer, db.Float)) else ''
+            counts.append(func.count(func.nullif(column, empty)))
+        return counts
+
+    @classmethod
+    def get_non_empty_columns(cls, conditions):
+        """
+           Returns the data columns holding at least one non-empty value,
+           using a single COUNT() pass instead of scanning rows in Python
+        """
+        row = db.session.execute(select(*cls.non_empty_counts()).where(*conditions)).one()
+        return [column_name for column_name, count in zip(cls.data_columns, row) if count]
+
+    @classmethod
+    def get_distinct_values(cls, column_names, conditions):
+        """
+           Returns {column: [distinct non-empty values]} for the given columns.
+           Uses GROUPING SETS where the backend has them, otherwise a UNION ALL
+           of DISTINCT selects, so all facets come back in one round trip.
+        """
+        unique_values = {column_name: [] for column_name in column_names}
+        if not column_names:
+            return unique_values
 
-            if column_name == "sector" or column_name == "series_name" or column_name == "subsector_1":
-                query_unique = db.session.query(getattr(cls, column_name)).distinct().all()
-                unique_values[column_name] = [item[0] for item in query_unique if item[0] not in [None, '']]
+        columns = [getattr(cls, column_name) for column_name in column_names]
+        dialect = db.session.connection(mapper=inspect(cls)).dialect.name
 
-            elif column_name == "subsector_2":
-                query_unique = db.session.query(getattr(cls, column_name)).distinct().filter(
-                    getattr(cls, "subsector_1") == filters.get("subsector_1")
-                ).all()
-                unique_values[column_name] = [item[0] for item in query_unique if item[0] not in [None, '']]
+        if dialect == 'postgresql':
+            query = select(*columns, *[func.grouping(column) for column in columns]) \
+                .where(*conditions) \
+                .group_by(func.grouping_sets(*columns))
 
-            else:
-                query_unique = list(set(entry[column_name] for entry in result))
-                unique_values[column_name] = [item for item in query_unique if item not in [None, '']]
+            for row in db.session.execute(query):
+                values, grouped = row[:len(columns)], row[len(columns):]
+                for column_name, value, grouping in zip(column_names, values, grouped):
+                    if grouping == 0 and not cls.is_empty(value):
+                        unique_values[column_name].append(value)
+        else:
+            query = union_all(*[
+                select(literal(column_name).label('name'), column.label('value')).where(*conditions).distinct()
+                for column_name, column in zip(column_names, columns)
+            ])
+
+            for column_name, value in db.session.execute(query):
+                if not cls.is_empty(value):
+                    unique_values[column_name].append(value)
+
+        for values in unique_values.values():
+            values.sort(key=str)
+        return unique_values
+
+    @classmethod
+    def get_extra_filters(cls, conditions):
+        """
+           Facet values of the extra dimensions of the selection, from one
+           DISTINCT pass over the side table: {key: [distinct non-empty values]}
+        """
+        dimensions = cls.dimensions
+        query = select(dimensions.c.key, dimensions.c.value) \
+            .join(cls.__table__, cls.id == dimensions.c.row_id) \
+            .where(*conditions) \
+            .distinct()
+
+        unique_values = defaultdict(set)
+        for key, raw in db.session.execute(query):
+            value = json.loads(raw) if raw else None
+            if not cls.is_empty(value) and not isinstance(value, (list, dict)):
+                unique_values[key].add(value)
+
+        return {key: sorted(values, key=str) for key, values in unique_values.items()}
+
+    @classmethod
+    def select_data(cls, fields=None, **filters):
+        """
+           Resolves everything about a selection except its rows: the WHERE
+           clause, the non-empty columns and the facet values. The rows
+           themselves are read by iter_data().
+
+           `fields` projects the rows onto those columns (and extra dimension
+           keys); facets are still computed over the whole selection.
+        """
+        conditions = cls.get_conditions(filters)
+
+        # Selections along sector > subsector > series have their columns and facets precomputed
+        from .facets import FacetIndex, facet_store
+        node = facet_store.get(cls).lookup(filters) if FacetIndex.covers(filters) else None
+
+        # Remove columns where all values are empty or None
+        if node is not None:
+            columns = [column_name for column_name in cls.data_columns if node.columns.get(column_name)]
+        else:
+            columns = cls.get_non_empty_columns(conditions)
+        if not columns:
+            return {
+                'conditions': conditions,
+                'columns': [],
+                'extra_keys': set(),
+                'filters': {}
+            }
+
+        # Retrieve unique values for every facet column left in the result
+        facet_columns = [column_name for column_name in columns if column_name not in cls.exclude_column]
+
+        if node is not None:
+            unique_values = {column_name: sorted(node.facets.get(column_name, ()), key=str)
+                             for column_name in facet_columns}
+            extra_values = {key: sorted(counts, key=str) for key, counts in node.extra.items() if counts}
+        else:
+            unique_values = cls.get_distinct_values(facet_columns, conditions)
+            extra_values = cls.get_extra_filters(conditions)
+        unique_values.update(extra_values)
+
+        # Only the extra keys with at least one non-empty value survive pruning
+        extra_keys = set(extra_values)
+        if fields:
+            columns = [column_name for column_name in columns if column_name in fields]
+            extra_keys &= set(fields)
+
+        return {
+            'conditions': conditions,
+            'columns': columns,
+            'extra_keys': extra_keys,
+            'filters': {key: value for key, value in unique_values.items() if value}
+        }
+
+    @classmethod
+    def iter_data(cls, selection, chunk_size=None, after_id=None, limit=None):
+        """
+           Yields (id, row) for the rows of a selection, rows as plain dicts,
+           no ORM objects. With `chunk_size` the rows are read through a
+           server-side cursor `chunk_size` at a time, so memory stays flat for
+           any selection size. `after_id`/`limit` read one keyset page: the
+           first `limit` rows with an id above `after_id`.
+
+           Extra dimensions are read in bulk from the side table in row order
+           and merged in; each distinct value is decoded once per query.
+        """
+        columns = selection['columns']
+        if not columns:
+            return
+
+        conditions = list(selection['conditions'])
+        if after_id is not None:
+            conditions.append(cls.id > after_id)
+
+        query = select(cls.id, *[getattr(cls, column_name) for column_name in columns]) \
+            .where(*conditions) \
+            .order_by(cls.id)
+        if limit:
+            query = query.limit(limit)
+        if chunk_size:
+            query = query.execution_options(stream_results=True, yield_per=chunk_size)
+
+        rows = db.session.execute(query)
+        if limit:
+            # Bound the side table read to the page
+            rows = rows.all()
+            if not rows:
+                return
+            conditions.append(cls.id <= rows[-1][0])
+
+        dimensions = cls.dimensions
+        dimension_query = select(dimensions.c.row_id, dimensions.c.key, dimensions.c.value) \
+            .where(dimensions.c.row_id.in_(select(cls.id).where(*conditions)),
+                   dimensions.c.key.in_(selection['extra_keys'])) \
+            .order_by(dimensions.c.row_id)
+        if chunk_size:
+            dimension_query = dimension_query.execution_options(stream_results=True, yield_per=chunk_size)
+
+        decoded = {None: None}
+        dimension_rows = iter(db.session.execute(dimension_query) if selection['extra_keys'] else ())
+        pending = next(dimension_rows, None)
+
+        for row in rows:
+            entry = dict(zip(columns, row[1:]))
+            while pending is not None and pending[0] <= row[0]:
+                if pending[0] == row[0]:
+                    raw = pending[2]
+                    if raw not in decoded:
+                        decoded[raw] = json.loads(raw)
+                    entry[pending[1]] = decoded[raw]
+                pending = next(dimension_rows, None)
+            yield row[0], entry
+
+    @classmethod
+    def sync_dimensions(cls, conditions=(), connection=None):
+        """
+           Rebuilds the side table rows of the matching rows from their
+           `filters` JSON. Bulk loaders call this after writing; ORM writes
+           are kept in sync by the flush hook.
+        """
+        execute = connection.execute if connection is not None else db.session.execute
+        dimensions = cls.dimensions
+
+        execute(dimensions.delete().where(dimensions.c.row_id.in_(select(cls.id).where(*conditions))))
+
+        query = select(cls.id, cls.filters).where(*conditions, cls.filters.isnot(None), cls.filters != '')
+        batch = []
+        for row_id, raw in execute(query).all():
+            batch.extend(dimension_rows(row_id, raw))
+            if len(batch) >= 10000:
+                execute(dimensions.insert(), batch)
+                batch = []
+        if batch:
+            execute(dimensions.insert(), batch)
+
+    @classmethod
+    def get_data(cls, fields=None, **filters):
+        if current_app.config.get('DATA_ENGINE') == 'columnar':
+            from .columnar import snapshots
+            with phase('columnar'):
+                result = snapshots.get(cls).get_data(fields=fields, **filters)
+            record_rows(len(result['data']))
+            return result
+
+        with phase('facets'):
+            selection = cls.select_data(fields=fields, **filters)
+        with phase('rows'):
+            rows = [row for _, row in cls.iter_data(selection)]
+        record_rows(len(rows))
 
-        unique_values = {key: value for key, value in unique_values.items() if value}
         return {
-            'data': result,
-            'filters': unique_values
+            'data': rows,
+            'filters': selection['filters']
         }
+
+    @classmethod
+    def get_page(cls, selection, after_id=None, limit=1000):
+        """
+           One keyset page of a selection from select_data(): (rows, last id
+           or None when this is the last page). Costs an index range scan on
+           the primary key whatever the page number.
+        """
+        with phase('rows'):
+            page = list(cls.iter_data(selection, after_id=after_id, limit=limit + 1))
+        record_rows(len(page))
+        if len(page) > limit:
+            return [row for _, row in page[:limit]], page[limit - 1][0]
+        return [row for _, row in page], None
     
 
     @classmethod
-    def get_menu(cls):
-        # Step 1: Query distinct sectors
-        sectors = db.session.query(cls.sector).distinct().all()
-        sectors = [s[0] for s in sectors if s[0] not in [None, ""]]
+    def aggregate(cls, group_by, measures, **filters):
+        """
+           Aggregates indicator_value over the selection with one GROUP BY.
+           Returns {column: [values]}: the group_by columns, then one column
+           per measure, one entry per group in group order. NULL values are
+           skipped by every measure, as in SQL.
+        """
+        if current_app.config.get('DATA_ENGINE') == 'columnar':
+            from .columnar import snapshots
+            with phase('columnar'):
+                return snapshots.get(cls).aggregate(group_by, measures, **filters)
+
+        group_columns = [getattr(cls, column_name) for column_name in group_by]
+        query = select(*group_columns,
+                       *[cls.aggregate_functions[measure](cls.indicator_value) for measure in measures]) \
+            .select_from(cls.from_clause(group_by + list(filters))) \
+            .where(*cls.get_conditions(filters)) \
+            .group_by(*group_columns) \
+            .order_by(*group_columns)
+
+        with phase('aggregate'):
+            rows = db.session.execute(query).all()
+        record_rows(len(rows))
+        names = group_by + measures
+        values = list(zip(*rows)) if rows else [()] * len(names)
+        return {name: list(column) for name, column in zip(names, values)}
+
+    @classmethod
+    def get_bbox_conditions(cls, bbox):
+        """
+           WHERE clauses for the rows located inside `bbox`, a (west, south,
+           east, north) box in degrees; west > east crosses the antimeridian.
+           The candidates come from the spatial index when there is one (the
+           R-tree on SQLite, the GiST index on PostgreSQL, see
+           schema.ensure_spatial_indexes), the exact bounds are always checked.
+        """
+        west, south, east, north = bbox
+        spans = [(west, 180), (-180, east)] if west > east else [(west, east)]
+        conditions = [cls.latitude.between(south, north),
+                      or_(*[cls.longitude.between(low, high) for low, high in spans])]
+
+        dialect = db.session.connection(mapper=inspect(cls)).dialect.name
+        if dialect == 'sqlite' and has_rtree(cls.__tablename__):
+            # Boxes are stored rounded outwards to 32-bit floats, so ask for overlaps
+            rtree = rtree_table(cls.__tablename__)
+            conditions.append(cls.id.in_(union_all(*[
+                select(rtree.c.id).where(rtree.c.max_lat >= south, rtree.c.min_lat <= north,
+                                         rtree.c.max_lon >= low, rtree.c.min_lon <= high)
+                for low, high in spans])))
+        elif dialect == 'postgresql':
+            location = func.point(cls.longitude, cls.latitude)
+            conditions.append(or_(*[location.op('<@')(func.box(func.point(low, south), func.point(high, north)))
+                                    for low, high in spans]))
+        return conditions
+
+    @classmethod
+    def get_points(cls, bbox, fields, limit=None, **filters):
+        """
+           The rows of the selection located inside `bbox`, as columns
+           {name: [values]}: id, latitude, longitude, then `fields`, in id
+           order and at most `limit` of them.
+        """
+        names = ['id', 'latitude', 'longitude'] + [name for name in fields
+                                                   if name not in ('id', 'latitude', 'longitude')]
+        if current_app.config.get('DATA_ENGINE') == 'columnar':
+            from .columnar import snapshots
+            with phase('columnar'):
+                result = snapshots.get(cls).get_points(bbox, names, limit, **filters)
+            record_rows(len(result['id']))
+            return result
+
+        query = select(*[getattr(cls, name) for name in names]) \
+            .select_from(cls.from_clause(names + list(filters))) \
+            .where(*cls.get_conditions(filters), *cls.get_bbox_conditions(bbox)) \
+            .order_by(cls.id)
+        if limit:
+            query = query.limit(limit)
+
+        with phase('points'):
+            rows = db.session.execute(query).all()
+        record_rows(len(rows))
+        values = list(zip(*rows)) if rows else [()] * len(names)
+        return {name: list(column) for name, column in zip(names, values)}
+
+    @classmethod
+    def get_clusters(cls, bbox, cell_size, **filters):
+        """
+           The located rows of the selection inside `bbox`, clustered on a
+           grid of `cell_size` degrees anchored at (-90, -180), so a point
+           falls in the same cluster whatever the view. Returns columns
+           {name: [values]}, one entry per non-empty cell in cell order: the
+           cell's row and column on the grid, its point count, the mean
+           position of its points and their mean indicator_value.
+        """
+        if current_app.config.get('DATA_ENGINE') == 'columnar':
+            from .columnar import snapshots
+            with phase('columnar'):
+                result = snapshots.get(cls).get_clusters(bbox, cell_size, **filters)
+            record_rows(len(result['count']))
+            return result
+
+        dialect = db.session.connection(mapper=inspect(cls)).dialect.name
+        # Constants are inlined: bound parameters would make GROUP BY differ from the SELECT on PostgreSQL
+        cells = [grid_cell(column + literal_column(offset), literal_column(repr(float(cell_size))), dialect)
+                 for column, offset in ((cls.latitude, '90'), (cls.longitude, '180'))]
+        query = select(*cells, func.count(), func.avg(cls.latitude), func.avg(cls.longitude),
+                       func.avg(cls.indicator_value)) \
+            .select_from(cls.from_clause(list(filters))) \
+            .where(*cls.get_conditions(filters), *cls.get_bbox_conditions(bbox)) \
+            .group_by(*cells) \
+            .order_by(*cells)
+
+        with phase('clusters'):
+            rows = db.session.execute(query).all()
+        record_rows(len(rows))
+        names = ['cell_lat', 'cell_lon', 'count', 'latitude', 'longitude', 'indicator_value']
+        values = list(zip(*rows)) if rows else [()] * len(names)
+        return {name: list(column) for name, column in zip(names, values)}
 
-        # Step 2: Query distinct subsector_1 values mapped to sectors
+    @classmethod
+    def get_menu(cls):
+        # Step 1: Query distinct subsector_1 values mapped to sectors
         subsector_1_data = db.session.query(cls.sector, cls.subsector_1).distinct().all()
 
-        # Step 3: Query distinct series names mapped to subsector_1
+        # Step 2: Query distinct series names mapped to subsector_1
         series_data = db.session.query(cls.subsector_1, cls.series_name).distinct().all()
 
-        # Step 4: Build the hierarchical structure
+        # Step 3: Build the hierarchical structure
         menu = defaultdict(lambda: defaultdict(list))
+        sectors_by_subsector = defaultdict(list)
         series_name_list = []
+        seen = set()
 
         # Mapping subsector_1 to sectors
         for sector, sub1 in subsector_1_data:
             if sector and sub1:
                 menu[sector][sub1] = []
+                sectors_by_subsector[sub1].append(sector)
 
         # Mapping series to subsector_1
         for sub1, series in series_data:
             if sub1 and series:
-                # series_name_list.add(series)
-                for sector in menu:
-                    if sub1 in menu[sector]:
-                        menu[sector][sub1].append(series)
-                        new_item = {"series_name": series, "sector": sector}
-                        if new_item not in series_name_list:
-                            series_name_list.append(new_item)
+                for sector in sectors_by_subsector.get(sub1, []):
+                    menu[sector][sub1].append(series)
+                    if (series, sector) not in seen:
+                        seen.add((series, sector))
+                        series_name_list.append({"series_name": series, "sector": sector})
 
         return menu, series_name_list
 
-    
+
+class BaseModel(DataQueries, db.Model):
+    __abstract__ = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '__tablename__' in cls.__dict__:
+            cls.dimensions = dimension_table(cls.__tablename__)
+
+    @declared_attr
+    def __table_args__(cls):
+        """
+           Composite indexes for the access patterns of get_data (equality
+           filters on series/subsectors, facets on province/year/indicator)
+           and get_menu (DISTINCT sector/subsector_1 and subsector_1/series_name)
+        """
+        table = cls.__tablename__
+        return (
+            db.Index(f'ix_{table}_series_subsectors', 'series_name', 'subsector_1', 'subsector_2'),
+            db.Index(f'ix_{table}_subsectors', 'subsector_1', 'subsector_2'),
+            db.Index(f'ix_{table}_sector_subsector', 'sector', 'subsector_1'),
+            db.Index(f'ix_{table}_subsector_series', 'subsector_1', 'series_name'),
+            db.Index(f'ix_{table}_province_year', 'province', 'year'),
+            db.Index(f'ix_{table}_indicator_year', 'indicator', 'year'),
+            db.Index(f'ix_{table}_lat_lon', 'latitude', 'longitude'),
+            db.Index(f'ux_{table}_row_key', 'row_key', unique=True),
+            REPLICATED,
+        )
+
+    id = db.Column(db.Integer, primary_key=True)
+    province = db.Column(db.String(255), nullable=True)
+    series_name = db.Column(db.String(255), nullable=True)
+    indicator_value = db.Column(db.Float, nullable=True)
+    indicator = db.Column(db.String(255), nullable=True)
+    year = db.Column(db.String(4), nullable=True)
+    series_code = db.Column(db.String(255), nullable=True)
+    sector = db.Column(db.String(255), nullable=True)
+    subsector_1 = db.Column(db.String(255), nullable=True)
+    subsector_2 = db.Column(db.String(255), nullable=True)
+    source = db.Column(db.String(255), nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    indicator_unit = db.Column(db.String(255), nullable=True)
+    tag = db.Column(db.String(255), nullable=True)
+    filters = db.Column(db.String(255), nullable=True)
+    # Hash of the natural key, set by the bulk loader so re-loads upsert instead of duplicating
+    row_key = db.Column(db.String(40), nullable=True)
+
+    def save(self):
+        """Save instance to DB."""
+        db.session.add(self)
+        db.session.commit()
+
+    @classmethod
+    def get_by_id(cls, id):
+        return cls.query.get_or_404(id)
+
+    @classmethod
+    def get_by_province(cls, province):
+        return cls.query.filter_by(province=province).all()
+
+    @classmethod
+    def load_rows(cls, connection, rows):
+        """Where loader rows are written: this table, rows unchanged. Returns (table, rows)."""
+        return cls.__table__, rows
+
     def to_dict(self):
         filters_dict = json.loads(self.filters) if self.filters else {}
         return {
@@ -235,4 +806,259 @@ class AgricultureData(BaseModel):
     __tablename__ = 'agriculture_data'
 
 class EconomicData(BaseModel):
-    __tablename__ = 'economic_data'
\ No newline at end of file
+    __tablename__ = 'economic_data'
+
+
+
+"""
+   Unified storage (DATA_STORAGE=unified): one fact table for every sector,
+   with integer keys into small dimension tables instead of repeated
+   strings. A sector is a row of the `sectors` registry, so loading a file
+   with a new sector name is all it takes to add one.
+"""
+
+class Sector(db.Model):
+    __tablename__ = 'sectors'
+    __table_args__ = REPLICATED
+
+    id = db.Column(db.Integer(), primary_key=True)
+    name = db.Column(db.String(255), nullable=False, unique=True)
+
+    def __repr__(self):
+        return f"Sector {self.name}"
+
+    @classmethod
+    def get_names(cls):
+        return [name for name, in db.session.execute(select(cls.name).order_by(cls.name))]
+
+
+class Subsector(db.Model):
+    __tablename__ = 'subsectors'
+    __table_args__ = (db.Index('ux_subsectors_names', 'subsector_1', 'subsector_2', unique=True), REPLICATED)
+
+    id = db.Column(db.Integer(), primary_key=True)
+    subsector_1 = db.Column(db.String(255), nullable=True)
+    subsector_2 = db.Column(db.String(255), nullable=True)
+
+
+class Series(db.Model):
+    __tablename__ = 'series'
+    __table_args__ = (db.Index('ux_series_names', 'series_name', 'series_code', unique=True), REPLICATED)
+
+    id = db.Column(db.Integer(), primary_key=True)
+    series_name = db.Column(db.String(255), nullable=True)
+    series_code = db.Column(db.String(255), nullable=True)
+
+
+class Province(db.Model):
+    __tablename__ = 'provinces'
+    __table_args__ = REPLICATED
+
+    id = db.Column(db.Integer(), primary_key=True)
+    name = db.Column(db.String(255), nullable=False, unique=True)
+
+
+# Every index leads with sector_id, so a sector's rows are one contiguous index range
+fact_table = db.Table(
+    'fact_data', db.metadata,
+    db.Column('id', db.Integer(), primary_key=True),
+    db.Column('sector_id', db.Integer(), db.ForeignKey('sectors.id'), nullable=False),
+    db.Column('subsector_id', db.Integer(), db.ForeignKey('subsectors.id'), nullable=True),
+    db.Column('series_id', db.Integer(), db.ForeignKey('series.id'), nullable=True),
+    db.Column('province_id', db.Integer(), db.ForeignKey('provinces.id'), nullable=True),
+    db.Column('indicator_value', db.Float, nullable=True),
+    db.Column('indicator', db.String(255), nullable=True),
+    db.Column('year', db.String(4), nullable=True),
+    db.Column('source', db.String(255), nullable=True),
+    db.Column('latitude', db.Float, nullable=True),
+    db.Column('longitude', db.Float, nullable=True),
+    db.Column('indicator_unit', db.String(255), nullable=True),
+    db.Column('tag', db.String(255), nullable=True),
+    db.Column('filters', db.String(255), nullable=True),
+    db.Column('row_key', db.String(40), nullable=True),
+    # Menu: DISTINCT (sector, subsector, series) straight from the index
+    db.Index('ix_fact_data_sector_subsector_series', 'sector_id', 'subsector_id', 'series_id'),
+    db.Index('ix_fact_data_sector_series', 'sector_id', 'series_id', 'subsector_id'),
+    db.Index('ix_fact_data_sector_province_year', 'sector_id', 'province_id', 'year'),
+    db.Index('ix_fact_data_sector_indicator_year', 'sector_id', 'indicator', 'year'),
+    # Covers the rollups by sector and year: one ordered index pass, no table lookups
+    db.Index('ix_fact_data_sector_year_value', 'sector_id', 'year', 'indicator_value'),
+    db.Index('ix_fact_data_series', 'series_id'),
+    db.Index('ix_fact_data_lat_lon', 'latitude', 'longitude'),
+    db.Index('ux_fact_data_row_key', 'row_key', unique=True),
+    **REPLICATED
+)
+
+fact_view = fact_table \
+    .join(Sector.__table__, fact_table.c.sector_id == Sector.id) \
+    .outerjoin(Subsector.__table__, fact_table.c.subsector_id == Subsector.id) \
+    .outerjoin(Series.__table__, fact_table.c.series_id == Series.id) \
+    .outerjoin(Province.__table__, fact_table.c.province_id == Province.id)
+
+
+class FactData(DataQueries, db.Model):
+    """
+       The unified fact table, mapped over its join with the dimension tables
+       so it has the same attributes as a sector table (`sector`,
+       `series_name`, `province`, ...) and the whole DataQueries read path
+       works on it unchanged. Read-only through the ORM: rows are written
+       with load_rows() by `flask ingest` and `flask unify-sectors`.
+    """
+    __table__ = fact_view
+    __tablename__ = 'fact_data'
+
+    id = fact_table.c.id
+    sector = column_property(Sector.__table__.c.name)
+    subsector_1 = Subsector.__table__.c.subsector_1
+    subsector_2 = Subsector.__table__.c.subsector_2
+    series_name = Series.__table__.c.series_name
+    series_code = Series.__table__.c.series_code
+    province = column_property(Province.__table__.c.name)
+    # The integer keys: each fact column with the dimension id it joins on
+    sector_key = column_property(fact_table.c.sector_id, Sector.__table__.c.id)
+    subsector_key = column_property(fact_table.c.subsector_id, Subsector.__table__.c.id)
+    series_key = column_property(fact_table.c.series_id, Series.__table__.c.id)
+    province_key = column_property(fact_table.c.province_id, Province.__table__.c.id)
+
+    __mapper_args__ = {'primary_key': [fact_table.c.id]}
+
+    dimensions = dimension_table('fact_data')
+
+    # Dimension columns of the loader rows: (dimension table, its columns, fact key column)
+    dimension_keys = [
+        (Sector.__table__, ['sector'], 'sector_id'),
+        (Subsector.__table__, ['subsector_1', 'subsector_2'], 'subsector_id'),
+        (Series.__table__, ['series_name', 'series_code'], 'series_id'),
+        (Province.__table__, ['province'], 'province_id'),
+    ]
+
+    @classmethod
+    def from_clause(cls, column_names):
+        """
+           The fact table joined only to the dimensions `column_names` use.
+           SQLite does not drop unused outer joins from aggregate queries,
+           which would cost three primary key lookups per row.
+        """
+        clause = fact_table
+        for table, columns, key_column in cls.dimension_keys:
+            if any(column in column_names for column in columns):
+                key = fact_table.c[key_column]
+                clause = clause.join(table, key == table.c.id, isouter=key.nullable)
+        return clause
+
+    @classmethod
+    def load_rows(cls, connection, rows):
+        """
+           Turns flat loader rows (string dimensions, see ingest.LOAD_COLUMNS)
+           into fact rows: dimension values become integer keys, registering
+           the new ones. The row_key is prefixed with the sector, since the
+           natural key is only unique within one. Returns (table, rows).
+        """
+        if any(not row.get('sector') for row in rows):
+            raise ValueError("Rows for the unified fact table need a sector (pass --sector)")
+
+        facts = [{name: value for name, value in row.items() if name in fact_table.c} for row in rows]
+        for table, columns, key_column in cls.dimension_keys:
+            keys = [tuple(row.get(column) for column in columns) for row in rows]
+            ids = dimension_ids(connection, table, keys)
+            for fact, key in zip(facts, keys):
+                fact[key_column] = ids.get(key)
+
+        for fact, row in zip(facts, rows):
+            if row.get('row_key'):
+                fact['row_key'] = hashlib.sha1(f"{row['sector']}\x1f{row['row_key']}".encode('utf-8')).hexdigest()
+        return fact_table, facts
+
+    @classmethod
+    def get_menu(cls):
+        """
+           The same menu as the sector tables, from one DISTINCT pass over the
+           (sector_id, subsector_id, series_id) index; the names are joined
+           from the small dimension tables afterwards.
+        """
+        keys = select(fact_table.c.sector_id, fact_table.c.subsector_id, fact_table.c.series_id) \
+            .distinct().subquery()
+        subsectors, series = Subsector.__table__, Series.__table__
+        query = select(Sector.name, subsectors.c.subsector_1, series.c.series_name) \
+            .select_from(keys.join(Sector.__table__, keys.c.sector_id == Sector.id)
+                         .outerjoin(subsectors, keys.c.subsector_id == subsectors.c.id)
+                         .outerjoin(series, keys.c.series_id == series.c.id)) \
+            .distinct() \
+            .order_by(Sector.name, subsectors.c.subsector_1, series.c.series_name)
+
+        menu = defaultdict(lambda: defaultdict(list))
+        series_name_list = []
+        seen = set()
+
+        for sector, sub1, series_name in db.session.execute(query):
+            if not (sector and sub1):
+                continue
+            menu[sector][sub1]
+            if series_name:
+                menu[sector][sub1].append(series_name)
+                if (series_name, sector) not in seen:
+                    seen.add((series_name, sector))
+                    series_name_list.append({"series_name": series_name, "sector": sector})
+
+        return menu, series_name_list
+
+
+def dimension_ids(connection, table, keys):
+    """
+       {key: id} in dimension `table` for the value tuples `keys` (in the
+       order of the table's non-id columns), inserting the missing ones.
+       All-None keys map to no row.
+    """
+    columns = [column for column in table.c if column.name != 'id']
+    keys = {key for key in keys if any(value is not None for value in key)}
+    if not keys:
+        return {}
+
+    first_values = {key[0] for key in keys}
+    condition = columns[0].in_([value for value in first_values if value is not None])
+    if None in first_values:
+        condition = or_(condition, columns[0].is_(None))
+
+    def lookup():
+        query = select(table.c.id, *columns).where(condition)
+        return {tuple(row[1:]): row[0] for row in connection.execute(query) if tuple(row[1:]) in keys}
+
+    ids = lookup()
+    missing = keys - set(ids)
+    if missing:
+        connection.execute(table.insert(), [{column.name: value for column, value in zip(columns, key)}
+                                            for key in sorted(missing, key=str)])
+        ids = lookup()
+    return ids
+
+def dimension_rows(row_id, raw):
+    """Side table rows for one `filters` JSON string."""
+    if not raw:
+        return []
+    return [{'row_id': row_id, 'key': key, 'value': json.dumps(value)}
+            for key, value in json.loads(raw).items()]
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def bump_data_versions(session, flush_context):
+    """Bumps the data version of every sector table touched by an ORM flush."""
+    table_names = {instance.__tablename__
+                   for instance in (*session.new, *session.dirty, *session.deleted)
+                   if isinstance(instance, DataQueries)}
+    if table_names:
+        DataVersion.bump(table_names, connection=session.connection())
+        session.info.setdefault('changed_tables', set()).update(table_names)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def sync_dimension_tables(session, flush_context):
+    """Keeps the extra-dimension side tables in step with the `filters` JSON of flushed rows."""
+    connection = None
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, DataQueries) and instance.id is not None:
+            connection = connection or session.connection()
+            dimensions = instance.dimensions
+            connection.execute(dimensions.delete().where(dimensions.c.row_id == instance.id))
+            rows = [] if instance in session.deleted else dimension_rows(instance.id, instance.filters)
+            if rows:
+                connection.execute(dimensions.insert(), rows)
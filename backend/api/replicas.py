@@ -0,0 +1,205 @@
+# -*- encoding: utf-8 -*-
+"""
+   Read replicas for the data tables (DB_REPLICA_URIS).
+
+   RoutingSession sends a SELECT to a replica when every table it reads is
+   a data table (Table.info['replicated']: the sector tables, the unified
+   fact and dimension tables, their side tables and data_version) and the
+   session has not written yet. Everything else stays on the primary
+   (SQLALCHEMY_DATABASE_URI): users, tokens, the chart cache, every
+   INSERT/UPDATE/DELETE, bare session.connection() calls and, so a request
+   reads its own writes, every statement of a session after its first
+   write. Replication itself is up to the database (a PostgreSQL standby)
+   or the deployment (a copy of the SQLite file).
+
+   A session sticks to one replica, so data_version and the rows it
+   versions come from the same copy. Replicas are checked every
+   DB_REPLICA_CHECK_SECONDS, a PostgreSQL standby also for replay lag; one
+   that fails a check or loses its connection mid-query is skipped until
+   it passes a check again, and with none healthy reads go to the primary.
+   A statement that fails on its replica is run again on the primary, so
+   the request still gets its answer.
+"""
+
+import itertools, threading, time
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, exc, orm, text
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import CompoundSelect, Select
+from sqlalchemy.sql.util import find_tables
+
+# Seconds a PostgreSQL standby is behind (0 when it has replayed all it received)
+POSTGRESQL_LAG = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+class Replica():
+
+    def __init__(self, name, uri, options):
+        self.name = name
+        self.engine = create_engine(uri, **options)
+        self.healthy = True
+        self.lag = None
+        self.failures = 0
+        self.statements = 0
+        event.listen(self.engine, 'handle_error', self.on_error)
+        event.listen(self.engine, 'before_cursor_execute', self.count_statement)
+
+    def on_error(self, context):
+        # A lost connection or an unreachable database, not a bad statement
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+            self.healthy = False
+            self.failures += 1
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def check(self, max_lag):
+        """Marks the replica healthy when it answers (and is at most `max_lag` seconds behind)."""
+        try:
+            with self.engine.connect() as connection:
+                # Also proves the schema is there, unlike SELECT 1
+                connection.execute(text('SELECT COUNT(*) FROM data_version')).scalar()
+                lag = connection.execute(text(POSTGRESQL_LAG)).scalar() \
+                    if self.engine.dialect.name == 'postgresql' else 0
+        except exc.SQLAlchemyError:
+            self.healthy = False
+            self.failures += 1
+            return False
+
+        self.lag = float(lag) if lag is not None else None
+        self.healthy = self.lag is None or self.lag <= max_lag
+        return self.healthy
+
+    def stats(self):
+        return {'healthy': int(self.healthy), 'lag_seconds': self.lag or 0, 'failures': self.failures,
+                'statements': self.statements}
+
+
+class ReplicaSet():
+    """The configured replicas of this process and the thread that health-checks them."""
+
+    def __init__(self):
+        self.replicas = []
+        self.max_lag = 0
+        self._next = itertools.count()
+        self._tables = None
+        self._thread = None
+
+    def init_app(self, app):
+        self.dispose()
+        self.max_lag = app.config['DB_REPLICA_MAX_LAG']
+        self.replicas = [
+            Replica(f'replica_{i}', uri,
+                    app.config['SQLITE_ENGINE_OPTIONS'] if uri.startswith('sqlite') else app.config['DBMS_ENGINE_OPTIONS'])
+            for i, uri in enumerate(app.config['DB_REPLICA_URIS'])]
+
+    def dispose(self):
+        """Drops pooled connections, e.g. in a freshly forked worker."""
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def replicated_tables(self):
+        """Names of the tables replicas serve, with the R-trees SQLite keeps next to them."""
+        if self._tables is None:
+            from .models import db
+            tables = [table for table in db.metadata.tables.values() if table.info.get('replicated')]
+            self._tables = {table.name for table in tables} | \
+                {f'{table.name}_rtree' for table in tables if 'latitude' in table.c}
+        return self._tables
+
+    def pick(self):
+        """A healthy replica, round robin, or None."""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check(self.max_lag)
+
+    def start(self, app):
+        """Checks every replica now and again every DB_REPLICA_CHECK_SECONDS from a daemon thread."""
+        if not self.replicas:
+            return
+        self.check()
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(app.config['DB_REPLICA_CHECK_SECONDS'])
+                try:
+                    self.check()
+                except Exception as e:
+                    print('> Error: replica health check failed: ' + str(e))
+
+        self._thread = threading.Thread(target=run, name='replica-health', daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        return {replica.name: replica.stats() for replica in self.replicas}
+
+
+replicas = ReplicaSet()
+
+
+def is_replicated_read(mapper, clause):
+    """Whether a statement (or, without one, the mapper's tables) only reads replicated tables."""
+    if clause is None:
+        tables = mapper.tables if mapper is not None else []
+    elif isinstance(clause, (Select, CompoundSelect)) and getattr(clause, '_for_update_arg', None) is None:
+        # Literal and label columns belong to no table
+        tables = [table for table in find_tables(clause, check_columns=True) if table is not None]
+    else:
+        return False
+
+    names = replicas.replicated_tables()
+    return bool(tables) and all(table.name in names for table in tables)
+
+
+def use_primary(session):
+    """Sends every statement of `session` to the primary, for work that reads what it is about to write."""
+    session.info['primary'] = True
+
+
+class RoutingSession(SignallingSession):
+    """SignallingSession that sends reads of the data tables to a read replica."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if replicas.replicas:
+            if self._flushing or isinstance(clause, UpdateBase) or (mapper is None and clause is None):
+                # Writes, and a raw connection that may write: this session reads from the primary from now on
+                self.info['primary'] = True
+            elif not self.info.get('primary') and is_replicated_read(mapper, clause):
+                replica = self.info.get('replica')
+                if replica is None or not replica.healthy:
+                    replica = self.info['replica'] = replicas.pick()
+                if replica is not None:
+                    return replica.engine
+        return super().get_bind(mapper, clause)
+
+    def execute(self, statement, *args, **kwargs):
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except exc.DBAPIError as e:
+            # Replica.on_error has marked the replica that failed; errors of the primary are the caller's
+            replica = self.info.get('replica')
+            if replica is None or replica.healthy or self.info.get('primary'):
+                raise
+            if e.connection_invalidated:
+                # The session cannot commit with a dead connection in its transaction; nothing was written
+                # yet (writes stick the session to the primary), so only loaded state is expired
+                self.rollback()
+            self.info['primary'] = True
+            return super().execute(statement, *args, **kwargs)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
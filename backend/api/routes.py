@@ -2,21 +2,31 @@ from datetime import datetime, timezone, timedelta
 
 from functools import wraps
 
-from flask import request
-from flask_restx import Api, Resource, fields
+from flask import Response, current_app, request, stream_with_context
+from flask_restx import Resource, fields
+from itsdangerous import BadSignature, URLSafeSerializer
 
 import jwt
 import json
-import google.generativeai as genai
-import re
+import math
 
-from .models import db, Users, JWTTokenBlocklist, EducationData, AgricultureData, EconomicData
+from .models import db, Users, JWTTokenBlocklist, EducationData, AgricultureData, EconomicData, FactData, Sector
 from .config import BaseConfig
-import requests
+from .caching import VersionedCache, data_versions, result_cache
+from .encoding import (FORMATS, compress, dumps, encode_columns, encode_data, make_data_response, negotiate_encoding,
+                       negotiate_format, output_json)
+from .errors import EnvelopeApi
+from .advisor import query_log
+from .auth import revoke, revoked_tokens, token_hash, user_cache
+from .llm import chart_cache, generate_chart, template_cache
+from .metrics import phase
+from .facets import HIERARCHY, facet_store
+from .search import series_search
+from .upstream import UpstreamBusy, UpstreamError, UpstreamTimeout, http_request, upstreams
 from collections import defaultdict
 
-rest_api = Api(version="1.0", title="CDRI Data Hub API")
-genai.configure(api_key=BaseConfig.GOOGLE_API_KEY)
+rest_api = EnvelopeApi(version="1.0", title="CDRI Data Hub API")
+rest_api.representation('application/json')(output_json)
 
 
 """
@@ -38,10 +48,31 @@ user_edit_model = rest_api.model('UserEditModel', {"userID": fields.String(requi
                                                    })
 
 query_model = rest_api.model('QueryModel', {
-    'sector': fields.String(required=True, description="Sector"),
+    'sector': fields.String(required=True, description="Sector (DATA_STORAGE=unified: optional, all sectors when omitted)"),
     'series_name': fields.String(required=False, description="Series Name"),
     'subsector_1': fields.String(required=False, description="Subsector 1"),
     'subsector_2': fields.String(required=False, description="Subsector 2"),
+    'filters': fields.Raw(required=False, description="Extra dimensions to match, e.g. {\"grade\": \"Grade 1\"}"),
+    'fields': fields.List(fields.String, required=False, description="Only return these columns, e.g. [\"year\", \"province\", \"indicator_value\"]"),
+    'limit': fields.Integer(required=False, description="Page size; turns on keyset pagination"),
+    'after_id': fields.Integer(required=False, description="Return rows with an id above this one"),
+    'cursor': fields.String(required=False, description="next_cursor of the previous page"),
+})
+
+aggregate_model = rest_api.clone('AggregateModel', query_model, {
+    'group_by': fields.List(fields.String, required=False, description="Dimensions to group by, e.g. [\"year\", \"province\"]"),
+    'measures': fields.List(fields.String, required=False, description="Any of sum, avg, min, max, count (default: sum)"),
+})
+
+map_model = rest_api.model('MapModel', {
+    'sector': fields.String(required=True, description="Sector (DATA_STORAGE=unified: optional, all sectors when omitted)"),
+    'series_name': fields.String(required=False, description="Series Name"),
+    'subsector_1': fields.String(required=False, description="Subsector 1"),
+    'subsector_2': fields.String(required=False, description="Subsector 2"),
+    'filters': fields.Raw(required=False, description="Extra dimensions to match, e.g. {\"grade\": \"Grade 1\"}"),
+    'bbox': fields.List(fields.Float, required=True, description="Visible area as [west, south, east, north] in degrees"),
+    'zoom': fields.Integer(required=True, min=0, max=24, description="Map zoom level; low levels are clustered"),
+    'fields': fields.List(fields.String, required=False, description="Columns of each point besides id, latitude and longitude"),
 })
 
 chat_model = rest_api.model('ChatModel', {
@@ -69,17 +100,17 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, BaseConfig.SECRET_KEY, algorithms=["HS256"])
-            current_user = Users.get_by_email(data["email"])
+
+            # Revocations and users are served from memory, see api/auth.py
+            if revoked_tokens.contains(token_hash(token)):
+                return {"success": False, "msg": "Token revoked."}, 400
+
+            current_user = user_cache.get(data["email"])
 
             if not current_user:
                 return {"success": False,
                         "msg": "Sorry. Wrong auth token. This user does not exist."}, 400
 
-            token_expired = db.session.query(JWTTokenBlocklist.id).filter_by(jwt_token=token).scalar()
-
-            if token_expired is not None:
-                return {"success": False, "msg": "Token revoked."}, 400
-
             if not current_user.check_jwt_auth_active():
                 return {"success": False, "msg": "Token expired."}, 400
 
@@ -91,6 +122,158 @@ def token_required(f):
     return decorator
 
 
+"""
+   Helper function for calls to third-party services
+"""
+
+def upstream_errors(f):
+    """Turns a saturated, slow or failing upstream into a 503/504/502 instead of a hung worker."""
+
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except UpstreamBusy as e:
+            return {"success": False, "msg": str(e)}, 503
+        except UpstreamTimeout as e:
+            return {"success": False, "msg": str(e)}, 504
+        except (UpstreamError, ValueError) as e:
+            # ValueError: an upstream answer that is not the JSON we expected
+            return {"success": False, "msg": "Upstream request failed: " + str(e)}, 502
+
+    return decorator
+
+
+"""
+   Helper function for streamed query-data responses
+"""
+
+STREAM_FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+
+def requested_stream_format():
+    """
+       Streaming is opt-in: `?stream=json|ndjson`, or an Accept header that
+       prefers NDJSON. Returns None for the regular one-shot response.
+    """
+    stream = request.args.get('stream')
+    if stream:
+        return stream if stream in STREAM_FORMATS else 'json'
+
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    if best == 'application/x-ndjson' and request.accept_mimetypes[best] > request.accept_mimetypes['application/json']:
+        return 'ndjson'
+    return None
+
+
+def stream_data(model_class, filters, fields, stream_format):
+    """
+       Streams a get_data payload row by row from a server-side cursor.
+
+       json:   the regular {"data": [...], "filters": {...}} document, written
+               incrementally with `filters` as the trailer.
+       ndjson: one {"filters": {...}} frame, then one JSON object per row.
+    """
+    selection = model_class.select_data(fields=fields, **filters)
+    chunk_size = BaseConfig.STREAM_CHUNK_SIZE
+
+    def generate():
+        if stream_format == 'ndjson':
+            yield dumps({"filters": selection['filters']}) + b'\n'
+
+        rows = model_class.iter_data(selection, chunk_size=chunk_size)
+        if stream_format == 'json':
+            yield b'{"data": ['
+
+        buffer = []
+        separator = b''
+        for _, row in rows:
+            buffer.append(dumps(row))
+            if len(buffer) >= chunk_size:
+                yield encode_chunk(buffer, separator, stream_format)
+                buffer, separator = [], b', '
+        if buffer:
+            yield encode_chunk(buffer, separator, stream_format)
+
+        if stream_format == 'json':
+            yield b'], "filters": ' + dumps(selection['filters']) + b'}'
+
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format])
+
+
+def encode_chunk(encoded_rows, separator, stream_format):
+    if stream_format == 'ndjson':
+        return b'\n'.join(encoded_rows) + b'\n'
+    return separator + b', '.join(encoded_rows)
+
+
+def encode_response(result, format_name, content_encoding):
+    with phase('encode'):
+        body = encode_data(result, format_name)
+    with phase('compress'):
+        return compress(body, content_encoding)
+
+
+"""
+   Helper functions for paginated query-data responses
+"""
+
+PAGE_OPTIONS = ('fields', 'limit', 'after_id', 'cursor')
+
+
+def cursor_serializer():
+    return URLSafeSerializer(BaseConfig.SECRET_KEY, salt='query-data-cursor')
+
+
+def query_page(model_class, filters, fields, after_id, limit, cursor):
+    """
+       One keyset page of query-data. The first page resolves the selection
+       (pruned columns, facets) and returns the facets; its state travels in
+       a signed `next_cursor`, so later pages only read their rows. Facets
+       are recomputed and sent again if the table changed in between.
+    """
+    # As it reads back from the cursor's JSON
+    stamp = [list(version) for version in data_versions.stamp([model_class.__tablename__])]
+
+    if cursor:
+        try:
+            state = cursor_serializer().loads(cursor)
+        except BadSignature:
+            return {"success": False, "msg": "Invalid cursor"}, 400
+        if state['table'] != model_class.__tablename__ or state['filters'].get('sector') != filters.get('sector'):
+            return {"success": False, "msg": "Cursor belongs to another sector"}, 400
+        filters, fields, after_id, limit = state['filters'], state['fields'], state['after_id'], state['limit']
+
+    limit = min(limit or BaseConfig.QUERY_PAGE_SIZE, BaseConfig.QUERY_PAGE_MAX_SIZE)
+    if cursor and state['stamp'] == stamp:
+        selection = {'conditions': model_class.get_conditions(filters), 'columns': state['columns'],
+                     'extra_keys': set(state['extra_keys'])}
+        facets = None
+    else:
+        selection = model_class.select_data(fields=fields, **filters)
+        facets = selection['filters']
+
+    rows, last_id = model_class.get_page(selection, after_id=after_id, limit=limit)
+
+    next_cursor = None
+    if last_id is not None:
+        next_cursor = cursor_serializer().dumps({
+            'table': model_class.__tablename__, 'stamp': stamp, 'filters': filters, 'fields': fields,
+            'after_id': last_id, 'limit': limit, 'columns': selection['columns'],
+            'extra_keys': sorted(selection['extra_keys'])})
+
+    payload = {"data": rows, "next_cursor": next_cursor}
+    if facets is not None:
+        payload["filters"] = facets
+
+    content_encoding = negotiate_encoding(request, 'json')
+    with phase('encode'):
+        body = dumps(payload)
+    with phase('compress'):
+        body = compress(body, content_encoding)
+    return make_data_response(body, 'json', content_encoding)
+
+
 """
     Flask-Restx routes
 """
@@ -99,6 +282,7 @@ def token_required(f):
 class GenerateChat(Resource):
     """
     Generates an ECharts configuration for testing based on a natural language query.
+    Queries about a series of the hub chart its real data (see llm.generate_chart).
     Requires JWT authentication.
     """
     @rest_api.expect(chat_model, validate=True)
@@ -110,35 +294,24 @@ class GenerateChat(Resource):
             if not query:
                 return {"success": False, "msg": "No query provided"}, 400
 
-            # Prepare prompt for Gemini
-            prompt = f"""
-            You are an expert in generating ECharts configuration code for charts. Based on the user's query, generate an ECharts option object as a valid JSON string, compatible with echarts-for-react. Include sample data since no external data is provided. Return ONLY the JSON object as a string, without markdown (e.g., no ```json or ```), without explanations, and without any extra text or whitespace outside the JSON.
-
-            User Query:
-            {query}
-            """
-
-            # Call Gemini API
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            response = model.generate_content(prompt)
-
-            # Parse and validate the generated ECharts code
-            response_text = response.text.strip()
-            json_pattern = r'```json\s*(.*?)\s*```'
-            match = re.match(json_pattern, response_text, re.DOTALL)
-            if match:
-                json_str = match.group(1).strip()
-            else:
-                json_str = response_text
-            chart_config = json.loads(json_str)
-
-            return {
+            # Real data for series of the hub, else a cached, coalesced call to the model
+            models = [FactData] if current_app.config['DATA_STORAGE'] == 'unified' else SECTOR_MODELS
+            chart_config, source = generate_chart(query, models, resolve_sector)
+
+            response = {
                 "success": True,
                 "chartConfig": chart_config
-            }, 200
+            }
+            if source is not None:
+                response["source"] = source
+            return response, 200
 
         except json.JSONDecodeError:
             return {"success": False, "msg": "Invalid ECharts configuration generated"}, 500
+        except UpstreamBusy as e:
+            return {"success": False, "msg": str(e)}, 503
+        except UpstreamTimeout as e:
+            return {"success": False, "msg": str(e)}, 504
         except Exception as e:
             return {"success": False, "msg": str(e)}, 500
 
@@ -149,57 +322,356 @@ class QueryData(Resource):
     def post(self):
         data = rest_api.payload
 
-        # Call the `query` method of the EducationData model
-        sector = data.get('sector', None)
-
         # Dynamically select the model based on sector
-        if sector == "Education":
-            ModelClass = EducationData
-        elif sector == "Agriculture":
-            ModelClass = AgricultureData
-        elif sector == "Economic":
-            ModelClass = EconomicData
-
+        ModelClass, scope = resolve_sector(data.get('sector', None))
         if not ModelClass:
-            return {"error": "Invalid sector. Supported sectors: Education, Agriculture"}, 400
-        
-        # Prepare filters (excluding 'sector' itself)
-        filters = {key: value for key, value in data.items() if key != 'sector'}
-        
-        # Query data dynamically
-        filtered_data = ModelClass.get_data(**filters)
+            return {"success": False, "msg": "Invalid sector. Supported sectors: " + ", ".join(scope)}, 400
+
+        # Prepare filters (excluding 'sector' itself and the paging/projection options)
+        filters = dict(scope, **{key: value for key, value in data.items() if key != 'sector' and key not in PAGE_OPTIONS})
+        invalid = invalid_filters(filters, ModelClass.data_columns)
+        if invalid:
+            return {"success": False, "msg": invalid}, 400
+        fields = data.get('fields') or None
+        invalid = invalid_fields(ModelClass, fields)
+        if invalid:
+            return {"success": False, "msg": invalid}, 400
+        query_log.record(ModelClass.__tablename__, filters)
+
+        if data.get('cursor') or data.get('limit') is not None or data.get('after_id') is not None:
+            try:
+                after_id = None if data.get('after_id') is None else int(data['after_id'])
+                limit = None if data.get('limit') is None else int(data['limit'])
+            except (TypeError, ValueError):
+                return {"success": False, "msg": "after_id and limit must be integers"}, 400
+            if limit is not None and limit < 1:
+                return {"success": False, "msg": "limit must be positive"}, 400
+            return query_page(ModelClass, filters, fields, after_id, limit, data.get('cursor'))
+
+        stream_format = requested_stream_format()
+        if stream_format:
+            return stream_data(ModelClass, filters, fields, stream_format)
+
+        format_name = negotiate_format(request)
+        if format_name is None:
+            return {"success": False, "msg": "Unsupported format. Supported formats: " + ", ".join(FORMATS)}, 406
+        content_encoding = negotiate_encoding(request, format_name)
+
+        # Query data dynamically, or replay the cached, encoded response for this filter set
+        body = result_cache.get_or_compute(
+            ModelClass.__tablename__, dict(filters, fields=fields, format=format_name, encoding=content_encoding),
+            lambda: encode_response(ModelClass.get_data(fields=fields, **filters), format_name, content_encoding))
+
+        return make_data_response(body, format_name, content_encoding)
+
+
+@rest_api.route('/api/cache/stats')
+class CacheStats(Resource):
+    """
+       Hit/miss/eviction counters of this worker's caches, for tuning. Public,
+       like the same counters on /metrics
+    """
+    def get(self):
+        return {"success": True,
+                "result_cache": result_cache.stats(),
+                "chart_cache": chart_cache.stats(),
+                "chart_templates": template_cache.stats(),
+                "upstreams": {name: upstream.stats() for name, upstream in upstreams.items()}}, 200
+
+SECTOR_MODELS = [EducationData, AgricultureData, EconomicData]
+
+SECTORS = {"Education": EducationData, "Agriculture": AgricultureData, "Economic": EconomicData}
+
+# Sector names registered for the unified fact table
+sector_registry = VersionedCache(Sector.get_names, [FactData.__tablename__])
+
+
+def resolve_sector(sector):
+    """
+       (model, scope filters) serving `sector`, or (None, the supported
+       sectors). With DATA_STORAGE=unified a sector is a filter on the fact
+       table, and no sector at all selects every sector.
+    """
+    if current_app.config['DATA_STORAGE'] == 'unified':
+        if not sector:
+            return FactData, {}
+        names = sector_registry.get()['value']
+        return (FactData, {'sector': sector}) if sector in names else (None, names)
+
+    return (SECTORS[sector], {}) if sector in SECTORS else (None, list(SECTORS))
+
+
+def is_scalar(value):
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def invalid_filters(filters, columns):
+    """
+       Why /api/query-data, /api/aggregate and /api/map-points refuse a
+       filter set, or None: column filters take scalars of `columns`, the
+       `filters` entry an object of extra dimensions with scalar or list
+       values.
+    """
+    unknown = [key for key in filters if key != 'filters' and key not in columns]
+    if unknown:
+        return "Unknown filter: " + ", ".join(unknown)
+
+    invalid = [key for key, value in filters.items() if key != 'filters' and not is_scalar(value)]
+    if invalid:
+        return "Filters take a single value: " + ", ".join(invalid)
+
+    extra = filters.get('filters')
+    if extra is not None and (not isinstance(extra, dict) or not all(
+            is_scalar(value) or isinstance(value, list) and all(is_scalar(item) for item in value)
+            for value in extra.values())):
+        return "filters takes an object of extra dimensions with scalar or list values"
+    return None
+
+
+def invalid_fields(model_class, fields):
+    """Why /api/query-data refuses `fields`, or None: it takes a list of data columns and extra dimensions."""
+    if fields is None:
+        return None
+    # The extra dimensions of the table, from the facet index
+    known = set(model_class.data_columns) | set(facet_store.get(model_class).lookup({}).extra)
+    if not isinstance(fields, list) or not all(isinstance(name, str) and name in known for name in fields):
+        return "fields takes a list of columns of " + ", ".join(model_class.data_columns) + " or extra dimensions"
+    return None
+
+
+def build_menu():
+    # Initialize an empty dictionary to store the aggregated data
+    aggregated_menu = defaultdict(lambda: defaultdict(list))
+    aggregated_series_name = []
+
+    # Query hierarchical data from all sector models (one pass over the fact table when unified)
+    models = [FactData] if current_app.config['DATA_STORAGE'] == 'unified' else SECTOR_MODELS
+    for model_class in models:
+        filtered_data, series_name_list = model_class.get_menu()
+
+        # Merge the dictionaries
+        for key, sub_dict in filtered_data.items():
+            for sub_key, sub_value in sub_dict.items():
+                aggregated_menu[key][sub_key].extend(sub_value)
+
+        # Extend the list instead of appending
+        aggregated_series_name.extend(series_name_list)
+
+    # Convert back to a regular dictionary if needed
+    aggregated_menu = {k: dict(v) for k, v in aggregated_menu.items()}
+
+    return {"menu": aggregated_menu, "data_explorer": aggregated_series_name}
+
+
+# Rebuilt only when one of the sector tables changes
+menu_cache = VersionedCache(build_menu, [model.__tablename__ for model in SECTOR_MODELS + [FactData]])
 
-        if not filtered_data:
-            return {"message": "No data found matching the criteria."}, 404
-        
-        return filtered_data, 200
 
 @rest_api.route('/api/query-menu')
 class QueryMenu(Resource):
     def get(self):
-        print("Hello")
-        ModelClasses = [EducationData, AgricultureData, EconomicData]
-        
-        # Initialize an empty dictionary to store the aggregated data
-        aggregated_menu = defaultdict(lambda: defaultdict(list))
-        aggregated_series_name = []
+        menu = menu_cache.get()
+        headers = {"ETag": '"%s"' % menu['etag'], "Cache-Control": "no-cache"}
 
-        # Query hierarchical data from all sector models
-        for model_class in ModelClasses:
-            filtered_data, series_name_list = model_class.get_menu()
+        if request.if_none_match.contains(menu['etag']):
+            return Response(status=304, headers=headers)
 
-            # Merge the dictionaries
-            for key, sub_dict in filtered_data.items():
-                for sub_key, sub_value in sub_dict.items():
-                    aggregated_menu[key][sub_key].extend(sub_value)
+        return Response(menu['body'], mimetype='application/json', headers=headers)
 
-            # Extend the list instead of appending
-            aggregated_series_name.extend(series_name_list)
 
-        # Convert back to a regular dictionary if needed
-        aggregated_menu = {k: dict(v) for k, v in aggregated_menu.items()}
+@rest_api.route('/api/aggregate')
+class AggregateData(Resource):
+    """
+       Aggregates indicator_value in the database instead of shipping raw rows:
+       column-oriented {"columns": {name: [values]}}, one entry per group
+    """
+
+    @rest_api.expect(aggregate_model)
+    def post(self):
+        data = rest_api.payload
+
+        ModelClass, scope = resolve_sector(data.get('sector'))
+        if not ModelClass:
+            return {"success": False, "msg": "Invalid sector. Supported sectors: " + ", ".join(scope)}, 400
+
+        group_by = data.get('group_by') or []
+        measures = data.get('measures') or ['sum']
+
+        invalid = [name for name in group_by if name not in ModelClass.group_columns]
+        invalid += [name for name in measures if name not in ModelClass.aggregate_functions]
+        if invalid or len(set(group_by)) != len(group_by) or len(set(measures)) != len(measures):
+            return {"success": False,
+                    "msg": "Invalid group_by or measures: group_by takes distinct columns of "
+                           + ", ".join(ModelClass.group_columns) + "; measures distinct names of "
+                           + ", ".join(ModelClass.aggregate_functions)}, 400
+
+        # Same filters as /api/query-data
+        filters = dict(scope, **{key: value for key, value in data.items() if key not in ('sector', 'group_by', 'measures')})
+        invalid = invalid_filters(filters, ModelClass.group_columns)
+        if invalid:
+            return {"success": False, "msg": invalid}, 400
+
+        format_name = negotiate_format(request)
+        if format_name is None:
+            return {"success": False, "msg": "Unsupported format. Supported formats: " + ", ".join(FORMATS)}, 406
+        content_encoding = negotiate_encoding(request, format_name)
+
+        def compute():
+            columns = ModelClass.aggregate(group_by, measures, **filters)
+            meta = {"success": True,
+                    "group_by": group_by,
+                    "measures": measures,
+                    "rows": len(next(iter(columns.values()), []))}
+            with phase('encode'):
+                body = encode_columns(columns, meta, format_name)
+            with phase('compress'):
+                return compress(body, content_encoding)
+
+        body = result_cache.get_or_compute(
+            ModelClass.__tablename__,
+            dict(filters, group_by=group_by, measures=measures, format=format_name, encoding=content_encoding), compute)
+        return make_data_response(body, format_name, content_encoding)
+
+
+@rest_api.route('/api/facets')
+class Facets(Resource):
+    """
+       Cascading filter options with row counts, from the in-memory facet
+       index: the hierarchy levels left to pick and every facet of the
+       selection, each as [{value, count}]. Takes sector, subsector_1,
+       subsector_2 and series_name as query arguments.
+    """
 
-        return {"menu": aggregated_menu, "data_explorer": aggregated_series_name}, 200
+    def get(self):
+        unknown = [key for key in request.args if key not in HIERARCHY]
+        if unknown:
+            return {"success": False, "msg": "Unknown filter: " + ", ".join(unknown)}, 400
+
+        ModelClass, scope = resolve_sector(request.args.get('sector'))
+        if not ModelClass:
+            return {"success": False, "msg": "Invalid sector. Supported sectors: " + ", ".join(scope)}, 400
+
+        filters = dict(scope, **{key: value for key, value in request.args.items() if key != 'sector' and value})
+        with phase('facets'):
+            document = facet_store.get(ModelClass).describe(filters)
+        return dict(document, success=True), 200
+
+
+@rest_api.route('/api/search')
+class SearchSeries(Resource):
+    """
+       Series search for the data explorer: ?q= matches series names,
+       indicators, subsectors and tags by word, prefix or with typos,
+       best matches first. Optional ?sector= and ?limit=
+    """
+
+    def get(self):
+        query = request.args.get('q', '').strip()
+        if not query:
+            return {"success": False, "msg": "q is required"}, 400
+
+        try:
+            limit = min(int(request.args.get('limit', current_app.config['SEARCH_LIMIT'])),
+                        current_app.config['SEARCH_MAX_LIMIT'])
+        except ValueError:
+            return {"success": False, "msg": "limit must be an integer"}, 400
+        if limit < 1:
+            return {"success": False, "msg": "limit must be positive"}, 400
+
+        models = [FactData] if current_app.config['DATA_STORAGE'] == 'unified' else SECTOR_MODELS
+        with phase('search'):
+            results = series_search.search(models, query, limit, sector=request.args.get('sector') or None)
+        return {"success": True, "query": query, "results": results}, 200
+
+
+# Point columns /api/map-points returns when no `fields` are given
+MAP_POINT_FIELDS = ['id', 'latitude', 'longitude', 'indicator_value', 'series_name', 'indicator', 'province', 'year']
+
+
+@rest_api.route('/api/map-points')
+class MapPoints(Resource):
+    """
+       The located rows inside the visible bounding box, column-oriented.
+       Below MAP_CLUSTER_MAX_ZOOM, or when the view holds more than
+       MAP_MAX_POINTS, they are clustered on a grid of MAP_CLUSTER_GRID cells
+       per map tile instead: {"clustered": true, "columns": {cell_lat,
+       cell_lon, count, latitude, longitude, indicator_value}}
+    """
+
+    @rest_api.expect(map_model)
+    def post(self):
+        data = rest_api.payload
+
+        ModelClass, scope = resolve_sector(data.get('sector'))
+        if not ModelClass:
+            return {"success": False, "msg": "Invalid sector. Supported sectors: " + ", ".join(scope)}, 400
+
+        bbox, zoom = data['bbox'], data['zoom']
+        if len(bbox) != 4 or not (-180 <= bbox[0] <= 180 and -180 <= bbox[2] <= 180
+                                  and -90 <= bbox[1] <= bbox[3] <= 90):
+            return {"success": False, "msg": "bbox takes [west, south, east, north] in degrees, south below north"}, 400
+
+        fields = data.get('fields') or MAP_POINT_FIELDS
+        invalid = [name for name in fields if name not in ModelClass.data_columns]
+        if invalid:
+            return {"success": False, "msg": "fields takes columns of " + ", ".join(ModelClass.data_columns)}, 400
+
+        filters = dict(scope, **{key: value for key, value in data.items()
+                                 if key not in ('sector', 'bbox', 'zoom', 'fields')})
+        invalid = invalid_filters(filters, ModelClass.group_columns)
+        if invalid:
+            return {"success": False, "msg": invalid}, 400
+
+        format_name = negotiate_format(request)
+        if format_name is None:
+            return {"success": False, "msg": "Unsupported format. Supported formats: " + ", ".join(FORMATS)}, 406
+        content_encoding = negotiate_encoding(request, format_name)
+
+        config = current_app.config
+        # A tile spans 360 / 2**zoom degrees of longitude
+        cell_size = 360.0 / 2 ** zoom / config['MAP_CLUSTER_GRID']
+        max_points = config['MAP_MAX_POINTS']
+        clustered = zoom < config['MAP_CLUSTER_MAX_ZOOM']
+        if clustered:
+            # Snap the view outwards to whole cells, so panning keeps clusters (and cache keys) stable
+            bbox = snap_bbox(bbox, cell_size)
+
+        def compute():
+            is_clustered = clustered
+            if not is_clustered:
+                columns = ModelClass.get_points(bbox, fields, limit=max_points + 1, **filters)
+                is_clustered = len(columns['id']) > max_points
+            if is_clustered:
+                columns = ModelClass.get_clusters(bbox, cell_size, **filters)
+            meta = {"success": True,
+                    "clustered": is_clustered,
+                    "bbox": bbox,
+                    "zoom": zoom,
+                    "rows": len(next(iter(columns.values()), []))}
+            if is_clustered:
+                meta["cell_size"] = cell_size
+            with phase('encode'):
+                body = encode_columns(columns, meta, format_name)
+            with phase('compress'):
+                return compress(body, content_encoding)
+
+        body = result_cache.get_or_compute(
+            ModelClass.__tablename__,
+            dict(filters, bbox=bbox, zoom=zoom, fields=fields, format=format_name, encoding=content_encoding), compute)
+        return make_data_response(body, format_name, content_encoding)
+
+
+def snap_bbox(bbox, cell_size):
+    """`bbox` grown to the edges of the cells of the cluster grid it touches."""
+    west, south, east, north = bbox
+
+    def down(value, offset):
+        return math.floor((value + offset) / cell_size) * cell_size - offset
+
+    def up(value, offset):
+        return math.ceil((value + offset) / cell_size) * cell_size - offset
+
+    return [max(down(west, 180), -180), max(down(south, 90), -90), min(up(east, 180), 180), min(up(north, 90), 90)]
 
 
 @rest_api.route('/api/users/register')
@@ -304,8 +776,7 @@ class LogoutUser(Resource):
 
         _jwt_token = request.headers["authorization"]
 
-        jwt_block = JWTTokenBlocklist(jwt_token=_jwt_token, created_at=datetime.now(timezone.utc))
-        jwt_block.save()
+        revoke(_jwt_token, jwt.decode(_jwt_token, BaseConfig.SECRET_KEY, algorithms=["HS256"]))
 
         self.set_jwt_auth_active(False)
         self.save()
@@ -315,22 +786,23 @@ class LogoutUser(Resource):
 
 @rest_api.route('/api/sessions/oauth/github/')
 class GitHubLogin(Resource):
+    @upstream_errors
     def get(self):
         code = request.args.get('code')
         client_id = BaseConfig.GITHUB_CLIENT_ID
         client_secret = BaseConfig.GITHUB_CLIENT_SECRET
-        root_url = 'https://github.com/login/oauth/access_token'
+        root_url = BaseConfig.GITHUB_TOKEN_URL
 
         params = { 'client_id': client_id, 'client_secret': client_secret, 'code': code }
 
-        data = requests.post(root_url, params=params, headers={
+        data = http_request('POST', root_url, params=params, headers={
             'Content-Type': 'application/x-www-form-urlencoded',
         })
 
         response = data._content.decode('utf-8')
         access_token = response.split('&')[0].split('=')[1]
 
-        user_data = requests.get('https://api.github.com/user', headers={
+        user_data = http_request('GET', BaseConfig.GITHUB_USER_URL, headers={
             "Authorization": "Bearer " + access_token
         }).json()
         
@@ -362,11 +834,12 @@ class GitHubLogin(Resource):
 
 @rest_api.route('/api/sessions/oauth/google/')
 class GoogleLogin(Resource):
+    @upstream_errors
     def get(self):
         code = request.args.get('code')
         client_id = BaseConfig.GOOGLE_CLIENT_ID  # Loaded from .env
         client_secret = BaseConfig.GOOGLE_CLIENT_SECRET  # Loaded from .env
-        root_url = 'https://oauth2.googleapis.com/token'  # Google's token endpoint
+        root_url = BaseConfig.GOOGLE_TOKEN_URL  # Google's token endpoint
 
         # Parameters for the token request
         params = {
@@ -378,7 +851,7 @@ class GoogleLogin(Resource):
         }
 
         # Get the access token from Google
-        data = requests.post(root_url, data=params, headers={
+        data = http_request('POST', root_url, data=params, headers={
             'Content-Type': 'application/x-www-form-urlencoded',
         })
 
@@ -389,8 +862,8 @@ class GoogleLogin(Resource):
             return {"success": False, "msg": "Failed to obtain access token from Google."}, 400
 
         # Use the access token to fetch the user's Google profile
-        user_info_url = 'https://www.googleapis.com/oauth2/v2/userinfo'
-        user_data = requests.get(user_info_url, headers={
+        user_info_url = BaseConfig.GOOGLE_USERINFO_URL
+        user_data = http_request('GET', user_info_url, headers={
             'Authorization': f'Bearer {access_token}'
         }).json()
 
@@ -0,0 +1,203 @@
+# -*- encoding: utf-8 -*-
+"""
+   Schema upkeep for databases created before a model change.
+
+   db.create_all() only creates missing tables; it never touches tables that
+   already exist. The helpers here bring existing tables up to date, and
+   create the spatial indexes, which are not part of the metadata.
+"""
+
+from sqlalchemy import Float, MetaData, String, inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from .models import db
+
+
+def ensure_columns(models, bind=None):
+    """
+       Adds declared columns that are missing from existing tables (ALTER
+       TABLE ... ADD COLUMN). Accepts models or Table objects. Returns the
+       "table.column" names added.
+    """
+    engine = db.get_engine(bind=bind)
+    inspector = inspect(engine)
+    added = []
+
+    for model in models:
+        table = getattr(model, '__table__', model)
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                with engine.begin() as connection:
+                    connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+                added.append(f'{table.name}.{column.name}')
+
+    return added
+
+
+def ensure_indexes(models, bind=None):
+    """
+       Creates the declared indexes of `models` that are missing from the
+       database. Returns the names of the indexes created.
+    """
+    engine = db.get_engine(bind=bind)
+    inspector = inspect(engine)
+    created = []
+
+    for model in models:
+        table = getattr(model, '__table__', model)
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+
+    return created
+
+
+# A string holding one number, as in "11.5623" or " -1e3 "
+SQLITE_NUMBER = "TRIM({0}) GLOB '*[0-9]*' AND NOT TRIM({0}) GLOB '*[^-+.eE0-9]*'"
+POSTGRESQL_NUMBER = r"{0} ~ '^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'"
+
+
+def ensure_column_types(models, bind=None):
+    """
+       Converts columns now declared numeric (Float) that an older schema
+       created as strings; values that are not a number become NULL.
+       PostgreSQL alters the column in place. SQLite cannot, so the table is
+       rebuilt: copied into a new table of the declared schema, swapped in,
+       and its indexes recreated. Returns the "table.column" names converted.
+    """
+    engine = db.get_engine(bind=bind)
+    inspector = inspect(engine)
+    converted = []
+
+    for model in models:
+        table = getattr(model, '__table__', model)
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        stale = [column for column in table.columns
+                 if isinstance(column.type, Float) and isinstance(existing.get(column.name), String)]
+        if not stale:
+            continue
+
+        with engine.begin() as connection:
+            if engine.dialect.name == 'sqlite':
+                rebuild_sqlite_table(connection, table, stale)
+            else:
+                for column in stale:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE double precision USING '
+                        f'CASE WHEN {POSTGRESQL_NUMBER.format(column.name)} '
+                        f'THEN TRIM({column.name})::double precision END')
+        converted.extend(f'{table.name}.{column.name}' for column in stale)
+
+    return converted
+
+
+def rebuild_sqlite_table(connection, table, stale):
+    """Recreates `table` with its declared column types, converting the `stale` string columns."""
+    columns = [column.name for column in table.columns
+               if column.name in {column['name'] for column in inspect(connection).get_columns(table.name)}]
+    values = [f'CASE WHEN {SQLITE_NUMBER.format(name)} THEN CAST(TRIM({name}) AS REAL) END'
+              if name in {column.name for column in stale} else name
+              for name in columns]
+
+    metadata = MetaData()
+    for foreign_key in table.foreign_keys:
+        foreign_key.column.table.to_metadata(metadata)
+    staging = table.to_metadata(metadata, name=f'{table.name}__rebuild')
+    connection.execute(CreateTable(staging))
+    connection.exec_driver_sql(f'INSERT INTO {staging.name} ({", ".join(columns)}) '
+                               f'SELECT {", ".join(values)} FROM {table.name}')
+    connection.exec_driver_sql(f'DROP TABLE {table.name}')
+    connection.exec_driver_sql(f'ALTER TABLE {staging.name} RENAME TO {table.name}')
+    for index in table.indexes:
+        index.create(bind=connection)
+
+
+def ensure_spatial_indexes(tables, bind=None):
+    """
+       Spatial index on the latitude/longitude of `tables`: an R-tree kept in
+       step by triggers on SQLite, a GiST index on point(longitude,
+       latitude) on PostgreSQL. Other backends make do with the B-tree on
+       (latitude, longitude). Returns the names of what was created.
+    """
+    engine = db.get_engine(bind=bind)
+    inspector = inspect(engine)
+    created = []
+
+    for table in tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        if engine.dialect.name == 'sqlite':
+            rtree = f'{table.name}_rtree'
+            triggers = {f'{rtree}_insert', f'{rtree}_update', f'{rtree}_delete'}
+            with engine.begin() as connection:
+                existing = {name for name, in connection.exec_driver_sql(
+                    "SELECT name FROM sqlite_master WHERE tbl_name IN (?, ?)", (table.name, rtree))}
+                if rtree in existing and triggers <= existing:
+                    continue
+                try:
+                    create_sqlite_rtree(connection, table.name, rtree)
+                except OperationalError:
+                    # SQLite built without the R*Tree module
+                    continue
+            created.append(rtree)
+
+        elif engine.dialect.name == 'postgresql':
+            name = f'ix_{table.name}_location_gist'
+            if name not in {index['name'] for index in inspector.get_indexes(table.name)}:
+                with engine.begin() as connection:
+                    connection.exec_driver_sql(
+                        f'CREATE INDEX {name} ON {table.name} USING gist (point(longitude, latitude))')
+                created.append(name)
+
+    return created
+
+
+def create_sqlite_rtree(connection, table_name, rtree):
+    """(Re)creates the R-tree of `table_name`, its triggers and its contents."""
+    located = 'new.latitude IS NOT NULL AND new.longitude IS NOT NULL'
+    row = 'new.id, new.latitude, new.latitude, new.longitude, new.longitude'
+
+    connection.exec_driver_sql(f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} '
+                               f'USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+    for statement in (
+            f'DROP TRIGGER IF EXISTS {rtree}_insert',
+            f'DROP TRIGGER IF EXISTS {rtree}_update',
+            f'DROP TRIGGER IF EXISTS {rtree}_delete',
+            f'CREATE TRIGGER {rtree}_insert AFTER INSERT ON {table_name} WHEN {located} '
+            f'BEGIN INSERT OR REPLACE INTO {rtree} VALUES ({row}); END',
+            f'CREATE TRIGGER {rtree}_update AFTER UPDATE OF id, latitude, longitude ON {table_name} '
+            f'BEGIN DELETE FROM {rtree} WHERE id = old.id; '
+            f'INSERT OR REPLACE INTO {rtree} SELECT {row} WHERE {located}; END',
+            f'CREATE TRIGGER {rtree}_delete AFTER DELETE ON {table_name} '
+            f'BEGIN DELETE FROM {rtree} WHERE id = old.id; END',
+            f'DELETE FROM {rtree}',
+            f'INSERT INTO {rtree} SELECT id, latitude, latitude, longitude, longitude FROM {table_name} '
+            f'WHERE latitude IS NOT NULL AND longitude IS NOT NULL'):
+        connection.exec_driver_sql(statement)
+
+
+def upgrade(bind=None):
+    """
+       Creates missing tables, then converts, adds and indexes the columns of
+       existing ones, and builds the spatial indexes.
+    """
+    db.create_all(bind=bind)
+    tables = db.metadata.sorted_tables
+    located = [table for table in tables if 'latitude' in table.c and 'longitude' in table.c]
+    return ensure_column_types(tables, bind=bind) + ensure_columns(tables, bind=bind) \
+        + ensure_indexes(tables, bind=bind) + ensure_spatial_indexes(located, bind=bind)
@@ -0,0 +1,225 @@
+# -*- encoding: utf-8 -*-
+"""
+   Series search for /api/search.
+
+   One document per (sector, series_name), holding the series' subsectors,
+   indicators and tags. The index is in-process: an inverted index from
+   word to documents, a sorted vocabulary for prefix matches and a trigram
+   index over the vocabulary for typo-tolerant ones (a bounded edit
+   distance confirms each trigram candidate). Searches never touch the
+   database and behave the same on SQLite and PostgreSQL.
+
+   Documents are read per source table and re-read only for the tables
+   whose data_version moved (an ingest, an ORM write); the word index over
+   all of them is rebuilt from the cached documents, which takes a few
+   milliseconds for thousands of series.
+"""
+
+import heapq, re, threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import islice
+
+from sqlalchemy import select
+
+from .caching import data_versions
+from .models import db
+
+# How much a match in each field counts
+FIELD_WEIGHTS = {'series_name': 3.0, 'indicator': 2.0, 'subsector_1': 1.5, 'subsector_2': 1.5, 'tag': 1.0,
+                 'sector': 1.0}
+
+# A prefix match counts for this much of an exact one, a typo for this much per edit less
+PREFIX_SCORE = 0.8
+TYPO_SCORE = 0.3
+
+# Words a prefix may expand to, and the shortest term typos are tolerated in
+MAX_EXPANSIONS = 50
+FUZZY_MIN_LENGTH = 4
+
+WORD = re.compile(r'\w+')
+
+# Query words too common to say anything about a series
+STOP_WORDS = {'a', 'an', 'and', 'at', 'by', 'for', 'from', 'in', 'of', 'on', 'or', 'per', 'the', 'to', 'with'}
+
+
+def tokenize(text):
+    return WORD.findall(text.casefold()) if text else []
+
+
+def trigrams(word):
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance of `a` and `b`, or limit + 1 once it is known to exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+
+def load_documents(model):
+    """The search documents of one source table, from one DISTINCT scan."""
+    names = ['sector', 'series_name', 'subsector_1', 'subsector_2', 'indicator', 'tag']
+    query = select(*[getattr(model, name) for name in names]) \
+        .select_from(model.from_clause(names)) \
+        .where(model.series_name.isnot(None), model.series_name != '') \
+        .distinct()
+
+    documents = {}
+    for row in db.session.execute(query):
+        values = dict(zip(names, row))
+        document = documents.setdefault((values['sector'], values['series_name']), {
+            'sector': values['sector'], 'series_name': values['series_name'],
+            'subsector_1': set(), 'subsector_2': set(), 'indicator': set(), 'tag': set()})
+        for name in ('subsector_1', 'subsector_2', 'indicator', 'tag'):
+            if values[name]:
+                document[name].add(values[name])
+    return list(documents.values())
+
+
+class Index():
+    """An immutable word index over a list of documents."""
+
+    def __init__(self, stamp, documents):
+        self.stamp = stamp
+        # Shorter series names first, so document order breaks score ties
+        self.documents = sorted(documents, key=lambda document: (len(document['series_name']),
+                                                                 document['series_name'], document['sector'] or ''))
+
+        postings = defaultdict(dict)
+        for position, document in enumerate(self.documents):
+            for field, weight in FIELD_WEIGHTS.items():
+                values = document[field]
+                for value in [values] if isinstance(values, str) else values:
+                    for word in tokenize(value):
+                        if postings[word].get(position, 0) < weight:
+                            postings[word][position] = weight
+        self.postings = dict(postings)
+        self.words = sorted(self.postings)
+
+        grams = defaultdict(list)
+        for word in self.words:
+            for gram in trigrams(word):
+                grams[gram].append(word)
+        self.trigrams = dict(grams)
+
+    def expand(self, term):
+        """{word: similarity} of the indexed words `term` matches: itself, by prefix, or with typos."""
+        matches = {term: 1.0} if term in self.postings else {}
+
+        start = bisect_left(self.words, term)
+        for word in islice(self.words, start, start + MAX_EXPANSIONS):
+            if not word.startswith(term):
+                break
+            matches.setdefault(word, PREFIX_SCORE)
+
+        if len(term) >= FUZZY_MIN_LENGTH:
+            limit = 1 if len(term) < 8 else 2
+            grams = trigrams(term)
+            shared = Counter(word for gram in grams for word in self.trigrams.get(gram, ()))
+            for word, count in shared.items():
+                # An edit changes at most three trigrams (one more is lost when the word runs on)
+                if word in matches or count < len(grams) - 3 * limit - 1 or len(word) < len(term) - limit:
+                    continue
+                # Typos in a prefix count too: "enrol" -> "enrollment"
+                whole, prefix = edit_distance(term, word, limit), edit_distance(term, word[:len(term)], limit)
+                if whole <= min(prefix, limit):
+                    matches[word] = 1.0 - TYPO_SCORE * whole
+                elif prefix <= limit:
+                    matches[word] = PREFIX_SCORE - TYPO_SCORE * prefix
+        return matches
+
+    def search(self, query, limit, sector=None):
+        """
+           The best `limit` documents for `query`, as result dicts. Documents
+           matching more of the query's words come first, then by score.
+        """
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term not in STOP_WORDS]
+        # Worth more than the scores of all terms together, so matching one more term always wins
+        bonus = max(FIELD_WEIGHTS.values()) * len(terms) + 1
+        totals = {}
+        matched_words = set()
+
+        for term in terms:
+            best = {}
+            for word, similarity in self.expand(term).items():
+                matched_words.add(word)
+                postings = self.postings[word]
+                if not best:
+                    best = {position: weight * similarity for position, weight in postings.items()}
+                    continue
+                for position, weight in postings.items():
+                    score = weight * similarity
+                    if score > best.get(position, 0):
+                        best[position] = score
+            for position, score in best.items():
+                totals[position] = totals.get(position, 0) + bonus + score
+
+        documents = self.documents
+        ranked = heapq.nsmallest(limit, ((-total, position) for position, total in totals.items()
+                                         if sector is None or documents[position]['sector'] == sector))
+        return [self.result(documents[position], -total % bonus, matched_words) for total, position in ranked]
+
+    @staticmethod
+    def result(document, score, matched_words):
+        matches = {}
+        for field in ('indicator', 'subsector_1', 'subsector_2', 'tag'):
+            values = sorted(value for value in document[field] if matched_words.intersection(tokenize(value)))
+            if values:
+                matches[field] = values
+        return {
+            'sector': document['sector'],
+            'series_name': document['series_name'],
+            'subsector_1': sorted(document['subsector_1']),
+            'score': round(score, 3),
+            'matches': matches,
+        }
+
+
+class SeriesSearch():
+    """
+       Keeps the Index of the current data: documents are cached per source
+       table with the data_version they were read at, and only the tables
+       whose version moved are read again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._index = None
+
+    def get(self, models):
+        stamp = data_versions.stamp([model.__tablename__ for model in models])
+        index = self._index
+        if index is not None and index.stamp == stamp:
+            return index
+
+        with self._lock:
+            if self._index is None or self._index.stamp != stamp:
+                versions = dict(stamp)
+                for model in models:
+                    cached = self._documents.get(model.__tablename__)
+                    if cached is None or cached[0] != versions[model.__tablename__]:
+                        self._documents[model.__tablename__] = (versions[model.__tablename__], load_documents(model))
+                self._index = Index(stamp, [document for model in models
+                                            for document in self._documents[model.__tablename__][1]])
+            return self._index
+
+    def search(self, models, query, limit, sector=None):
+        return self.get(models).search(query, limit, sector=sector)
+
+
+series_search = SeriesSearch()
@@ -0,0 +1,114 @@
+# -*- encoding: utf-8 -*-
+"""
+   Bounded execution of calls to slow third-party services (Gemini, OAuth).
+
+   Each upstream gets a small dedicated thread pool, a concurrency limit and
+   a per-call deadline. When an upstream is saturated new calls fail fast
+   with UpstreamBusy instead of queueing. Chat requests that wait on an
+   identical prompt already in flight (llm.SingleFlight) are capped the
+   same way by CHAT_MAX_FOLLOWERS, so a slow upstream holds at most
+   max_concurrency + CHAT_MAX_FOLLOWERS request threads and the rest of
+   the API keeps serving. HTTP calls share one keep-alive session per
+   process.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from .config import BaseConfig
+
+
+class UpstreamBusy(Exception):
+    pass
+
+
+class UpstreamTimeout(Exception):
+    pass
+
+
+class UpstreamError(Exception):
+    """The upstream answered with a transport error (requests.RequestException)."""
+    pass
+
+
+class Upstream():
+
+    def __init__(self, name, max_concurrency, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f'upstream-{name}')
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def call(self, fn, *args, **kwargs):
+        """
+           Runs fn(*args, **kwargs) on the pool and waits at most `timeout`
+           seconds. A slot stays taken until the call really finishes, so
+           timed-out calls still count against the limit.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise UpstreamBusy(f"{self.name} is busy, try again shortly")
+
+        with self._lock:
+            self.calls += 1
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise UpstreamTimeout(f"{self.name} did not answer within {self.timeout}s")
+
+    def stats(self):
+        return {"max_concurrency": self.max_concurrency, "timeout": self.timeout,
+                "calls": self.calls, "rejected": self.rejected, "timeouts": self.timeouts}
+
+
+def make_http_session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """The shared keep-alive session, created (and `requests` imported) on the first OAuth call."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = make_http_session(BaseConfig.OAUTH_MAX_CONCURRENCY)
+    return _http_session
+
+upstreams = {
+    'chat': Upstream('chat', BaseConfig.CHAT_MAX_CONCURRENCY, BaseConfig.CHAT_TIMEOUT),
+    'oauth': Upstream('oauth', BaseConfig.OAUTH_MAX_CONCURRENCY, BaseConfig.OAUTH_TIMEOUT),
+}
+
+
+def http_request(method, url, **kwargs):
+    """An OAuth-bound HTTP request on the shared session, bounded by the 'oauth' upstream."""
+    import requests
+
+    upstream = upstreams['oauth']
+    kwargs.setdefault('timeout', upstream.timeout)
+    try:
+        return upstream.call(get_http_session().request, method, url, **kwargs)
+    except requests.RequestException as e:
+        raise UpstreamError(str(e))
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+"""
+   /api/aggregate against aggregating raw /api/query-data rows on the client.
+
+   For a few typical chart queries (a time series, a province rollup, a
+   year x province matrix) prints the response size and latency of the raw
+   rows (aggregated in Python, as the frontend does) and of the aggregate
+   with both engines (sql, columnar). tests/test_get_data.py checks that
+   they agree.
+
+   Usage: python -m benchmarks.bench_aggregate [--rows 100000]
+"""
+
+import argparse, os, time
+from collections import defaultdict
+
+from benchmarks.synthetic import make_app, populate
+
+QUERIES = [
+    ('time series', {'subsector_1': 'Primary Education'}, ['year']),
+    ('province rollup', {'subsector_1': 'Primary Education', 'year': '2010'}, ['province']),
+    ('year x province', {'series_name': 'Education series 1'}, ['year', 'province']),
+    ('year x indicator', {}, ['year', 'indicator']),
+]
+
+MEASURES = ['sum', 'avg', 'min', 'max', 'count']
+
+
+def aggregate_rows(rows, group_by):
+    """What the frontend does today with the raw rows."""
+    groups = defaultdict(list)
+    for row in rows:
+        value = row.get('indicator_value')
+        groups[tuple(row.get(column) for column in group_by)].append(value)
+
+    result = {name: [] for name in group_by + MEASURES}
+    for key in sorted(groups, key=lambda key: [(value is not None, value or '') for value in key]):
+        values = [value for value in groups[key] if value is not None]
+        for column, value in zip(group_by, key):
+            result[column].append(value)
+        result['sum'].append(sum(values) if values else None)
+        result['avg'].append(sum(values) / len(values) if values else None)
+        result['min'].append(min(values) if values else None)
+        result['max'].append(max(values) if values else None)
+        result['count'].append(len(values))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    from api.models import EducationData
+
+    with app.app_context():
+        populate(EducationData, args.rows)
+    client = app.test_client()
+
+    try:
+        print('%-18s %12s %9s %12s %9s %11s %8s' % ('query', 'raw bytes', 'raw s', 'agg bytes', 'sql s',
+                                                    'columnar s', 'ratio'))
+        for name, filters, group_by in QUERIES:
+            payload = dict(filters, sector='Education')
+
+            started = time.perf_counter()
+            raw = client.post('/api/query-data', json=payload)
+            aggregate_rows(raw.get_json()['data'], group_by)
+            raw_seconds = time.perf_counter() - started
+
+            seconds = {}
+            for engine in ('sql', 'columnar'):
+                app.config['DATA_ENGINE'] = engine
+                started = time.perf_counter()
+                response = client.post('/api/aggregate', json=dict(payload, group_by=group_by, measures=MEASURES))
+                seconds[engine] = time.perf_counter() - started
+            app.config['DATA_ENGINE'] = 'sql'
+
+            print('%-18s %12d %8.3fs %12d %8.3fs %10.3fs %7.0fx' % (
+                name, len(raw.get_data()), raw_seconds, len(response.get_data()), seconds['sql'],
+                seconds['columnar'], len(raw.get_data()) / len(response.get_data())))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
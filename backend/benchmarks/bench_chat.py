@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+"""
+   /api/chat latency with the chart cache and single-flight coalescing,
+   against FakeGeminiClient (no network).
+
+   Then loads --series realistic series names and asks for --queries
+   different charts of them, with CHAT_GROUNDED off (the model writes every
+   chart with sample data) and on (real data, the model only writes the
+   templates): model calls, prompt and answer sizes, and latency.
+
+   Usage: python -m benchmarks.bench_chat [--latency 0.5] [--concurrency 16] [--series 300] [--queries 40]
+          [--similarity 0.85]
+"""
+
+import argparse, os, statistics, threading, time
+
+from benchmarks.bench_search import rename_series, series_names
+from benchmarks.synthetic import make_app, populate
+
+CHART_PHRASES = ['Line chart of {} by year', 'Bar chart of {} by province', 'Show the {} over time',
+                 'Pie chart of {} by province']
+
+
+def timed_post(client, query, timings):
+    started = time.perf_counter()
+    response = client.post('/api/chat', json={'query': query})
+    timings.append(time.perf_counter() - started)
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+
+def grounded_queries(app, fake, args):
+    """{mode: (model calls, prompt chars, answer chars, p50 seconds)} over the same queries in both modes."""
+    from api.config import BaseConfig
+    from api.llm import FakeGeminiClient, set_chat_client
+    from api.models import db, DataVersion
+    from api.routes import SECTOR_MODELS
+
+    names = series_names(args.series)
+    with app.app_context():
+        for i, model in enumerate(SECTOR_MODELS):
+            populate(model, 10000)
+            rename_series(db, model, names, i * (len(names) // 3))
+        DataVersion.bump([model.__tablename__ for model in SECTOR_MODELS])
+        db.session.commit()
+
+    queries = [CHART_PHRASES[i % len(CHART_PHRASES)].format(names[(i * 7) % len(names)].lower())
+               for i in range(args.queries)]
+    client = app.test_client()
+    results = {}
+    for mode in ('sample data', 'grounded'):
+        BaseConfig.CHAT_GROUNDED = mode == 'grounded'
+        sizes = {'prompt': 0, 'answer': 0}
+        recording = FakeGeminiClient(latency=args.latency)
+        generate = recording.generate
+
+        def recorded(prompt):
+            answer = generate(prompt)
+            sizes['prompt'] += len(prompt)
+            sizes['answer'] += len(answer)
+            return answer
+
+        recording.generate = recorded
+        set_chat_client(recording)
+        timings = []
+        for query in queries:
+            timed_post(client, query, timings)
+        results[mode] = (recording.calls, sizes['prompt'], sizes['answer'], statistics.median(timings))
+
+    BaseConfig.CHAT_GROUNDED = True
+    set_chat_client(fake)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.5, help="Simulated model latency in seconds.")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--series', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=40, help="Different chart queries.")
+    parser.add_argument('--similarity', type=float, default=0.85,
+                        help="CHAT_CACHE_SIMILARITY (the server default, 1, matches exact queries only).")
+    args = parser.parse_args()
+
+    app, path = make_app()
+    from api.config import BaseConfig
+    from api.llm import FakeGeminiClient, set_chat_client
+
+    BaseConfig.CHAT_CACHE_SIMILARITY = args.similarity
+
+    fake = FakeGeminiClient(latency=args.latency)
+    set_chat_client(fake)
+    client = app.test_client()
+
+    try:
+        # Cold: identical concurrent prompts share one upstream call
+        timings = []
+        threads = [threading.Thread(target=timed_post, args=(client, 'Line chart of rice yield by year', timings))
+                   for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print('cold, %d concurrent identical prompts: p50 %.3fs, upstream calls %d'
+              % (args.concurrency, statistics.median(timings), fake.calls))
+
+        # Warm: exact and near-duplicate prompts never reach the model
+        calls = fake.calls
+        for label, query in (('exact', 'Line chart of rice yield by year'),
+                             ('normalized', '  line CHART of rice yield, by year!'),
+                             ('near-duplicate', 'Line chart of rice yield by year please')):
+            timings = []
+            for _ in range(50):
+                timed_post(client, query, timings)
+            print('warm, %-14s p50 %.4fs, upstream calls %d' % (label, statistics.median(timings), fake.calls - calls))
+
+        print('\n%d different chart queries over %d series:' % (args.queries, args.series))
+        print('%-12s %12s %13s %13s %10s' % ('mode', 'model calls', 'prompt chars', 'answer chars', 'p50 s'))
+        for mode, (calls, prompt, answer, p50) in grounded_queries(app, fake, args).items():
+            print('%-12s %12d %13d %13d %10.4f' % (mode, calls, prompt, answer, p50))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
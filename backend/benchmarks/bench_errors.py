@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+"""
+   Error-heavy traffic through the API error layer.
+
+   Replays a mix of failing requests (payload validation, unknown sector,
+   bad JSON, missing token, wrong method, unsupported format, unknown
+   paths) plus a large and a streamed successful response, through the
+   EnvelopeApi error handling and with the old after_request hook that
+   re-parsed every error body (and the "did you mean" 404 help) put back.
+   The two are interleaved request by request so machine noise hits
+   both alike. Prints the median latency and the statuses of each request
+   for both; the successful responses run --requests / 10 times.
+
+   Usage: python -m benchmarks.bench_errors [--rows 10000] [--requests 300]
+"""
+
+import argparse, json, os, statistics, time
+
+from benchmarks.synthetic import make_app, populate
+
+CASES = [
+    ('validation', 'post', '/api/users/register', {'json': {'username': 'x'}}),
+    ('unknown sector', 'post', '/api/query-data', {'json': {'sector': 'Health'}}),
+    ('bad json', 'post', '/api/query-data', {'data': '{"sector": ', 'content_type': 'application/json'}),
+    ('missing token', 'post', '/api/users/logout', {}),
+    ('wrong method', 'get', '/api/query-data', {}),
+    ('bad format', 'post', '/api/query-data?format=xml', {'json': {'sector': 'Education'}}),
+    ('unknown api path', 'get', '/api/query-dat', {}),
+    ('unknown path', 'get', '/favicon.ico', {}),
+    ('large 200', 'post', '/api/query-data', {'json': {'sector': 'Education'}}),
+    ('streamed 200', 'post', '/api/query-data?stream=ndjson', {'json': {'sector': 'Education'}}),
+]
+
+
+def legacy_after_request(response):
+    """The hook this layer replaced: every error body parsed and re-serialized."""
+    if int(response.status_code) >= 400:
+        response_data = json.loads(response.get_data())
+        if "errors" in response_data:
+            response_data = {"success": False,
+                             "msg": list(response_data["errors"].items())[0][1]}
+            response.set_data(json.dumps(response_data))
+        response.headers.add('Content-Type', 'application/json')
+    return response
+
+
+def replay(app, client, requests):
+    """{case: {mode: (median seconds, statuses)}}"""
+    legacy = {'enabled': False}
+
+    def maybe_legacy(response):
+        return legacy_after_request(response) if legacy['enabled'] else response
+
+    # Appended last, so it runs first among the after_request hooks like the old one did
+    app.after_request_funcs.setdefault(None, []).append(maybe_legacy)
+
+    results = {}
+    for name, method, url, kwargs in CASES:
+        count = max(requests // 10, 1) if name.endswith('200') else requests
+        timings = {'envelope': [], 'legacy': []}
+        statuses = {'envelope': set(), 'legacy': set()}
+        for _ in range(count):
+            for mode in timings:
+                legacy['enabled'] = mode == 'legacy'
+                app.config['RESTX_ERROR_404_HELP'] = mode == 'legacy'
+                started = time.perf_counter()
+                response = getattr(client, method)(url, **kwargs)
+                response.get_data()
+                timings[mode].append(time.perf_counter() - started)
+                statuses[mode].add(response.status_code)
+        results[name] = {mode: (statistics.median(timings[mode]), sorted(statuses[mode])) for mode in timings}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    app.logger.disabled = True
+    from api.models import EducationData
+
+    try:
+        with app.app_context():
+            populate(EducationData, args.rows)
+        client = app.test_client()
+        client.get('/api/query-menu')
+
+        results = replay(app, client, args.requests)
+
+        print('%-18s %14s %10s %14s %10s %8s' % ('request', 'envelope ms', 'status', 'legacy ms', 'status', 'speedup'))
+        for name, _, _, _ in CASES:
+            (new_seconds, new_statuses), (old_seconds, old_statuses) = results[name]['envelope'], results[name]['legacy']
+            print('%-18s %14.3f %10s %14.3f %10s %7.2fx' % (
+                name, new_seconds * 1000, ','.join(map(str, new_statuses)), old_seconds * 1000,
+                ','.join(map(str, old_statuses)), old_seconds / new_seconds))
+
+        errors = [name for name, _, _, _ in CASES if not name.endswith('200')]
+        new_total = sum(results[name]['envelope'][0] for name in errors)
+        old_total = sum(results[name]['legacy'][0] for name in errors)
+        print(f'\nerror mix: {len(errors) / new_total:.0f} req/s with the envelope, '
+              f'{len(errors) / old_total:.0f} req/s with the legacy hook')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
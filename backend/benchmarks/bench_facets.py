@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+"""
+   Cascading filters from the precomputed facet index.
+
+   Loads --rows synthetic rows per sector, builds the facet index of each
+   table and walks the dropdowns of one sector down the hierarchy
+   (sector > subsector_1 > subsector_2 > series_name):
+
+     query-data   POST /api/query-data for the selection, facets read
+                  from its `filters` (no counts), facet phase from
+                  Server-Timing with and without the index
+     facets       GET /api/facets, with row counts
+
+   tests/test_facets.py checks that both give the same facet values.
+
+   Usage: python -m benchmarks.bench_facets [--rows 100000] [--repeat 10]
+"""
+
+import argparse, os, re, statistics, time
+
+from benchmarks.synthetic import make_app, populate
+
+STEPS = [
+    ('sector', {'sector': 'Education'}),
+    ('subsector_1', {'sector': 'Education', 'subsector_1': 'Primary Education'}),
+    ('subsector_2', {'sector': 'Education', 'subsector_1': 'Primary Education', 'subsector_2': 'Primary Education 1'}),
+    ('series_name', {'sector': 'Education', 'subsector_1': 'Primary Education', 'subsector_2': 'Primary Education 1',
+                     'series_name': 'Education series 1'}),
+]
+
+
+def phase_ms(response, name):
+    match = re.search(name + r';dur=([0-9.]+)', response.headers.get('Server-Timing', ''))
+    return float(match.group(1)) if match else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help="Rows per sector.")
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    from api import facets
+    from api.facets import FacetIndex, facet_store
+    from api.routes import SECTOR_MODELS
+
+    try:
+        with app.app_context():
+            for model in SECTOR_MODELS:
+                populate(model, args.rows)
+            for model in SECTOR_MODELS:
+                started = time.perf_counter()
+                index = facet_store.get(model)
+                print('%-18s index built in %6.1f ms, %d series' % (
+                    model.__tablename__, (time.perf_counter() - started) * 1000, len(index.levels[-1])))
+
+        client = app.test_client()
+        covers = FacetIndex.covers
+        print('\n%-12s %7s %14s %14s %11s %11s' % ('step', 'rows', 'facets sql ms', 'facets idx ms',
+                                                  'request ms', 'facets ms'))
+        for name, selection in STEPS:
+            timings = {'sql': [], 'index': [], 'request': [], 'facets': []}
+            for _ in range(args.repeat):
+                facets.FacetIndex.covers = staticmethod(lambda filters: False)
+                response = client.post('/api/query-data', json=selection)
+                timings['sql'].append(phase_ms(response, 'facets'))
+                facets.FacetIndex.covers = covers
+
+                started = time.perf_counter()
+                response = client.post('/api/query-data', json=selection)
+                timings['request'].append((time.perf_counter() - started) * 1000)
+                timings['index'].append(phase_ms(response, 'facets'))
+
+                started = time.perf_counter()
+                document = client.get('/api/facets', query_string=selection).get_json()
+                timings['facets'].append((time.perf_counter() - started) * 1000)
+
+            print('%-12s %7d %14.2f %14.2f %11.2f %11.2f' % (
+                name, document['rows'], statistics.median(timings['sql']), statistics.median(timings['index']),
+                statistics.median(timings['request']), statistics.median(timings['facets'])))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- encoding: utf-8 -*-
+"""
+   Payload size and encode time of each /api/query-data response format.
+
+   Loads a synthetic sector table, takes a few typical selections and, for
+   every format (json rows, columns JSON, MessagePack, Arrow, Parquet) and
+   content encoding (identity, gzip, br), reports the body size and the
+   time to encode (and compress) an already computed get_data() result.
+   `stdlib json` is the old json.dumps path for reference
+   (tests/test_formats.py checks the round trips).
+
+   Usage: python -m benchmarks.bench_formats [--rows 100000] [--repeat 3]
+"""
+
+import argparse, json, os, time
+
+from benchmarks.synthetic import make_app, populate
+
+SELECTIONS = [
+    ('series', {'series_name': 'Education series 1'}),
+    ('subsector', {'subsector_1': 'Primary Education'}),
+    ('table', {}),
+]
+
+
+def best_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - started)
+    return body, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    from api.encoding import FORMATS, compress, encode_data
+    from api.models import EducationData
+
+    try:
+        with app.app_context():
+            populate(EducationData, args.rows)
+
+            for name, filters in SELECTIONS:
+                result = EducationData.get_data(**filters)
+                print(f"\n{name}: {len(result['data'])} rows")
+                print('  %-12s %14s %10s %14s %10s %14s %10s' % ('format', 'identity', 'encode', 'gzip', 'encode',
+                                                                  'br', 'encode'))
+
+                body, seconds = best_time(lambda: json.dumps(result).encode('utf-8'), args.repeat)
+                print('  %-12s %14d %9.3fs' % ('stdlib json', len(body), seconds))
+
+                for format_name in FORMATS:
+                    cells = []
+                    for content_encoding in (None, 'gzip', 'br'):
+                        if format_name == 'parquet' and content_encoding:
+                            cells.append('%14s %10s' % ('-', '-'))
+                            continue
+                        body, seconds = best_time(
+                            lambda: compress(encode_data(result, format_name), content_encoding), args.repeat)
+                        cells.append('%14d %9.3fs' % (len(body), seconds))
+                    print('  %-12s %s' % (format_name, ' '.join(cells)))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# -*- encoding: utf-8 -*-
+"""
+   Compares the legacy ORM implementation of BaseModel.get_data with the
+   SQL aggregate path on synthetic tables (tests/test_get_data.py checks
+   that both return the same payload).
+
+   Usage: python -m benchmarks.bench_get_data [--sizes 10000 100000 1000000] [--repeat 3]
+"""
+
+import argparse, os, time, tracemalloc
+
+from benchmarks.synthetic import make_app, populate
+
+
+def legacy_get_data(cls, **filters):
+    """The original implementation: ORM objects, to_dict() and Python-side passes."""
+    from api.models import db
+
+    query = cls.query
+    for column, value in filters.items():
+        if value and column != "filters":
+            query = query.filter(getattr(cls, column) == value)
+
+    result = [entry.to_dict() for entry in query.all()]
+
+    if result:
+        columns_to_remove = []
+        for column in result[0].keys():
+            if all(not entry[column] or entry[column] == "" for entry in result):
+                columns_to_remove.append(column)
+
+        for entry in result:
+            for column in columns_to_remove:
+                del entry[column]
+
+    unique_values = {}
+    for column_name in result[0].keys():
+        if column_name in cls.exclude_column:
+            continue
+
+        if column_name == "sector" or column_name == "series_name" or column_name == "subsector_1":
+            query_unique = db.session.query(getattr(cls, column_name)).distinct().all()
+            unique_values[column_name] = [item[0] for item in query_unique if item[0] not in [None, '']]
+
+        elif column_name == "subsector_2":
+            query_unique = db.session.query(getattr(cls, column_name)).distinct().filter(
+                getattr(cls, "subsector_1") == filters.get("subsector_1")
+            ).all()
+            unique_values[column_name] = [item[0] for item in query_unique if item[0] not in [None, '']]
+
+        else:
+            query_unique = list(set(entry[column_name] for entry in result))
+            unique_values[column_name] = [item for item in query_unique if item not in [None, '']]
+
+    unique_values = {key: value for key, value in unique_values.items() if value}
+    return {'data': result, 'filters': unique_values}
+
+
+def measure(fn, repeat):
+    """Returns (payload, best wall time, peak traced memory); memory is traced in a separate run."""
+    from api.models import db
+
+    # Warm-up: the first call also builds the facet index
+    fn()
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        payload = fn()
+        timings.append(time.perf_counter() - started)
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return payload, min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from api.models import db, EducationData
+
+    # A selection covering one series, the shape dashboards send
+    filters = {'series_name': 'Education series 0', 'subsector_1': None, 'subsector_2': None}
+
+    print('%10s %8s %12s %12s %12s %12s %8s' % ('rows', 'selected', 'legacy (s)', 'sql (s)',
+                                                'legacy (MB)', 'sql (MB)', 'speedup'))
+    for size in args.sizes:
+        app, path = make_app()
+        try:
+            with app.app_context():
+                populate(EducationData, size)
+
+                legacy, legacy_time, legacy_peak = measure(
+                    lambda: legacy_get_data(EducationData, **filters), args.repeat)
+                current, current_time, current_peak = measure(
+                    lambda: EducationData.get_data(**filters), args.repeat)
+
+                print('%10d %8d %12.3f %12.3f %12.1f %12.1f %7.1fx' % (
+                    size, len(current['data']), legacy_time, current_time,
+                    legacy_peak / 2 ** 20, current_peak / 2 ** 20, legacy_time / current_time))
+                db.session.remove()
+                db.get_engine(app).dispose()
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
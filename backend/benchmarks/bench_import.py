@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+"""
+   Cold-start regression check: how long `import wsgi` takes, from
+   `python -X importtime`.
+
+   Runs the import --runs times in fresh interpreters and takes the fastest
+   run (the least disturbed by the machine). Fails (exit status 1) when it
+   exceeds --budget milliseconds, or when a dependency that must load lazily
+   (the Gemini SDK, NumPy, pandas, requests, redis, pyarrow, msgpack,
+   brotli) is imported at startup.
+   --top lists the slowest imports by cumulative time.
+
+   Usage: python -m benchmarks.bench_import [--budget 800] [--runs 5] [--top 15]
+"""
+
+import argparse, os, subprocess, sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by /api/chat, DATA_ENGINE=columnar, `flask ingest`, OAuth logins, Redis caches and binary formats
+LAZY_MODULES = ['google.generativeai', 'numpy', 'pandas', 'requests', 'redis', 'pyarrow', 'msgpack', 'brotli']
+
+
+def profile(module):
+    """{module name: cumulative microseconds} of one `import module` in a fresh interpreter."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', f'import {module}'],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='wsgi')
+    parser.add_argument('--budget', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', 800)),
+                        help="Maximum import time in milliseconds (IMPORT_BUDGET_MS).")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [profile(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda timings: timings[args.module])
+    total_ms = best[args.module] / 1000
+
+    print(f'import {args.module}: {total_ms:.0f} ms (best of {args.runs}), budget {args.budget:.0f} ms')
+    for name, cumulative in sorted(best.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print('  %8.1f ms  %s' % (cumulative / 1000, name))
+
+    failures = []
+    if total_ms > args.budget:
+        failures.append(f'import time {total_ms:.0f} ms is over the {args.budget:.0f} ms budget')
+    for name in LAZY_MODULES:
+        if name in best:
+            failures.append(f'{name} is imported at startup; import it where it is first used')
+
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# -*- encoding: utf-8 -*-
+"""
+   Read-replica routing against two read-only SQLite copies of the primary.
+
+   Loads --rows synthetic rows per sector into a primary SQLite file and
+   copies it twice, opened as replicas with mode=ro. Then:
+
+     routing   SQL statements each endpoint runs on the primary and on
+               the replicas (data reads on replicas, auth on the primary)
+     failover  a replica becomes unreadable: the health check takes it
+               out, reads move to the other one, then to the primary
+     load      gunicorn with and without DB_REPLICA_URIS: --readers
+               threads on /api/query-data while --writers threads log in,
+               for --duration seconds each. On one machine both modes share
+               the same CPUs, so this shows the routing costs nothing
+               rather than the scale-out a replica on another host gives
+
+   tests/test_replicas.py checks that replicas and primary answer the same.
+
+   Usage: python -m benchmarks.bench_replicas [--rows 50000] [--duration 10] [--readers 8] [--writers 2]
+"""
+
+import argparse, os, shutil, statistics, tempfile, threading, time
+
+import requests
+from sqlalchemy import event
+
+from .bench_serving import commands, start
+from .bench_upstream import free_port
+from .synthetic import PROVINCES, SECTORS, make_app, populate
+
+EMAIL, PASSWORD = 'replica-bench@example.com', 'bench-pass'
+
+REQUESTS = [
+    ('query-data', 'POST', '/api/query-data', {'sector': 'Education', 'subsector_1': 'Primary Education'}),
+    ('query-menu', 'GET', '/api/query-menu', None),
+    ('facets', 'GET', '/api/facets?sector=Agriculture', None),
+    ('aggregate', 'POST', '/api/aggregate', {'sector': 'Economic', 'group_by': ['year']}),
+    ('register', 'POST', '/api/users/register',
+     {'username': 'someone', 'email': 'someone@example.com', 'password': PASSWORD}),
+    ('login', 'POST', '/api/users/login', {'email': EMAIL, 'password': PASSWORD}),
+]
+
+
+def replica_uri(path):
+    return f'sqlite:///file:{path}?mode=ro&uri=true'
+
+
+def routing(app, db, replicas):
+    client = app.test_client()
+    primary = [0]
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: primary.__setitem__(0, primary[0] + 1))
+
+    # Startup work (menu, search and facet indexes, the revocation set) runs on the first request
+    client.get('/api/query-menu')
+
+    print('%-12s %7s %9s %9s' % ('endpoint', 'status', 'primary', 'replicas'))
+    for name, method, path, payload in REQUESTS:
+        before = primary[0], sum(replica.statements for replica in replicas.replicas)
+        response = client.open(path, method=method, json=payload)
+        after = primary[0], sum(replica.statements for replica in replicas.replicas)
+        print('%-12s %7d %9d %9d' % (name, response.status_code, after[0] - before[0], after[1] - before[1]))
+
+
+def failover(app, replicas, copies):
+    client = app.test_client()
+
+    def step(label):
+        replicas.check()
+        before = [replica.statements for replica in replicas.replicas]
+        for _ in range(4):
+            client.post('/api/query-data', json={'sector': 'Education'})
+        served = [replica.statements - count for replica, count in zip(replicas.replicas, before)]
+        print('%-30s %s' % (label, '  '.join(f'{replica.name}: {"up" if replica.healthy else "down"}, '
+                                              f'{count} statements'
+                                              for replica, count in zip(replicas.replicas, served))))
+
+    print()
+    step('both replicas')
+    for i, path in enumerate(copies):
+        # An unreadable file: new connections fail as they would against a dead server
+        os.rename(path, path + '.gone')
+        replicas.replicas[i].engine.dispose()
+        step(f'replica_{i} gone')
+    for i, path in enumerate(copies):
+        os.rename(path + '.gone', path)
+    step('both restored')
+
+
+def load(db_path, copies, args):
+    results = {}
+    for mode in ('primary only', 'replicas'):
+        port = free_port()
+        env = dict(os.environ, FLASK_APP='wsgi.py', SQLALCHEMY_DATABASE_URI='sqlite:///' + db_path,
+                   RESULT_CACHE_BACKEND='none', GUNICORN_ACCESSLOG='',
+                   DB_REPLICA_URIS=','.join(replica_uri(path) for path in copies) if mode == 'replicas' else '')
+        process, _ = start(commands(port)['gunicorn'], env, port)
+        stop = threading.Event()
+        timings = {'query-data': [], 'login': []}
+
+        def reader(offset):
+            session, i = requests.Session(), offset
+            while not stop.is_set():
+                subsectors = SECTORS['Education']
+                payload = {'sector': 'Education', 'subsector_1': subsectors[i % len(subsectors)],
+                           'province': PROVINCES[i % len(PROVINCES)]}
+                started = time.perf_counter()
+                if session.post(f'http://127.0.0.1:{port}/api/query-data', json=payload).status_code == 200:
+                    timings['query-data'].append(time.perf_counter() - started)
+                i += 1
+
+        def writer():
+            session = requests.Session()
+            while not stop.is_set():
+                started = time.perf_counter()
+                if session.post(f'http://127.0.0.1:{port}/api/users/login',
+                                json={'email': EMAIL, 'password': PASSWORD}).status_code == 200:
+                    timings['login'].append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=reader, args=(i * 7,)) for i in range(args.readers)] + \
+                  [threading.Thread(target=writer) for _ in range(args.writers)]
+        try:
+            for thread in threads:
+                thread.start()
+            time.sleep(args.duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            process.terminate()
+            process.wait()
+        results[mode] = timings
+
+    print('\n%-14s %14s %14s %14s %14s' % ('mode', 'query-data/s', 'query-data p95', 'logins/s', 'login p95'))
+    for mode, timings in results.items():
+        reads, logins = sorted(timings['query-data']), sorted(timings['login'])
+        print('%-14s %14.1f %13.0fms %14.1f %13.0fms' % (
+            mode, len(reads) / args.duration, reads[int(len(reads) * 0.95)] * 1000 if reads else float('nan'),
+            len(logins) / args.duration, logins[int(len(logins) * 0.95)] * 1000 if logins else float('nan')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000, help="Rows per sector.")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    from api.models import db, Users
+    from api.replicas import replicas
+    from api.routes import SECTOR_MODELS
+
+    with app.app_context():
+        for model in SECTOR_MODELS:
+            populate(model, args.rows)
+        user = Users(username='replica-bench', email=EMAIL)
+        user.set_password(PASSWORD)
+        user.save()
+        # Checkpoint the WAL into the main file before it is copied
+        db.engine.dispose()
+
+    workdir = tempfile.mkdtemp(prefix='cdri-replicas-')
+    copies = []
+    for i in range(2):
+        copies.append(os.path.join(workdir, f'replica_{i}.sqlite3'))
+        shutil.copy(path, copies[-1])
+
+    try:
+        app.config['DB_REPLICA_URIS'] = [replica_uri(copy) for copy in copies]
+        replicas.init_app(app)
+        replicas.check()
+
+        routing(app, db, replicas)
+        failover(app, replicas, copies)
+        replicas.dispose()
+        load(path, copies, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# -*- encoding: utf-8 -*-
+"""
+   /api/search against filtering the data explorer list on the client.
+
+   Loads --rows synthetic rows per sector and renames them into --series
+   distinct, realistic series names. Then times, per query:
+
+     client   GET /api/query-menu and a case-insensitive substring filter
+              over `data_explorer` (what the frontend does today)
+     search   GET /api/search?q=
+
+   and shows the top hit, including for prefix and misspelled queries the
+   substring filter cannot answer. Finally adds a series to one sector
+   and times the first search after it (only that table is read again)
+   against building the index from scratch (tests/test_search.py checks
+   that it finds the new series).
+
+   Usage: python -m benchmarks.bench_search [--rows 50000] [--series 3000] [--repeat 20]
+"""
+
+import argparse, os, statistics, time
+
+from benchmarks.synthetic import make_app, populate
+
+MEASURES = ['Net enrolment rate', 'Gross enrolment ratio', 'Dropout rate', 'Repetition rate', 'Number of teachers',
+            'Pupil teacher ratio', 'Literacy rate', 'Paddy production', 'Harvested area', 'Cattle population',
+            'Fish catch', 'Fertilizer use', 'Consumer price index', 'Export value', 'Import value',
+            'Employment rate', 'Average wage', 'Number of enterprises']
+SUBJECTS = ['primary schools', 'lower secondary schools', 'upper secondary schools', 'universities', 'wet season',
+            'dry season', 'inland fisheries', 'marine fisheries', 'garments', 'rice', 'manufacturing', 'services',
+            'construction', 'tourism', 'households', 'rural areas', 'urban areas']
+
+QUERIES = [
+    ('word', 'enrolment'),
+    ('two words', 'dropout primary'),
+    ('prefix', 'paddy prod'),
+    ('typo', 'enrolmnet rate'),
+    ('typo + prefix', 'consumr pric'),
+    ('indicator', 'female literacy'),
+]
+
+
+def series_names(count):
+    names = []
+    for i in range(count):
+        measure, subject = MEASURES[i % len(MEASURES)], SUBJECTS[(i // len(MEASURES)) % len(SUBJECTS)]
+        round_ = i // (len(MEASURES) * len(SUBJECTS))
+        names.append(f'{measure} in {subject}' + (f' ({2000 + round_})' if round_ else ''))
+    return names
+
+
+def rename_series(db, model, names, offset):
+    """Spreads `names` over the rows of `model`, a different slice per sector."""
+    rows = db.session.execute(db.text(f'SELECT id FROM {model.__tablename__}')).all()
+    db.session.execute(db.text(f'UPDATE {model.__tablename__} SET series_name = :name WHERE id = :id'),
+                       [{'id': row_id, 'name': names[offset + row_id % (len(names) // 3)]} for row_id, in rows])
+
+
+def median_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+
+def client_filter(client, query):
+    menu = client.get('/api/query-menu').get_json()['data_explorer']
+    needle = query.casefold()
+    return [item for item in menu if needle in item['series_name'].casefold()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000, help="Rows per sector.")
+    parser.add_argument('--series', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    from api.models import db, DataVersion, EducationData
+    from api.routes import SECTOR_MODELS
+    from api.search import SeriesSearch, series_search
+
+    names = series_names(args.series)
+    try:
+        with app.app_context():
+            for i, model in enumerate(SECTOR_MODELS):
+                populate(model, args.rows)
+                rename_series(db, model, names, i * (len(names) // 3))
+            DataVersion.bump([model.__tablename__ for model in SECTOR_MODELS])
+            db.session.commit()
+
+            started = time.perf_counter()
+            index = series_search.get(SECTOR_MODELS)
+            print(f'index: {len(index.documents)} series, {len(index.words)} words, '
+                  f'built in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+        client = app.test_client()
+        print('\n%-14s %-18s %10s %8s %10s %8s  %s' % ('query', 'q', 'client ms', 'hits', 'search ms', 'hits',
+                                                        'top hit'))
+        for name, query in QUERIES:
+            client_hits, client_seconds = median_time(lambda: client_filter(client, query), args.repeat)
+            response, search_seconds = median_time(
+                lambda: client.get('/api/search', query_string={'q': query}).get_json(), args.repeat)
+            results = response['results']
+            print('%-14s %-18s %10.2f %8d %10.2f %8d  %s' % (
+                name, query, client_seconds * 1000, len(client_hits), search_seconds * 1000, len(results),
+                results[0]['series_name'] if results else '-'))
+
+        with app.app_context():
+            db.session.add(EducationData(sector='Education', subsector_1='Primary Education',
+                                         series_name='Number of scholarship recipients', indicator='Female'))
+            db.session.commit()
+
+            started = time.perf_counter()
+            series_search.search(SECTOR_MODELS, 'scholarship', 5)
+            incremental = time.perf_counter() - started
+            started = time.perf_counter()
+            SeriesSearch().get(SECTOR_MODELS)
+            full = time.perf_counter() - started
+            print(f'\nafter adding a series: first search {incremental * 1000:.1f} ms '
+                  f'(full rebuild {full * 1000:.1f} ms)')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# -*- encoding: utf-8 -*-
+"""
+   Startup time and throughput: `flask run` (the old Dockerfile command)
+   against gunicorn with gunicorn.conf.py.
+
+   Both servers run on the same synthetic SQLite database. Startup is the
+   time from launching the process to the first 200 from /api/query-menu;
+   throughput is measured by --clients threads cycling through
+   /api/query-data filter sets for --duration seconds, with the result
+   cache disabled so every request reaches the database.
+
+   Usage: python -m benchmarks.bench_serving [--rows 50000] [--duration 10]
+"""
+
+import argparse, os, shutil, statistics, subprocess, sys, tempfile, threading, time
+
+import requests
+
+from .bench_upstream import free_port
+from .synthetic import PROVINCES, SECTORS, make_app, populate
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def commands(port):
+    return {
+        'flask run': [sys.executable, '-m', 'flask', 'run', '--host=127.0.0.1', f'--port={port}'],
+        'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}', 'wsgi:app'],
+    }
+
+
+def start(command, env, port):
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    while time.perf_counter() - started < 60:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/api/query-menu', timeout=2).status_code == 200:
+                return process, time.perf_counter() - started
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    process.kill()
+    raise SystemExit(f"{command[2]} did not start")
+
+
+def load(port, clients, duration):
+    payloads = [{'sector': 'Education', 'subsector_1': subsector, 'province': province}
+                for subsector in SECTORS['Education'] for province in PROVINCES]
+    stop = threading.Event()
+    timings, errors = [], []
+
+    def client(offset):
+        session = requests.Session()
+        i = offset
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = session.post(f'http://127.0.0.1:{port}/api/query-data',
+                                        json=payloads[i % len(payloads)], timeout=30)
+                (timings if response.status_code == 200 else errors).append(time.perf_counter() - started)
+            except requests.RequestException:
+                errors.append(None)
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(i * 7,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sorted(timings), len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None, help="GUNICORN_WORKERS (default: cores + 1).")
+    args = parser.parse_args()
+
+    app, path = make_app()
+    from api.models import db, EducationData
+    with app.app_context():
+        populate(EducationData, args.rows)
+        # Closing the pool checkpoints the WAL into the main file before it is copied
+        db.engine.dispose()
+
+    print('%-10s %9s %9s %8s %8s %7s' % ('server', 'startup', 'req/s', 'p50', 'p95', 'errors'))
+    try:
+        for name in ('flask run', 'gunicorn'):
+            # Each server gets its own copy so WAL files of the previous run do not interfere
+            workdir = tempfile.mkdtemp(prefix='cdri-serving-')
+            db_path = os.path.join(workdir, 'bench.sqlite3')
+            shutil.copy(path, db_path)
+
+            port = free_port()
+            env = dict(os.environ, FLASK_APP='wsgi.py', SQLALCHEMY_DATABASE_URI='sqlite:///' + db_path,
+                       RESULT_CACHE_BACKEND='none', GUNICORN_ACCESSLOG='')
+            if args.workers:
+                env['GUNICORN_WORKERS'] = str(args.workers)
+
+            process, startup = start(commands(port)[name], env, port)
+            try:
+                timings, errors = load(port, args.clients, args.duration)
+            finally:
+                process.terminate()
+                process.wait()
+                shutil.rmtree(workdir, ignore_errors=True)
+
+            p95 = timings[int(len(timings) * 0.95)] if timings else float('nan')
+            print('%-10s %8.2fs %9.1f %7.3fs %7.3fs %7d' % (
+                name, startup, len(timings) / args.duration,
+                statistics.median(timings) if timings else float('nan'), p95, errors))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
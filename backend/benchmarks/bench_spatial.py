@@ -0,0 +1,154 @@
+# -*- encoding: utf-8 -*-
+"""
+   Map views through /api/map-points against downloading the sector.
+
+   Builds an education_data table the way older schemas did (latitude and
+   longitude as strings, a few of them not numbers), loads --rows rows and
+   runs schema.upgrade(), which converts the columns and builds the R-tree.
+   Then, for a 1024x768 px view at several zoom levels, times:
+
+     download   POST /api/query-data for the whole sector, then parse and
+                filter the coordinates client-side (what the map did)
+     btree      /api/map-points without the R-tree (latitude BETWEEN ...)
+     rtree      /api/map-points through the R-tree
+     columnar   /api/map-points with DATA_ENGINE=columnar
+
+   tests/test_spatial.py checks that all of them find the same points and
+   clusters, and that the R-tree triggers keep up with ORM writes.
+
+   Usage: python -m benchmarks.bench_spatial [--rows 200000] [--repeat 5]
+"""
+
+import argparse, os, time
+
+from benchmarks.synthetic import make_app, populate
+
+# (name, zoom, centre longitude, centre latitude)
+VIEWS = [
+    ('country', 7, 104.9, 12.5),
+    ('province', 9, 104.9, 11.6),
+    ('district', 11, 104.9, 11.6),
+    ('city', 13, 104.92, 11.56),
+]
+
+WIDTH, HEIGHT = 1024, 768
+
+
+def view_bbox(zoom, longitude, latitude):
+    """[west, south, east, north] of a WIDTH x HEIGHT px view (256 px tiles, plate carree is close enough here)."""
+    degrees_per_pixel = 360.0 / 2 ** zoom / 256
+    half_width, half_height = WIDTH / 2 * degrees_per_pixel, HEIGHT / 2 * degrees_per_pixel
+    return [longitude - half_width, latitude - half_height, longitude + half_width, latitude + half_height]
+
+
+def best_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def create_legacy_table(db, model):
+    """Recreates `model`'s table with the old string latitude/longitude columns."""
+    from sqlalchemy import MetaData, String
+
+    db.session.execute(db.text(f'DROP TABLE IF EXISTS {model.dimensions.name}'))
+    db.session.execute(db.text(f'DROP TABLE {model.__tablename__}'))
+    db.session.commit()
+
+    metadata = MetaData()
+    legacy = model.__table__.to_metadata(metadata)
+    legacy.c.latitude.type = String(255)
+    legacy.c.longitude.type = String(255)
+    for index in list(legacy.indexes):
+        if 'latitude' in index.columns:
+            legacy.indexes.discard(index)
+    metadata.create_all(bind=db.engine, tables=[legacy])
+    model.dimensions.create(bind=db.engine)
+
+
+def download(client, bbox):
+    """The old way: every row of the sector, coordinates parsed and filtered here."""
+    west, south, east, north = bbox
+    found = []
+    for row in client.post('/api/query-data', json={'sector': 'Education'}).get_json()['data']:
+        try:
+            latitude, longitude = float(row.get('latitude')), float(row.get('longitude'))
+        except (TypeError, ValueError):
+            continue
+        if south <= latitude <= north and west <= longitude <= east:
+            found.append(row['id'])
+    return found
+
+
+def map_points(client, bbox, zoom):
+    return client.post('/api/map-points', json={'sector': 'Education', 'bbox': bbox, 'zoom': zoom}).get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    from api import models
+    from api.columnar import snapshots
+    from api.ingest import analyze
+    from api.models import db, EducationData
+    from api.schema import upgrade
+
+    try:
+        with app.app_context():
+            create_legacy_table(db, EducationData)
+            populate(EducationData, args.rows)
+            db.session.execute(db.text("UPDATE education_data SET latitude = 'n/a' WHERE id % 1000 = 1"))
+            db.session.execute(db.text("UPDATE education_data SET longitude = '' WHERE id % 1000 = 2"))
+            db.session.commit()
+
+            started = time.perf_counter()
+            changes = upgrade()
+            print(f'upgrade: {time.perf_counter() - started:.2f}s, ' + ', '.join(
+                change for change in changes if 'education_data' in change and 'dimension' not in change))
+            types = db.session.execute(db.text(
+                "SELECT typeof(latitude), COUNT(*) FROM education_data GROUP BY 1 ORDER BY 1")).all()
+            print('latitude storage after upgrade: ' + ', '.join(f'{kind} {count}' for kind, count in types))
+            analyze([EducationData])
+
+        client = app.test_client()
+        has_rtree = models.has_rtree
+        print('\n%-9s %5s %7s %9s %11s %9s %9s %11s' % (
+            'view', 'zoom', 'points', 'clusters', 'download s', 'btree s', 'rtree s', 'columnar s'))
+
+        for name, zoom, longitude, latitude in VIEWS:
+            bbox = view_bbox(zoom, longitude, latitude)
+            app.config['DATA_ENGINE'] = 'sql'
+            _, download_seconds = best_time(lambda: download(client, bbox), args.repeat)
+
+            models.has_rtree = lambda table_name: False
+            _, btree_seconds = best_time(lambda: map_points(client, bbox, zoom), args.repeat)
+            models.has_rtree = has_rtree
+            rtree, rtree_seconds = best_time(lambda: map_points(client, bbox, zoom), args.repeat)
+            app.config['DATA_ENGINE'] = 'columnar'
+            with app.app_context():
+                snapshots.reload(EducationData)
+            _, columnar_seconds = best_time(lambda: map_points(client, bbox, zoom), args.repeat)
+            app.config['DATA_ENGINE'] = 'sql'
+
+            if rtree['clustered']:
+                points = sum(rtree['columns']['count'])
+                clusters = len(rtree['columns']['count'])
+            else:
+                points = len(rtree['columns']['id'])
+                clusters = 0
+            print('%-9s %5d %7d %9d %10.4fs %8.4fs %8.4fs %10.4fs' % (
+                name, zoom, points, clusters, download_seconds, btree_seconds, rtree_seconds, columnar_seconds))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
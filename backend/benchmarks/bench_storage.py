@@ -0,0 +1,114 @@
+# -*- encoding: utf-8 -*-
+"""
+   Per-sector tables against the unified fact table (DATA_STORAGE=unified).
+
+   Loads --rows synthetic rows into each sector table, copies them with
+   unify_tables() (the `flask unify-sectors` migration) and then times the
+   same requests in both storage modes: building the menu, typical
+   query-data selections and aggregates, and a cross-sector aggregate
+   (three requests, one per table, against one request on the fact
+   table). On SQLite also prints the on-disk size of each layout from
+   dbstat. tests/test_storage.py checks that both modes answer the same
+   rows.
+
+   Usage: python -m benchmarks.bench_storage [--rows 100000] [--repeat 5]
+"""
+
+import argparse, os, time
+
+from benchmarks.synthetic import make_app, populate
+
+REQUESTS = [
+    ('series', '/api/query-data', {'sector': 'Education', 'series_name': 'Education series 1'}),
+    ('subsector', '/api/query-data', {'sector': 'Agriculture', 'subsector_1': 'Crops'}),
+    ('province rollup', '/api/aggregate', {'sector': 'Economic', 'subsector_1': 'Trade', 'group_by': ['province']}),
+    ('year x indicator', '/api/aggregate', {'sector': 'Education', 'group_by': ['year', 'indicator'],
+                                            'measures': ['avg', 'count']}),
+]
+
+SECTOR_NAMES = ['Education', 'Agriculture', 'Economic']
+
+
+def best_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def table_sizes(db, names):
+    """{table: bytes} including its indexes, from SQLite's dbstat."""
+    rows = db.session.execute(db.text(
+        "SELECT tbl_name, SUM(pgsize) FROM dbstat JOIN sqlite_master ON dbstat.name = sqlite_master.name "
+        "GROUP BY tbl_name")).all()
+    return {name: size for name, size in rows if name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help="Rows per sector.")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app, path = make_app()
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    from api.ingest import analyze, unify_tables
+    from api.models import db, FactData
+    from api.routes import SECTORS, SECTOR_MODELS, build_menu
+
+    try:
+        with app.app_context():
+            for model in SECTOR_MODELS:
+                populate(model, args.rows)
+            started = time.perf_counter()
+            unify_tables(SECTORS, report=lambda line: None)
+            print(f"unify_tables: {3 * args.rows} rows in {time.perf_counter() - started:.2f}s")
+            analyze(SECTOR_MODELS + [FactData])
+
+            try:
+                sector_tables = [table for model in SECTOR_MODELS
+                                 for table in (model.__tablename__, model.dimensions.name)]
+                fact_tables = ['fact_data', 'fact_data_dimension', 'sectors', 'subsectors', 'series', 'provinces']
+                sizes = table_sizes(db, sector_tables + fact_tables)
+                print('on disk: sector tables %.1f MB, unified %.1f MB' % (
+                    sum(sizes.get(name, 0) for name in sector_tables) / 1e6,
+                    sum(sizes.get(name, 0) for name in fact_tables) / 1e6))
+            except Exception as e:
+                db.session.rollback()
+                print(f'on disk: unavailable ({e.__class__.__name__})')
+
+        client = app.test_client()
+        print('\n%-22s %12s %12s %8s' % ('request', 'tables s', 'unified s', 'ratio'))
+
+        timings = {}
+        for storage in ('tables', 'unified'):
+            app.config['DATA_STORAGE'] = storage
+            with app.test_request_context():
+                _, timings[storage, 'menu'] = best_time(build_menu, args.repeat)
+
+            for name, url, payload in REQUESTS:
+                timings[storage, name] = best_time(
+                    lambda: client.post(url, json=payload).get_json(), args.repeat)
+
+            # Every sector by year: one request per table, or one over the fact table
+            if storage == 'tables':
+                timings[storage, 'cross-sector'] = best_time(lambda: [
+                    client.post('/api/aggregate', json={'sector': sector, 'group_by': ['year']}).get_json()
+                    for sector in SECTOR_NAMES], args.repeat)
+            else:
+                timings[storage, 'cross-sector'] = best_time(lambda: client.post(
+                    '/api/aggregate', json={'group_by': ['sector', 'year']}).get_json(), args.repeat)
+
+        print('%-22s %11.4fs %11.4fs %7.2fx' % ('menu', timings['tables', 'menu'], timings['unified', 'menu'],
+                                               timings['tables', 'menu'] / timings['unified', 'menu']))
+        for name in [name for name, _, _ in REQUESTS] + ['cross-sector']:
+            (_, old_seconds), (_, new_seconds) = timings['tables', name], timings['unified', name]
+            print('%-22s %11.4fs %11.4fs %7.2fx' % (name, old_seconds, new_seconds, old_seconds / new_seconds))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+# -*- encoding: utf-8 -*-
+"""
+   Performance suite with baseline regression checks.
+
+   For each --scales entry (rows per sector table) a fresh worker process
+   loads synthetic Education/Agriculture/Economic tables and drives every
+   endpoint twice:
+
+     test-client   sequential requests through the Flask test client
+     http          --clients threads against a threaded HTTP server in the
+                   same process (so RSS and SQL counts are the API's own)
+
+   over /api/query-data (result cache off, so every request reaches the
+   database), /api/query-menu, /api/chat (FakeGeminiClient, no network),
+   /api/users/register, /api/users/login, /api/users/edit and
+   /api/users/logout (each logout with a fresh user). Per endpoint it records
+   p50/p95/p99 latency, throughput, the process' peak RSS so far, SQL
+   statements per request (from Server-Timing) and errors.
+
+   --save-baseline writes the results as JSON; --baseline compares against
+   such a file and exits with status 1 when p50/p95 latency, throughput or
+   peak RSS get worse by more than --threshold, SQL statements per request
+   go up (by half a statement or more on average) or errors go up at all.
+   p99 is reported but not checked, a few hundred requests are too few for
+   it to be stable. Baselines only compare on the same machine and
+   settings, e.g. one CI runner:
+
+     python -m benchmarks.bench_suite --save-baseline baseline.json
+     python -m benchmarks.bench_suite --baseline baseline.json
+
+   Usage: python -m benchmarks.bench_suite [--scales 10000,100000] [--requests 200] [--clients 8]
+                                           [--baseline FILE] [--save-baseline FILE] [--threshold 0.25]
+"""
+
+import argparse, itertools, json, logging, os, platform, re, resource, statistics, subprocess, sys, tempfile
+import threading, time
+from datetime import datetime, timedelta
+
+import jwt
+import requests
+
+from benchmarks.synthetic import PROVINCES, SECTORS, make_app, populate
+
+TRANSPORTS = ['test-client', 'http']
+
+# Latency and throughput checks, and the smallest latency change that counts (timer noise below that)
+CHECKED = ['p50_ms', 'p95_ms']
+MIN_DELTA_MS = 1.0
+
+SQL_TIMING = re.compile(r'sql;dur=[0-9.]+;desc="(\d+) statements"')
+
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'bench-password'
+
+_user_ids = itertools.count()
+_logout_ids = itertools.count()
+
+
+def query_data_payload(i):
+    sector = list(SECTORS)[i % len(SECTORS)]
+    subsectors = SECTORS[sector]
+    return {'sector': sector, 'subsector_1': subsectors[(i // 3) % len(subsectors)],
+            'province': PROVINCES[(i // 9) % len(PROVINCES)]}
+
+
+def chat_payload(i):
+    sector = list(SECTORS)[i % len(SECTORS)]
+    kind = ['Line chart of {} by year', 'Bar chart of {} by province'][(i // 3) % 2]
+    return {'query': kind.format(f'{sector.lower()} series {(i // 6) % 20}')}
+
+
+def register_payload(i):
+    user_id = next(_user_ids)
+    return {'username': f'bench{user_id}', 'email': f'bench{user_id}@example.com', 'password': BENCH_PASSWORD}
+
+
+def bench_token(email):
+    from api.config import BaseConfig
+    return jwt.encode({'email': email, 'exp': datetime.utcnow() + timedelta(hours=1)}, BaseConfig.SECRET_KEY)
+
+
+def logout_headers(i):
+    # Logout revokes the token and deactivates the user, so every request logs out another one
+    return {'authorization': bench_token(f'logout{next(_logout_ids)}@example.com')}
+
+
+# name: (method, path, payload(i) or None, headers(i) or None, uses the --auth-requests budget)
+ENDPOINTS = {
+    'query-data': ('POST', '/api/query-data', query_data_payload, None, False),
+    'query-menu': ('GET', '/api/query-menu', None, None, False),
+    'chat': ('POST', '/api/chat', chat_payload, None, False),
+    'register': ('POST', '/api/users/register', register_payload, None, True),
+    'login': ('POST', '/api/users/login', lambda i: {'email': BENCH_EMAIL, 'password': BENCH_PASSWORD}, None, True),
+    'edit': ('POST', '/api/users/edit', lambda i: {'userID': '1', 'username': f'bench{i % 1000}'},
+             lambda i: {'authorization': bench_token(BENCH_EMAIL)}, True),
+    'logout': ('POST', '/api/users/logout', None, logout_headers, True),
+}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def sql_count(headers):
+    match = SQL_TIMING.search(headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+class TestClientTransport():
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload, headers):
+        response = self.client.open(path, method=method, json=payload, headers=headers)
+        return response.status_code, response.headers
+
+
+class HttpTransport():
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.local = threading.local()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, method, path, payload, headers):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        response = session.request(method, self.url + path, json=payload, headers=headers, timeout=60)
+        return response.status_code, response.headers
+
+    def close(self):
+        self.server.shutdown()
+
+
+def measure(transport, endpoint, count, clients):
+    """Sends `count` requests from `clients` threads, returns the metrics of the endpoint."""
+    method, path, payload, headers, _ = ENDPOINTS[endpoint]
+    numbers = itertools.count()
+    lock = threading.Lock()
+    timings, statements, errors = [], [], [0]
+
+    def client():
+        while True:
+            with lock:
+                i = next(numbers)
+            if i >= count:
+                return
+            started = time.perf_counter()
+            try:
+                status, response_headers = transport.request(method, path, payload(i) if payload else None,
+                                                             headers(i) if headers else None)
+            except requests.RequestException:
+                status, response_headers = None, {}
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings.append(elapsed)
+                statements.append(sql_count(response_headers))
+                if status is None or status >= 400:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'requests': count,
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'throughput': round(count / elapsed, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'sql_per_request': round(statistics.mean(statements), 2),
+        'errors': errors[0],
+    }
+
+
+def run_scale(scale, args):
+    """Loads `scale` rows per sector and benchmarks every endpoint; {key: metrics}."""
+    app, path = make_app()
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    from api.llm import FakeGeminiClient, set_chat_client
+    from api.models import db, Users
+    from api.routes import SECTOR_MODELS
+    set_chat_client(FakeGeminiClient())
+
+    results = {}
+    try:
+        with app.app_context():
+            for model in SECTOR_MODELS:
+                populate(model, scale)
+            user = Users(username='bench', email=BENCH_EMAIL, jwt_auth_active=True)
+            user.set_password(BENCH_PASSWORD)
+            user.save()
+            # One user per logout request (warm-up included), sharing one password hash
+            for i in range(len(args.transports) * (args.auth_requests + 5)):
+                db.session.add(Users(username=f'logout{i}', email=f'logout{i}@example.com',
+                                     password=user.password, jwt_auth_active=True))
+            db.session.commit()
+
+        for transport_name in args.transports:
+            transport = TestClientTransport(app) if transport_name == 'test-client' else HttpTransport(app)
+            clients = 1 if transport_name == 'test-client' else args.clients
+            try:
+                for endpoint in args.endpoints:
+                    count = args.auth_requests if ENDPOINTS[endpoint][4] else args.requests
+                    # Warm-up: first-use caches and indexes are not what a baseline should measure
+                    measure(transport, endpoint, min(count, 5), 1)
+                    results[f'{scale}/{transport_name}/{endpoint}'] = measure(transport, endpoint, count, clients)
+            finally:
+                if transport_name == 'http':
+                    transport.close()
+    finally:
+        os.remove(path)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric in CHECKED:
+            if current[metric] > previous[metric] * (1 + threshold) and \
+                    current[metric] - previous[metric] >= MIN_DELTA_MS:
+                regressions.append(f'{key}: {metric} {previous[metric]} -> {current[metric]}')
+        if current['throughput'] < previous['throughput'] / (1 + threshold):
+            regressions.append(f'{key}: throughput {previous["throughput"]} -> {current["throughput"]} req/s')
+        if current['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f'{key}: peak_rss_mb {previous["peak_rss_mb"]} -> {current["peak_rss_mb"]}')
+        # Statement counts are deterministic but for the odd cache write
+        if current['sql_per_request'] >= previous['sql_per_request'] + 0.5:
+            regressions.append(f'{key}: sql_per_request {previous["sql_per_request"]} -> {current["sql_per_request"]}')
+        if current['errors'] > previous['errors']:
+            regressions.append(f'{key}: errors {previous["errors"]} -> {current["errors"]}')
+    return regressions
+
+
+def print_results(results, baseline):
+    print('%-32s %7s %9s %9s %9s %9s %8s %7s %6s' % ('scale/transport/endpoint', 'reqs', 'p50 ms', 'p95 ms',
+                                                    'p99 ms', 'req/s', 'rss MB', 'sql/req', 'errors'))
+    for key, entry in results.items():
+        print('%-32s %7d %9.2f %9.2f %9.2f %9.1f %8.1f %7.2f %6d' % (
+            key, entry['requests'], entry['p50_ms'], entry['p95_ms'], entry['p99_ms'], entry['throughput'],
+            entry['peak_rss_mb'], entry['sql_per_request'], entry['errors']))
+        previous = baseline.get(key)
+        if previous:
+            print('%-32s %7s %9.2f %9.2f %9.2f %9.1f %8.1f %7.2f %6d' % (
+                '  baseline', '', previous['p50_ms'], previous['p95_ms'], previous['p99_ms'],
+                previous['throughput'], previous['peak_rss_mb'], previous['sql_per_request'], previous['errors']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='10000,100000', help="Comma-separated rows per sector.")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and transport.")
+    parser.add_argument('--auth-requests', type=int, default=20,
+                        help="Requests for register/login/edit/logout, which hash passwords or write users.")
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent clients of the http transport.")
+    parser.add_argument('--transports', default=','.join(TRANSPORTS))
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--baseline', help="Compare against this file, exit 1 on regressions.")
+    parser.add_argument('--save-baseline', help="Write the results to this file.")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed relative slowdown (0.25 = 25%%).")
+    # A single scale in this process, results written to a file (what the parent runs per scale)
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.transports = [name for name in args.transports.split(',') if name]
+    args.endpoints = [name for name in args.endpoints.split(',') if name]
+    for name in args.transports:
+        if name not in TRANSPORTS:
+            parser.error(f'unknown transport {name}, choose from {", ".join(TRANSPORTS)}')
+    for name in args.endpoints:
+        if name not in ENDPOINTS:
+            parser.error(f'unknown endpoint {name}, choose from {", ".join(ENDPOINTS)}')
+
+    if args.run_scale is not None:
+        with open(args.output, 'w') as f:
+            json.dump(run_scale(args.run_scale, args), f)
+        return
+
+    # One process per scale: a clean heap for the RSS figures and no caches carried over
+    results = {}
+    for scale in [int(value) for value in args.scales.split(',') if value]:
+        handle, output = tempfile.mkstemp(suffix='.json', prefix='cdri-suite-')
+        os.close(handle)
+        try:
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_suite', *sys.argv[1:],
+                            '--run-scale', str(scale), '--output', output], check=True)
+            with open(output) as f:
+                results.update(json.load(f))
+        finally:
+            os.remove(output)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            document = json.load(f)
+        baseline = document['results']
+        if document['environment'] != environment():
+            print(f'warning: baseline was recorded on {document["environment"]}', file=sys.stderr)
+
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+        print(f'\nbaseline written to {args.save_baseline}')
+
+    if args.baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\nregressions beyond %d%%:' % (args.threshold * 100))
+            for regression in regressions:
+                print('  ' + regression)
+            raise SystemExit(1)
+        print('\nno regressions against %s' % args.baseline)
+
+
+def environment():
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system(),
+            'cpus': os.cpu_count()}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# -*- encoding: utf-8 -*-
+"""
+   Load test: does a slow upstream starve the API?
+
+   Starts a local stub for the GitHub OAuth endpoints that answers after
+   --delay seconds, then runs the API under gunicorn (1 worker, --threads
+   threads) twice: with effectively unbounded upstream concurrency and with
+   the bounded pools. In each run, --slow-clients threads keep calling the
+   OAuth and chat endpoints while --fast-clients threads measure
+   /api/query-menu throughput.
+
+   Usage: python -m benchmarks.bench_upstream [--delay 2] [--duration 5]
+"""
+
+import argparse, itertools, os, socket, statistics, subprocess, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(delay):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            time.sleep(delay)
+            self.reply(b'access_token=stub-token&scope=&token_type=bearer', 'application/x-www-form-urlencoded')
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.reply(b'{"login": "stub-user", "email": "stub@example.com"}', 'application/json')
+
+        def reply(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_api(port, env):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', '1', '-k', 'gthread', '--threads', env['BENCH_THREADS'],
+         '-b', f'127.0.0.1:{port}', 'wsgi:app'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/query-menu', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit('API did not start')
+
+
+def run(mode, limit, args, stub_url):
+    handle, db_path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(handle)
+    port = free_port()
+    env = dict(os.environ,
+               SQLALCHEMY_DATABASE_URI='sqlite:///' + db_path,
+               BENCH_THREADS=str(args.threads),
+               AUTO_MIGRATE='1', CHAT_CLIENT='fake', CHAT_FAKE_LATENCY=str(args.delay),
+               CHAT_MAX_CONCURRENCY=str(limit), CHAT_MAX_FOLLOWERS=str(limit), OAUTH_MAX_CONCURRENCY=str(limit),
+               GITHUB_TOKEN_URL=stub_url + '/token', GITHUB_USER_URL=stub_url + '/user')
+    process = start_api(port, env)
+    base = f'http://127.0.0.1:{port}'
+
+    stop = threading.Event()
+    fast_timings, slow_status = [], []
+    counter = itertools.count()
+
+    def slow_client():
+        session = requests.Session()
+        while not stop.is_set():
+            try:
+                if next(counter) % 2:
+                    response = session.get(base + '/api/sessions/oauth/github/?code=x', timeout=30)
+                else:
+                    response = session.post(base + '/api/chat', json={'query': f'chart {next(counter)}'}, timeout=30)
+                slow_status.append(response.status_code)
+            except requests.RequestException:
+                slow_status.append(None)
+
+    def fast_client():
+        session = requests.Session()
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                session.get(base + '/api/query-menu', timeout=30)
+                fast_timings.append(time.perf_counter() - started)
+            except requests.RequestException:
+                pass
+
+    threads = [threading.Thread(target=slow_client) for _ in range(args.slow_clients)]
+    threads += [threading.Thread(target=fast_client) for _ in range(args.fast_clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    process.terminate()
+    process.wait()
+    os.remove(db_path)
+
+    timings = sorted(fast_timings)
+    p95 = timings[int(len(timings) * 0.95)] if timings else float('nan')
+    print('%-10s menu %7.1f req/s  p50 %6.3fs  p95 %6.3fs | upstream ok %3d, 503 %3d, other %3d' % (
+        mode, len(timings) / args.duration, statistics.median(timings) if timings else float('nan'), p95,
+        slow_status.count(200), slow_status.count(503), len(slow_status) - slow_status.count(200) - slow_status.count(503)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--delay', type=float, default=2.0, help="Upstream latency in seconds.")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker.")
+    parser.add_argument('--limit', type=int, default=2, help="Bounded per-upstream concurrency.")
+    parser.add_argument('--slow-clients', type=int, default=16)
+    parser.add_argument('--fast-clients', type=int, default=4)
+    args = parser.parse_args()
+
+    stub = start_stub(args.delay)
+    stub_url = 'http://127.0.0.1:%d' % stub.server_address[1]
+    try:
+        run('unbounded', 1000, args, stub_url)
+        run('bounded', args.limit, args, stub_url)
+    finally:
+        stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
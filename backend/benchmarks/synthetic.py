@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+"""
+   Synthetic sector tables shared by the benchmark scripts
+"""
+
+import json, os, random, tempfile
+
+PROVINCES = ['Phnom Penh', 'Siem Reap', 'Battambang', 'Kampong Cham', 'Kampot', 'Kandal', 'Takeo', 'Prey Veng',
+             'Svay Rieng', 'Pursat', 'Kratie', 'Mondulkiri', 'Ratanakiri', 'Stung Treng', 'Preah Vihear',
+             'Oddar Meanchey', 'Banteay Meanchey', 'Pailin', 'Koh Kong', 'Kep', 'Sihanoukville', 'Kampong Speu',
+             'Kampong Thom', 'Kampong Chhnang', 'Tboung Khmum']
+
+SECTORS = {
+    'Education': ['Primary Education', 'Secondary Education', 'Higher Education'],
+    'Agriculture': ['Crops', 'Livestock', 'Fisheries'],
+    'Economic': ['Trade', 'Prices', 'Labour'],
+}
+
+INDICATORS = ['Total', 'Male', 'Female', 'Urban', 'Rural']
+
+
+def make_app(path=None):
+    """
+       Returns (app, path) with the API bound to a fresh SQLite file and the
+       schema created.
+    """
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix='.sqlite3', prefix='cdri-bench-')
+        os.close(handle)
+        os.remove(path)
+
+    from api import app, db
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+
+    with app.app_context():
+        db.create_all()
+    return app, path
+
+
+def generate_rows(sector, count, seed=0):
+    """Yields `count` row dicts shaped like the production sector tables."""
+    rng = random.Random(seed)
+    subsectors = SECTORS[sector]
+
+    for i in range(count):
+        subsector_1 = subsectors[i % len(subsectors)]
+        series = i // 5000
+        yield {
+            'sector': sector,
+            'subsector_1': subsector_1,
+            'subsector_2': '%s %d' % (subsector_1, series % 4) if series % 2 else None,
+            'series_name': '%s series %d' % (sector, series % 20),
+            'series_code': '%s.%04d' % (sector[:3].upper(), series % 20),
+            'indicator_value': round(rng.uniform(0, 1000), 2),
+            'indicator': INDICATORS[i % len(INDICATORS)],
+            'province': PROVINCES[(i // len(INDICATORS)) % len(PROVINCES)],
+            'year': str(2000 + (i // 125) % 24),
+            'source': 'Synthetic',
+            'latitude': round(rng.uniform(10.4, 14.6), 4),
+            'longitude': round(rng.uniform(102.3, 107.6), 4),
+            'indicator_unit': 'Number',
+            'tag': None,
+            'filters': json.dumps({'grade': 'Grade %d' % (i % 6 + 1)}) if series % 3 == 0 else None,
+        }
+
+
+def populate(model, count, seed=0, batch_size=20000):
+    """Bulk-loads `count` synthetic rows into `model`'s table."""
+    from api.models import db, DataVersion
+
+    sector = {'education_data': 'Education', 'agriculture_data': 'Agriculture',
+              'economic_data': 'Economic'}[model.__tablename__]
+
+    batch = []
+    for row in generate_rows(sector, count, seed):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(model.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(model.__table__.insert(), batch)
+    model.sync_dimensions()
+    DataVersion.bump([model.__tablename__])
+    db.session.commit()
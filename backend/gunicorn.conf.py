@@ -0,0 +1,56 @@
+# -*- encoding: utf-8 -*-
+"""
+   Production serving profile: gunicorn -c gunicorn.conf.py wsgi:app
+
+   The API mostly waits on the database and on upstream calls (Gemini,
+   OAuth), so workers are threaded (gthread): processes for CPU
+   parallelism, threads to overlap the waits. The app is preloaded in the
+   master so imports (flask-restx, SQLAlchemy) are paid once and shared
+   copy-on-write by the workers; the Gemini SDK is only imported by a
+   worker's first /api/chat call. Each worker builds its in-process caches
+   and indexes before it accepts connections (post_worker_init). Every
+   setting can be overridden with a GUNICORN_* environment variable.
+"""
+
+import multiprocessing, os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Processes: one per core plus one; threads cover I/O waits
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# Longer than CHAT_TIMEOUT, so a slow Gemini call ends in a 504 from the app, not a killed worker
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then so in-process caches and fragmentation cannot grow unbounded
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# Set GUNICORN_ACCESSLOG to an empty string to turn the access log off
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOGLEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Workers must not share pooled connections opened in the master."""
+    from api import app, db
+    from api.replicas import replicas
+
+    with app.app_context():
+        db.engine.dispose()
+    replicas.dispose()
+
+
+def post_worker_init(worker):
+    """Builds the worker's in-process caches and indexes before it takes its first request."""
+    from api import app, start_worker
+
+    with app.app_context():
+        start_worker()
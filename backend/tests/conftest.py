@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+"""
+   Fixtures: the API bound to a fresh SQLite file per test, with every
+   in-process cache emptied so nothing leaks from one test to the next.
+
+   Run from backend/: python -m pytest -q
+"""
+
+import shutil
+
+import pytest
+
+from benchmarks.synthetic import make_app
+
+
+def reset_state(app):
+    from api.auth import revoked_tokens, user_cache
+    from api.caching import data_versions, result_cache
+    from api.columnar import snapshots
+    from api.facets import facet_store
+    from api.llm import chart_cache, template_cache
+    from api.replicas import replicas
+    from api.routes import menu_cache, sector_registry
+    from api.search import series_search
+
+    data_versions.invalidate()
+    result_cache.configure(None)
+    result_cache.hits = result_cache.misses = 0
+    menu_cache.invalidate()
+    sector_registry.invalidate()
+    facet_store._indexes.clear()
+    snapshots._snapshots.clear()
+    series_search._documents.clear()
+    series_search._index = None
+    for cache in (chart_cache, template_cache):
+        cache.__init__(cache.namespace)
+    user_cache.clear()
+    revoked_tokens.reset()
+    replicas.init_app(app)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app, _ = make_app(str(tmp_path / 'primary.sqlite3'))
+    app.config.update(TESTING=True, AUTO_MIGRATE=False, DB_REPLICA_URIS=[], RESULT_CACHE_BACKEND='memory',
+                      DATA_ENGINE='sql', DATA_STORAGE='tables')
+    reset_state(app)
+
+    with app.app_context():
+        yield app
+        from api.models import db
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def token(client):
+    """A valid JWT for a freshly registered user."""
+    from api.models import Users
+
+    user = Users(username='tester', email='tester@example.com')
+    user.set_password('test-pass')
+    user.save()
+    response = client.post('/api/users/login', json={'email': 'tester@example.com', 'password': 'test-pass'})
+    return response.get_json()['token']
+
+
+def build_database(path, load):
+    """Runs `load` in an app bound to the SQLite file `path`, then closes it so the file can be copied."""
+    from api.models import db
+
+    app, _ = make_app(path)
+    with app.app_context():
+        load()
+        db.session.remove()
+        db.engine.dispose()
+    return path
+
+
+def copy_database(app, path):
+    """Replaces the database of `app` with a copy of `path`, caches emptied."""
+    from api.models import db
+
+    db.session.remove()
+    db.engine.dispose()
+    shutil.copy(path, app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])
+    reset_state(app)
+
+
+@pytest.fixture(scope='session')
+def sector_database(tmp_path_factory):
+    """A SQLite file with the three sector tables loaded, built once and copied for each test that needs it."""
+    from api.routes import SECTOR_MODELS
+    from benchmarks.synthetic import populate
+
+    def load():
+        # Three series per sector, the odd one with subsector_2 values
+        for model in SECTOR_MODELS:
+            populate(model, 12000)
+
+    return build_database(str(tmp_path_factory.mktemp('sectors') / 'sectors.sqlite3'), load)
+
+
+@pytest.fixture(scope='session')
+def unified_database(tmp_path_factory, sector_database):
+    """sector_database with the sector tables also copied into the unified fact table."""
+    from api.ingest import unify_tables
+    from api.routes import SECTORS
+
+    path = str(tmp_path_factory.mktemp('unified') / 'unified.sqlite3')
+    shutil.copy(sector_database, path)
+    return build_database(path, lambda: unify_tables(SECTORS, report=lambda line: None))
+
+
+@pytest.fixture
+def sectors(app, sector_database):
+    """The sector tables of `app` loaded with synthetic rows."""
+    from api.routes import SECTOR_MODELS
+
+    copy_database(app, sector_database)
+    return SECTOR_MODELS
+
+
+@pytest.fixture
+def unified(app, unified_database):
+    """The sector tables and the unified fact table of `app` loaded with the same synthetic rows."""
+    copy_database(app, unified_database)
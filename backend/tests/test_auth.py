@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+
+import re, time
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+
+from api.auth import RevocationSet, purge_expired_tokens, revoked_tokens, token_hash
+from api.models import JWTTokenBlocklist
+
+
+def test_logout_revokes_the_token(client, token):
+    headers = {'authorization': token}
+
+    assert client.post('/api/users/logout', headers=headers).status_code == 200
+
+    response = client.post('/api/users/logout', headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['msg'] == 'Token revoked.'
+
+
+def test_edit_renames_the_token_owner(client, token):
+    from api.models import Users
+
+    response = client.post('/api/users/edit', headers={'authorization': token},
+                           json={'userID': '1', 'username': 'renamed'})
+    assert response.status_code == 200
+    assert Users.get_by_email('tester@example.com').username == 'renamed'
+
+
+def test_purge_keeps_tokens_that_have_not_expired(app):
+    now = datetime.now(timezone.utc)
+    for name, expires_at in (('expired', now - timedelta(hours=1)), ('valid', now + timedelta(hours=1))):
+        JWTTokenBlocklist(jwt_token=name, token_hash=token_hash(name), created_at=now, expires_at=expires_at).save()
+    revoked_tokens.sync()
+
+    assert purge_expired_tokens() == 1
+    assert not revoked_tokens.contains(token_hash('expired'))
+    assert revoked_tokens.contains(token_hash('valid'))
+    assert len(revoked_tokens) == 1
+
+
+def test_purge_backfills_legacy_rows(app):
+    now = datetime.now(timezone.utc)
+    expired = jwt.encode({'email': 'a@example.com', 'exp': now - timedelta(hours=1)}, 'secret')
+    valid = jwt.encode({'email': 'b@example.com', 'exp': now + timedelta(hours=1)}, 'secret')
+    forever = jwt.encode({'email': 'c@example.com'}, 'secret')
+    # Rows as the migration left them: no token_hash, no expires_at
+    for token in (expired, valid, forever, 'not a token'):
+        JWTTokenBlocklist(jwt_token=token, created_at=now - timedelta(days=1)).save()
+    revoked_tokens.sync()
+
+    assert purge_expired_tokens() == 2
+    assert [row.jwt_token for row in JWTTokenBlocklist.query.order_by(JWTTokenBlocklist.id)] == [valid, forever]
+    assert not revoked_tokens.contains(token_hash(expired))
+    assert revoked_tokens.contains(token_hash(valid)) and revoked_tokens.contains(token_hash(forever))
+    assert JWTTokenBlocklist.query.filter_by(jwt_token=valid).one().token_hash == token_hash(valid)
+
+
+def test_token_required_runs_no_sql_once_warm(app, client, token):
+    from api.routes import token_required
+
+    app.add_url_rule('/api/test/whoami', 'whoami',
+                     token_required(lambda current_user: {'email': current_user.email}))
+    headers = {'authorization': token}
+    # Fills the user cache
+    client.get('/api/test/whoami', headers=headers)
+
+    response = client.get('/api/test/whoami', headers=headers)
+    assert response.get_json() == {'email': 'tester@example.com'}
+    statements = re.search(r'sql;dur=[0-9.]+;desc="(\d+) statements"', response.headers['Server-Timing'])
+    assert statements.group(1) == '0'
+
+
+def test_redis_revocations_are_pruned_by_expiry():
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeRedis()
+    writer, reader = RevocationSet(), RevocationSet()
+    writer.configure(client)
+    reader.configure(client)
+
+    now = time.time()
+    writer.add('expired', now - 60)
+    writer.add('valid', now + 60)
+    writer.add('forever')
+    assert reader.contains('expired') and reader.contains('forever')
+
+    writer.purge(now)
+    assert client.zcard(RevocationSet.key) == 2
+    # Another worker that never saw the expired token
+    other = RevocationSet()
+    other.configure(client)
+    assert not other.contains('expired')
+    assert other.contains('valid') and other.contains('forever')
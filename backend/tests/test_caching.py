@@ -0,0 +1,141 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from api.caching import MemoryBackend, RedisBackend, data_versions, result_cache
+from api.models import db, DataVersion
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request, app):
+    if request.param == 'memory':
+        backend = MemoryBackend(max_entries=16, ttl=60)
+    else:
+        backend = RedisBackend(ttl=60, client=fakeredis.FakeRedis())
+    result_cache.configure(backend)
+    return backend
+
+
+def cached(filters, body=b'body'):
+    """Asks the result cache for `filters`; returns whether it had to compute the body."""
+    computed = []
+    result = result_cache.get_or_compute('education_data', filters,
+                                         lambda: computed.append(True) or body)
+    assert result == body
+    return bool(computed)
+
+
+def test_keys_ignore_empty_filters_and_order(app):
+    first = result_cache.make_key('education_data', {'sector': 'Education', 'province': 'Kampot', 'year': ''})
+    second = result_cache.make_key('education_data', {'province': 'Kampot', 'sector': 'Education', 'tag': None})
+
+    assert first == second
+    assert first != result_cache.make_key('education_data', {'sector': 'Education', 'province': 'Takeo'})
+    assert first != result_cache.make_key('economic_data', {'sector': 'Education', 'province': 'Kampot'})
+
+
+def test_hit_after_miss(backend):
+    assert cached({'sector': 'Education'})
+    assert not cached({'sector': 'Education', 'province': None})
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+
+
+def test_new_data_version_misses(backend):
+    assert cached({'sector': 'Education'})
+
+    DataVersion.bump(['education_data'])
+    db.session.commit()
+    data_versions.invalidate()
+
+    assert cached({'sector': 'Education'})
+    # Cached again under the new version
+    assert not cached({'sector': 'Education'})
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2, ttl=60)
+    backend.set('a', b'1')
+    backend.set('b', b'2')
+    backend.get('a')
+    backend.set('c', b'3')
+
+    assert backend.get('b') is None
+    assert backend.get('a') == b'1' and backend.get('c') == b'3'
+    assert backend.evictions == 1
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryBackend(max_entries=2, ttl=-1)
+    backend.set('a', b'1')
+
+    assert backend.get('a') is None
+    assert backend.evictions == 1
+    assert len(backend) == 0 and backend.size == 0
+
+
+def test_memory_backend_is_bounded_by_body_bytes():
+    backend = MemoryBackend(max_entries=16, max_bytes=9, ttl=60)
+    backend.set('a', b'1234')
+    backend.set('b', b'5678')
+    backend.set('a', b'12')
+    backend.set('c', b'9012')
+
+    # Replacing 'a' freed its old body; 'c' pushed out 'b', the least recently used
+    assert backend.get('b') is None
+    assert backend.size == 6
+    assert backend.evictions == 1
+
+    # A body over the whole budget is not cached, and does not flush the others
+    backend.set('d', b'x' * 10)
+    assert backend.get('d') is None
+    assert backend.get('a') == b'12' and backend.get('c') == b'9012'
+
+
+def test_redis_backend_prefixes_and_expires_keys():
+    client = fakeredis.FakeRedis()
+    client.set('unrelated', b'x')
+    backend = RedisBackend(ttl=60, client=client)
+    backend.set('a', b'1')
+
+    assert backend.get('a') == b'1'
+    assert 0 < client.ttl('cdri:result:a') <= 60
+
+    backend.clear()
+    assert backend.get('a') is None
+    assert client.get('unrelated') == b'x'
+
+
+def test_redis_evictions_come_from_the_server(app):
+    class Client(fakeredis.FakeRedis):
+        def info(self, section=None):
+            return {'evicted_keys': 7}
+
+    result_cache.configure(RedisBackend(client=Client()))
+    assert result_cache.stats()['evictions'] == 7
+
+    # A server that does not answer INFO reports no eviction count rather than 0
+    result_cache.configure(RedisBackend(client=fakeredis.FakeRedis()))
+    assert 'evictions' not in result_cache.stats()
+
+
+def test_redis_stats_do_not_scan_the_keyspace(app):
+    class Client(fakeredis.FakeRedis):
+        def scan_iter(self, *args, **kwargs):
+            raise AssertionError('stats() scanned the keyspace')
+
+    result_cache.configure(RedisBackend(client=Client()))
+    assert 'entries' not in result_cache.stats()
+
+
+def test_stats_match_the_metrics(client):
+    assert cached({'sector': 'Education'})
+
+    stats = client.get('/api/cache/stats').get_json()['result_cache']
+    assert stats['backend'] == 'MemoryBackend'
+    assert (stats['entries'], stats['bytes'], stats['misses']) == (1, len(b'body'), 1)
+
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'cdri_result_cache_entries 1' in metrics
+    assert 'cdri_result_cache_bytes 4' in metrics
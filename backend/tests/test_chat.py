@@ -0,0 +1,120 @@
+# -*- encoding: utf-8 -*-
+
+import threading, time
+
+import pytest
+
+from api.caching import data_versions
+from api.llm import FakeGeminiClient, SingleFlight, set_chat_client
+from api.models import db, DataVersion, EducationData
+from api.upstream import Upstream, UpstreamTimeout
+
+ENROLMENT = {('2019', 'Kampot'): 80.0, ('2019', 'Takeo'): 90.0, ('2020', 'Kampot'): 84.0, ('2020', 'Takeo'): 94.0}
+
+
+@pytest.fixture
+def fake_model(app):
+    fake = FakeGeminiClient()
+    set_chat_client(fake)
+    yield fake
+    set_chat_client(None)
+
+
+@pytest.fixture
+def enrolment(app):
+    rows = [{'sector': 'Education', 'subsector_1': 'Primary Education', 'series_name': 'Net enrolment rate',
+             'indicator': 'Total', 'indicator_unit': 'Percent', 'year': year, 'province': province,
+             'indicator_value': value} for (year, province), value in ENROLMENT.items()]
+    rows += [dict(row, series_name='Number of teachers', indicator_unit='Number', indicator_value=1000.0)
+             for row in rows]
+    db.session.execute(EducationData.__table__.insert(), rows)
+    DataVersion.bump([EducationData.__tablename__])
+    db.session.commit()
+    data_versions.invalidate()
+
+
+def test_series_query_charts_hub_data(client, fake_model, enrolment):
+    response = client.post('/api/chat', json={'query': 'Line chart of net enrolment rate by year'})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['source'] == {'sector': 'Education', 'series_name': 'Net enrolment rate', 'group_by': 'year',
+                              'measure': 'avg', 'indicators': ['Total']}
+    chart = body['chartConfig']
+    assert chart['title']['text'] == 'Net enrolment rate (Total)'
+    assert chart['xAxis']['data'] == ['2019', '2020']
+    assert chart['yAxis']['name'] == 'Percent'
+    assert [(entry['type'], entry['data']) for entry in chart['series']] == [('line', [85.0, 89.0])]
+    # The model only wrote the template
+    assert fake_model.calls == 1
+
+    # Another series of the same shape reuses it
+    response = client.post('/api/chat', json={'query': 'line chart of number of teachers by year'})
+    assert response.get_json()['source']['series_name'] == 'Number of teachers'
+    assert response.get_json()['chartConfig']['series'][0]['data'] == [2000.0, 2000.0]
+    assert fake_model.calls == 1
+
+
+def test_other_query_falls_back_to_the_model(client, fake_model, enrolment):
+    query = 'Pie chart of favourite ice cream flavours'
+    response = client.post('/api/chat', json={'query': query})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert 'source' not in body
+    assert body['chartConfig']['title']['text'] == query
+    assert body['chartConfig']['series'][0]['data'] == [120, 132, 101, 134]
+    assert fake_model.calls == 1
+
+    # Cached by normalized query
+    response = client.post('/api/chat', json={'query': '  pie CHART of favourite ice-cream flavours!'})
+    assert response.get_json()['chartConfig'] == body['chartConfig']
+    assert fake_model.calls == 1
+
+
+def test_single_flight_followers_time_out():
+    flight, started, release = SingleFlight(timeout=0.05), threading.Event(), threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait()
+
+    leader = threading.Thread(target=flight.do, args=('q', stuck))
+    leader.start()
+    started.wait()
+    try:
+        with pytest.raises(UpstreamTimeout):
+            flight.do('q', stuck)
+    finally:
+        release.set()
+        leader.join()
+
+
+def test_slow_upstream_fails_fast_while_the_api_keeps_serving(client, monkeypatch):
+    from api import llm
+
+    upstream = Upstream('chat', max_concurrency=1, timeout=0.5)
+    monkeypatch.setitem(llm.upstreams, 'chat', upstream)
+    monkeypatch.setattr(llm, 'single_flight', SingleFlight(timeout=0.5, max_followers=1))
+    set_chat_client(FakeGeminiClient(latency=1.5))
+    client.get('/api/query-menu')
+
+    # A burst of the same prompt: one call, one waiting follower, the rest turned away
+    statuses = []
+    threads = [threading.Thread(target=lambda: statuses.append(
+        client.post('/api/chat', json={'query': 'Pie chart of favourite fruits'}).status_code)) for _ in range(6)]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        started = time.perf_counter()
+        menu = client.get('/api/query-menu')
+        elapsed = time.perf_counter() - started
+        for thread in threads:
+            thread.join()
+    finally:
+        upstream.executor.shutdown(wait=True)
+        set_chat_client(None)
+
+    assert menu.status_code == 200 and elapsed < 0.5
+    assert sorted(statuses) == [503] * 4 + [504] * 2
@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+
+def test_unknown_path_gets_the_envelope(client):
+    response = client.get('/nope')
+
+    assert response.status_code == 404
+    assert response.get_json()['success'] is False
+
+
+def test_wrong_method_gets_the_envelope(client):
+    response = client.post('/metrics')
+
+    assert response.status_code == 405
+    assert response.get_json()['success'] is False
+    assert 'GET' in response.headers['Allow']
+
+
+def test_unknown_query_key_is_a_bad_request(client):
+    response = client.post('/api/query-data', json={'sector': 'Education', 'bogus': 'x'})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"success": False, "msg": "Unknown filter: bogus"}
+
+
+def test_api_errors_keep_the_envelope(client):
+    response = client.get('/api/query-data')
+
+    assert response.status_code == 405
+    assert response.get_json()['success'] is False
+
+
+MAP = {'bbox': [102, 10, 108, 15], 'zoom': 7}
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/api/query-data', {}), ('/api/aggregate', {'group_by': ['year']}), ('/api/map-points', MAP)])
+@pytest.mark.parametrize('filters', [
+    {'filters': 'abc'}, {'filters': ['gender']}, {'filters': {'gender': {'is': 'Female'}}},
+    {'filters': {'grade': [1, {'x': 2}]}}, {'province': ['Kampot']}])
+def test_malformed_filters_are_a_bad_request(client, path, payload, filters):
+    response = client.post(path, json=dict(payload, sector='Education', **filters))
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
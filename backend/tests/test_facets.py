@@ -0,0 +1,21 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from api.facets import FacetIndex
+from benchmarks.bench_facets import STEPS
+
+
+@pytest.mark.parametrize('name, selection', STEPS)
+def test_facets_match_query_data(app, client, sectors, monkeypatch, name, selection):
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    indexed = client.post('/api/query-data', json=selection).get_json()
+    document = client.get('/api/facets', query_string=selection).get_json()
+
+    assert document['rows'] == len(indexed['data'])
+    assert {key: [entry['value'] for entry in values] for key, values in document['facets'].items()} \
+        == indexed['filters']
+
+    # The same selection without the index, from DISTINCT queries
+    monkeypatch.setattr(FacetIndex, 'covers', staticmethod(lambda filters: False))
+    assert client.post('/api/query-data', json=selection).get_json() == indexed
@@ -0,0 +1,51 @@
+# -*- encoding: utf-8 -*-
+
+import gzip, io, json
+
+import pytest
+
+from api.encoding import FORMATS, compress, encode_data, rows_to_columns
+from api.models import EducationData
+
+# Optional packages each format needs
+REQUIRES = {'msgpack': 'msgpack', 'arrow': 'pyarrow', 'parquet': 'pyarrow'}
+
+
+def decode(body, format_name):
+    """Back to (columns, meta)."""
+    if format_name == 'json':
+        document = json.loads(body)
+        return rows_to_columns(document['data']), {'filters': document['filters']}
+    if format_name == 'columns':
+        document = json.loads(body)
+        return document.pop('columns'), document
+    if format_name == 'msgpack':
+        import msgpack
+        document = msgpack.unpackb(body)
+        return document.pop('columns'), document
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.ipc.open_stream(body).read_all() if format_name == 'arrow' else pq.read_table(io.BytesIO(body))
+    return table.to_pydict(), json.loads(table.schema.metadata[b'cdri'])
+
+
+@pytest.mark.parametrize('format_name', list(FORMATS))
+def test_formats_round_trip(sectors, format_name):
+    if format_name in REQUIRES:
+        pytest.importorskip(REQUIRES[format_name])
+    result = EducationData.get_data(series_name='Education series 0')
+
+    columns, meta = decode(encode_data(result, format_name), format_name)
+
+    assert columns == rows_to_columns(result['data'])
+    assert meta['filters'] == result['filters']
+
+
+def test_compressed_bodies_decode(sectors):
+    result = EducationData.get_data(series_name='Education series 1')
+    body = encode_data(result, 'json')
+
+    assert json.loads(gzip.decompress(compress(body, 'gzip'))) == json.loads(json.dumps(result))
+    brotli = pytest.importorskip('brotli')
+    assert brotli.decompress(compress(body, 'br')) == body
@@ -0,0 +1,56 @@
+# -*- encoding: utf-8 -*-
+
+import math
+
+import pytest
+
+from api.models import EducationData
+from benchmarks.bench_aggregate import MEASURES, QUERIES, aggregate_rows
+from benchmarks.bench_get_data import legacy_get_data
+
+
+def normalize(payload):
+    return {
+        'data': sorted(payload['data'], key=lambda entry: entry['id']),
+        'filters': {key: sorted(values, key=str) for key, values in payload['filters'].items()},
+    }
+
+
+def same_columns(left, right):
+    assert left.keys() == right.keys()
+    for name in left:
+        assert len(left[name]) == len(right[name]), name
+        for a, b in zip(left[name], right[name]):
+            if isinstance(a, float) or isinstance(b, float):
+                assert a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9), name
+            else:
+                assert a == b, name
+
+
+@pytest.mark.parametrize('filters', [
+    # Along the hierarchy: answered from the facet index
+    {'series_name': 'Education series 0', 'subsector_1': None, 'subsector_2': None},
+    {'series_name': 'Education series 0', 'subsector_1': 'Secondary Education', 'subsector_2': None},
+    # Any other column: DISTINCT queries
+    {'series_name': 'Education series 0', 'subsector_1': 'Primary Education', 'province': 'Kampot'},
+    {'series_name': 'Education series 0', 'indicator': 'Female'},
+])
+def test_get_data_matches_the_legacy_implementation(sectors, filters):
+    assert normalize(EducationData.get_data(**filters)) == normalize(legacy_get_data(EducationData, **filters))
+
+
+@pytest.mark.parametrize('engine', ['sql', 'columnar'])
+@pytest.mark.parametrize('name, filters, group_by', QUERIES)
+def test_aggregate_matches_the_raw_rows(app, client, sectors, engine, name, filters, group_by):
+    if engine == 'columnar':
+        pytest.importorskip('numpy')
+        from api.columnar import snapshots
+        snapshots.reload(EducationData)
+    payload = dict(filters, sector='Education')
+    expected = aggregate_rows(client.post('/api/query-data', json=payload).get_json()['data'], group_by)
+
+    app.config['DATA_ENGINE'] = engine
+    response = client.post('/api/aggregate', json=dict(payload, group_by=group_by, measures=MEASURES))
+
+    assert response.status_code == 200
+    same_columns(response.get_json()['columns'], expected)
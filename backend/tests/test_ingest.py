@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+
+import csv
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from api.ingest import copy_buffer, copy_upsert, ingest_file, upsert_rows
+from api.models import db, DataVersion, EducationData
+
+HEADER = ['sector', 'subsector_1', 'series_name', 'province', 'year', 'indicator', 'indicator_value']
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    return str(path)
+
+
+def test_repeated_key_in_one_chunk_keeps_the_last_row(app, tmp_path):
+    path = write_csv(tmp_path / 'education.csv', [
+        ['Education', 'Primary Education', 'Enrolment', 'Kampot', '2020', 'Total', '10'],
+        ['Education', 'Primary Education', 'Enrolment', 'Kampot', '2020', 'Total', '20'],
+        ['Education', 'Primary Education', 'Enrolment', 'Takeo', '2020', 'Total', '30'],
+    ])
+
+    summary = ingest_file(path, EducationData, chunk_size=10, resume=False, report=lambda message: None)
+
+    assert summary['rejected'] == 0
+    values = {row.province: row.indicator_value for row in EducationData.query.all()}
+    assert values == {'Kampot': 20.0, 'Takeo': 30.0}
+
+
+def test_upsert_rows_writes_each_key_once(app):
+    rows = [{'row_key': 'a', 'series_name': 'Enrolment', 'indicator_value': 1.0},
+            {'row_key': 'b', 'series_name': 'Enrolment', 'indicator_value': 2.0},
+            {'row_key': 'a', 'series_name': 'Enrolment', 'indicator_value': 3.0}]
+
+    written = upsert_rows(db.session.connection(), EducationData, rows)
+    db.session.commit()
+
+    assert [(row['row_key'], row['indicator_value']) for row in written] == [('a', 3.0), ('b', 2.0)]
+    assert EducationData.query.count() == 2
+
+
+def test_every_chunk_commits_a_new_data_version(app, tmp_path):
+    path = write_csv(tmp_path / 'education.csv', [
+        ['Education', 'Primary Education', 'Enrolment', province, '2020', 'Total', '1']
+        for province in ('Kampot', 'Takeo', 'Kep')])
+    versions = []
+
+    def report(message):
+        # Runs after each chunk's commit: its version must already be visible
+        versions.append(DataVersion.get_versions().get(EducationData.__tablename__, 0))
+
+    ingest_file(path, EducationData, chunk_size=1, resume=False, report=report)
+
+    assert versions == [1, 2, 3]
+
+
+def test_copy_buffer_writes_null_unquoted_and_strings_quoted():
+    columns = ['series_name', 'indicator', 'indicator_value', 'latitude', 'year', 'tag']
+    rows = [{'series_name': 'Enrolment "net"', 'indicator': '', 'indicator_value': 1.5, 'latitude': None,
+             'year': 2020, 'tag': '\\N'},
+            {'series_name': None, 'indicator': 'a,b', 'indicator_value': None, 'latitude': 11.25,
+             'year': None, 'tag': 'two\nlines'}]
+
+    # COPY ... WITH (FORMAT csv, NULL '\N') only reads an unquoted \N as NULL
+    assert copy_buffer(rows, columns).getvalue() == (
+        '"Enrolment ""net""","",1.5,\\N,2020,"\\N"\n'
+        '\\N,"a,b",\\N,11.25,\\N,"two\nlines"\n')
+
+
+def test_copy_upsert_declares_the_null_marker():
+    statements = []
+
+    class Connection():
+        """Both the SQLAlchemy connection and its DBAPI connection and cursor."""
+        connection = property(lambda self: self)
+
+        def cursor(self):
+            return self
+
+        def exec_driver_sql(self, statement):
+            statements.append((statement, None))
+
+        def copy_expert(self, statement, buffer):
+            statements.append((statement, buffer.getvalue()))
+
+    copy_upsert(Connection(), EducationData.__table__, ['row_key', 'latitude'], [{'row_key': 'a', 'latitude': None}])
+
+    copy, body = statements[1]
+    assert copy.endswith("FROM STDIN WITH (FORMAT csv, NULL '\\N')")
+    assert body == '"a",\\N\n'
@@ -0,0 +1,50 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from api.models import db, EducationData
+
+
+@pytest.fixture
+def builds(sectors, monkeypatch):
+    """Counts the menu builds, as a list that grows."""
+    from api.routes import menu_cache
+
+    builds, build = [], menu_cache.build
+    monkeypatch.setattr(menu_cache, 'build', lambda: builds.append(True) or build())
+    return builds
+
+
+def test_etag_round_trip(client, builds):
+    response = client.get('/api/query-menu')
+    etag = response.headers['ETag']
+
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.get_json()['menu']
+
+    revalidated = client.get('/api/query-menu', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    assert revalidated.headers['ETag'] == etag
+
+    assert client.get('/api/query-menu', headers={'If-None-Match': '"stale"'}).status_code == 200
+    assert len(builds) == 1
+
+
+def test_menu_is_rebuilt_after_a_write(client, builds):
+    etag = client.get('/api/query-menu').headers['ETag']
+
+    db.session.add(EducationData(sector='Education', subsector_1='Primary Education',
+                                 series_name='Written after the menu', year='2031'))
+    db.session.commit()
+
+    response = client.get('/api/query-menu', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert {'sector': 'Education', 'series_name': 'Written after the menu'} in response.get_json()['data_explorer']
+    assert len(builds) == 2
+
+    # Unchanged tables: the new document is served as built
+    assert client.get('/api/query-menu', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert len(builds) == 2
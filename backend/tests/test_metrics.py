@@ -0,0 +1,33 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+from flask import g
+from sqlalchemy import exc, text
+
+from api.metrics import RequestMetrics
+from api.models import db, EducationData
+from benchmarks.synthetic import populate
+
+
+def test_failed_statements_leave_no_timer_behind(app):
+    with app.test_request_context():
+        metrics = g.request_metrics = RequestMetrics()
+        connection = db.session.connection()
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                connection.execute(text('SELECT * FROM no_such_table'))
+        connection.execute(text('SELECT 1'))
+
+        assert not connection.info.get('statement_started')
+        assert metrics.sql_count == 1
+
+
+def test_server_timing_only_on_whole_responses(client):
+    populate(EducationData, 50)
+
+    response = client.post('/api/query-data', json={'sector': 'Education'})
+    assert 'sql;dur=' in response.headers['Server-Timing']
+
+    response = client.post('/api/query-data?stream=ndjson', json={'sector': 'Education'})
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
@@ -0,0 +1,110 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from api.models import db, EducationData
+
+SELECTION = {'sector': 'Education', 'subsector_1': 'Primary Education', 'province': 'Kampot'}
+
+
+@pytest.fixture
+def education(app, sectors):
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    return SELECTION
+
+
+def pages(client, payload):
+    """Every page of `payload`, following next_cursor."""
+    documents = [client.post('/api/query-data', json=payload).get_json()]
+    while documents[-1]['next_cursor']:
+        documents.append(client.post('/api/query-data', json={
+            'sector': payload['sector'], 'cursor': documents[-1]['next_cursor']}).get_json())
+    return documents
+
+
+def test_pages_add_up_to_the_whole_selection(client, education):
+    whole = client.post('/api/query-data', json=education).get_json()
+    documents = pages(client, dict(education, limit=50))
+
+    assert len(documents) > 2
+    assert all(len(document['data']) <= 50 for document in documents)
+    assert [row for document in documents for row in document['data']] == \
+        sorted(whole['data'], key=lambda row: row['id'])
+
+
+def test_facets_come_with_the_first_page_only(client, education):
+    whole = client.post('/api/query-data', json=education).get_json()
+    documents = pages(client, dict(education, limit=50))
+
+    assert documents[0]['filters'] == whole['filters']
+    assert all('filters' not in document for document in documents[1:])
+
+
+def test_facets_are_sent_again_after_a_write(client, education):
+    first = client.post('/api/query-data', json=dict(education, limit=50)).get_json()
+    db.session.add(EducationData(sector='Education', subsector_1='Primary Education', province='Kampot',
+                                 series_name='Written between pages', year='2031'))
+    db.session.commit()
+
+    second = client.post('/api/query-data', json={'sector': 'Education', 'cursor': first['next_cursor']}).get_json()
+    assert '2031' in second['filters']['year']
+
+
+def test_after_id_starts_after_that_row(client, education):
+    first = client.post('/api/query-data', json=dict(education, limit=10)).get_json()
+    last_id = first['data'][-1]['id']
+
+    document = client.post('/api/query-data', json=dict(education, limit=10, after_id=last_id)).get_json()
+    assert document['data'][0]['id'] > last_id
+    assert [row['id'] for row in document['data']] == sorted(row['id'] for row in document['data'])
+
+
+def test_tampered_cursor_is_refused(client, education):
+    cursor = client.post('/api/query-data', json=dict(education, limit=10)).get_json()['next_cursor']
+    tampered = cursor[:-2] + ('AA' if not cursor.endswith('AA') else 'BB')
+
+    response = client.post('/api/query-data', json={'sector': 'Education', 'cursor': tampered})
+    assert response.status_code == 400
+    assert response.get_json() == {"success": False, "msg": "Invalid cursor"}
+
+
+def test_cursor_of_another_sector_is_refused(client, education):
+    cursor = client.post('/api/query-data', json=dict(education, limit=10)).get_json()['next_cursor']
+
+    response = client.post('/api/query-data', json={'sector': 'Agriculture', 'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json()['msg'] == "Cursor belongs to another sector"
+
+
+@pytest.mark.parametrize('options', [{'limit': 0}, {'limit': 'ten'}, {'after_id': 'x'}])
+def test_bad_paging_options_are_refused(client, education, options):
+    response = client.post('/api/query-data', json=dict(education, **options))
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+@pytest.mark.parametrize('fields', ['year', ['year', 'password'], ['year', 3], {'year': True}, ['created_at']])
+def test_fields_must_be_a_list_of_known_columns(client, education, fields):
+    response = client.post('/api/query-data', json=dict(education, fields=fields))
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_fields_select_columns(client, education):
+    document = client.post('/api/query-data', json=dict(education, fields=['year', 'indicator_value'])).get_json()
+
+    assert document['data']
+    assert all(set(row) <= {'year', 'indicator_value'} for row in document['data'])
+
+
+def test_fields_take_extra_dimensions(client, education):
+    db.session.add(EducationData(sector='Education', subsector_1='Primary Education', province='Kampot',
+                                 series_name='With a dimension', year='2020', filters='{"gender": "Female"}'))
+    db.session.commit()
+
+    response = client.post('/api/query-data', json=dict(education, series_name='With a dimension',
+                                                        fields=['year', 'gender']))
+    assert response.status_code == 200
+    assert response.get_json()['data'] == [{'year': '2020', 'gender': 'Female'}]
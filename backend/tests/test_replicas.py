@@ -0,0 +1,154 @@
+# -*- encoding: utf-8 -*-
+
+import os, shutil
+
+import pytest
+from sqlalchemy import event
+
+from benchmarks.bench_replicas import replica_uri
+from benchmarks.synthetic import PROVINCES, SECTORS
+
+SELECTION = {'sector': 'Education', 'subsector_1': 'Primary Education'}
+
+
+@pytest.fixture
+def replica(app, sectors, sector_database, tmp_path):
+    """A read-only copy of the primary's SQLite file, the only replica of `app`."""
+    from api.replicas import replicas
+
+    path = str(tmp_path / 'replica.sqlite3')
+    shutil.copy(sector_database, path)
+    app.config.update(DB_REPLICA_URIS=[replica_uri(path)], RESULT_CACHE_BACKEND='none')
+    replicas.init_app(app)
+    replicas.check()
+    yield replicas.replicas[0]
+    replicas.dispose()
+
+
+@pytest.fixture
+def primary_statements(app):
+    """The statements sent to the primary, as a list that grows."""
+    from api.models import db
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_data_reads_go_to_the_replica(client, replica, primary_statements):
+    # Startup work (menu, indexes, the revocation set) runs on the first request
+    client.get('/api/query-menu')
+    before, primary_statements[:] = replica.statements, []
+
+    response = client.post('/api/query-data', json=SELECTION)
+
+    assert response.status_code == 200
+    assert response.get_json()['data']
+    assert replica.statements > before
+    assert primary_statements == []
+
+
+def test_writes_and_flushes_go_to_the_primary(app, replica):
+    from api.models import db, EducationData
+
+    assert EducationData.query.filter_by(series_name='Replica check').count() == 0
+    assert not db.session.info.get('primary')
+
+    db.session.add(EducationData(sector='Education', series_name='Replica check'))
+    db.session.flush()
+    assert db.session.info['primary']
+    # The read-only copy has not got the row: reading it back means reading the primary
+    assert EducationData.query.filter_by(series_name='Replica check').count() == 1
+    db.session.commit()
+
+
+def test_register_writes_to_the_primary(client, replica):
+    from api.models import Users
+
+    response = client.post('/api/users/register', json={
+        'username': 'someone', 'email': 'someone@example.com', 'password': 'some-pass'})
+
+    assert response.status_code == 200
+    assert Users.get_by_email('someone@example.com') is not None
+
+
+def test_replica_and_primary_answer_the_same(client, replica):
+    from api.caching import data_versions
+
+    payloads = [{'sector': sector, 'subsector_1': subsector, 'province': PROVINCES[i]}
+                for i, (sector, subsectors) in enumerate(SECTORS.items()) for subsector in subsectors]
+
+    from_replica = [client.post('/api/query-data', json=payload).get_json() for payload in payloads]
+    replica.healthy = False
+    data_versions.invalidate()
+    before = replica.statements
+    from_primary = [client.post('/api/query-data', json=payload).get_json() for payload in payloads]
+
+    assert replica.statements == before
+    assert from_replica == from_primary
+
+
+def test_unreadable_replica_falls_back_to_the_primary(client, replica):
+    from api.replicas import replicas
+
+    path = replica.engine.url.database[len('file:'):]
+    os.rename(path, path + '.gone')
+    replica.engine.dispose()
+    replicas.check()
+    assert not replica.healthy
+
+    response = client.post('/api/query-data', json=SELECTION)
+    assert response.status_code == 200
+    assert response.get_json()['data']
+
+    os.rename(path + '.gone', path)
+    replicas.check()
+    assert replica.healthy
+
+
+def fail_statement(conn, cursor, statement, parameters, context, executemany):
+    return 'SELECT * FROM missing_table', ()
+
+
+def drop_connection(conn, cursor, statement, parameters, context, executemany):
+    cursor.connection.close()
+    return statement, parameters
+
+
+@pytest.mark.parametrize('failure', [fail_statement, drop_connection])
+def test_failure_mid_query_is_retried_on_the_primary(client, replica, failure):
+    expected = client.post('/api/query-data', json=SELECTION).get_json()
+    failed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if 'education_data' in statement and not failed:
+            failed.append(statement)
+            return failure(conn, cursor, statement, parameters, context, executemany)
+        return statement, parameters
+
+    event.listen(replica.engine, 'before_cursor_execute', before_cursor_execute, retval=True)
+    try:
+        response = client.post('/api/query-data', json=SELECTION)
+    finally:
+        event.remove(replica.engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert failed
+    assert not replica.healthy
+    assert response.status_code == 200
+    assert response.get_json() == expected
+
+
+def test_capture_statements_sees_replica_reads(app, replica):
+    from api.advisor import capture_statements
+    from api.models import EducationData
+
+    before = replica.statements
+    statements = capture_statements(lambda: EducationData.get_data(**SELECTION))
+
+    assert replica.statements > before
+    assert any('education_data' in statement for statement, _ in statements)
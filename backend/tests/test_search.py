@@ -0,0 +1,39 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from api.caching import data_versions
+from api.models import db, DataVersion, EducationData
+from api.search import series_search
+from benchmarks.bench_search import rename_series, series_names
+
+
+@pytest.fixture
+def named_series(sectors):
+    names = series_names(60)
+    for i, model in enumerate(sectors):
+        rename_series(db, model, names, i * (len(names) // 3))
+    DataVersion.bump([model.__tablename__ for model in sectors])
+    db.session.commit()
+    data_versions.invalidate()
+    return names
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('dropout primary', 'Dropout rate in primary schools'),
+    ('paddy prod', 'Paddy production in '),
+    ('enrolmnet rate', 'Net enrolment rate in '),
+])
+def test_search_finds_prefixes_and_typos(client, named_series, query, expected):
+    results = client.get('/api/search', query_string={'q': query}).get_json()['results']
+
+    assert results[0]['series_name'].startswith(expected)
+
+
+def test_new_series_is_found_after_a_write(named_series):
+    db.session.add(EducationData(sector='Education', subsector_1='Primary Education',
+                                 series_name='Number of scholarship recipients', indicator='Female'))
+    db.session.commit()
+
+    hits = series_search.search([EducationData], 'scholarship', 5)
+    assert [hit['series_name'] for hit in hits] == ['Number of scholarship recipients']
@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+
+import math
+
+import pytest
+
+from api import models
+from api.ingest import analyze
+from api.models import db, EducationData
+from api.schema import upgrade
+from benchmarks.bench_spatial import VIEWS, create_legacy_table, download, map_points, view_bbox
+from benchmarks.synthetic import populate
+
+
+@pytest.fixture
+def legacy_table(app):
+    """education_data with the old string coordinates (some not numbers), then upgraded."""
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    create_legacy_table(db, EducationData)
+    populate(EducationData, 5000)
+    db.session.execute(db.text("UPDATE education_data SET latitude = 'n/a' WHERE id % 1000 = 1"))
+    db.session.execute(db.text("UPDATE education_data SET longitude = '' WHERE id % 1000 = 2"))
+    db.session.commit()
+    upgrade()
+    analyze([EducationData])
+
+
+def same_clusters(old, new):
+    if old['cell_lat'] != new['cell_lat'] or old['cell_lon'] != new['cell_lon'] or old['count'] != new['count']:
+        return False
+    return all(math.isclose(a, b, rel_tol=1e-9) for name in ('latitude', 'longitude', 'indicator_value')
+               for a, b in zip(old[name], new[name]))
+
+
+@pytest.mark.parametrize('name, zoom, longitude, latitude', VIEWS)
+def test_map_points_agree_across_paths(app, client, legacy_table, monkeypatch, name, zoom, longitude, latitude):
+    pytest.importorskip('numpy')
+    from api.columnar import snapshots
+    bbox = view_bbox(zoom, longitude, latitude)
+    expected = download(client, bbox)
+
+    rtree = map_points(client, bbox, zoom)
+    with monkeypatch.context() as patch:
+        patch.setattr(models, 'has_rtree', lambda table_name: False)
+        btree = map_points(client, bbox, zoom)
+    snapshots.reload(EducationData)
+    app.config['DATA_ENGINE'] = 'columnar'
+    columnar = map_points(client, bbox, zoom)
+
+    if rtree['clustered']:
+        # The snapped view holds every point of the clusters
+        assert sum(rtree['columns']['count']) >= len(expected)
+        assert same_clusters(btree['columns'], rtree['columns'])
+        assert same_clusters(rtree['columns'], columnar['columns'])
+    else:
+        assert sorted(expected) == btree['columns']['id'] == rtree['columns']['id'] == columnar['columns']['id']
+
+
+def test_rtree_follows_orm_writes(legacy_table):
+    model = EducationData
+    row = model.query.filter(model.latitude.isnot(None)).order_by(model.id).first()
+    row.latitude, row.longitude = -45.5, 170.25
+    removed = model.query.filter(model.latitude.isnot(None)).order_by(model.id.desc()).first()
+    db.session.delete(removed)
+    added = model(sector='Education', series_name='Trigger check', latitude=45.5, longitude=-170.25)
+    db.session.add(added)
+    db.session.add(model(sector='Education', series_name='Trigger check'))
+    db.session.commit()
+
+    rtree = f'{model.__tablename__}_rtree'
+    located = db.session.execute(db.text(
+        f'SELECT COUNT(*) FROM {model.__tablename__} WHERE latitude IS NOT NULL AND longitude IS NOT NULL')).scalar()
+    assert db.session.execute(db.text(f'SELECT COUNT(*) FROM {rtree}')).scalar() == located
+    assert tuple(db.session.execute(db.text(f'SELECT min_lat, min_lon FROM {rtree} WHERE id = :id'),
+                                    {'id': row.id}).first()) == (-45.5, 170.25)
+    assert db.session.execute(db.text(f'SELECT 1 FROM {rtree} WHERE id = :id'), {'id': removed.id}).first() is None
+    assert db.session.execute(db.text(f'SELECT 1 FROM {rtree} WHERE id = :id'), {'id': added.id}).first() is not None
@@ -0,0 +1,29 @@
+# -*- encoding: utf-8 -*-
+
+import re
+
+import api
+
+
+def sql_statements(response):
+    return int(re.search(r'sql;dur=[0-9.]+;desc="(\d+) statements"', response.headers['Server-Timing']).group(1))
+
+
+def test_started_worker_serves_from_warm_indexes(app, client, sectors, monkeypatch):
+    monkeypatch.setattr(api, '_started', False)
+    api.start_worker()
+
+    # Nothing left to build: the facet index and the search index answer from memory
+    assert sql_statements(client.get('/api/facets', query_string={'sector': 'Education'})) == 0
+    assert sql_statements(client.get('/api/search', query_string={'q': 'education'})) == 0
+
+
+def test_worker_starts_once(app, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, '_started', False)
+    monkeypatch.setattr(api.menu_cache, 'refresh', lambda: calls.append('menu'))
+
+    api.start_worker()
+    api.start_worker()
+
+    assert calls == ['menu']
@@ -0,0 +1,37 @@
+# -*- encoding: utf-8 -*-
+
+import math
+
+import pytest
+
+from benchmarks.bench_storage import REQUESTS, SECTOR_NAMES
+
+
+def answer(app, client, storage, url, payload):
+    app.config.update(DATA_STORAGE=storage, RESULT_CACHE_BACKEND='none')
+    document = client.post(url, json=payload).get_json()
+    for row in document.get('data', []):
+        row.pop('id', None)
+    return document
+
+
+@pytest.mark.parametrize('name, url, payload', REQUESTS)
+def test_unified_table_answers_like_the_sector_tables(app, client, unified, name, url, payload):
+    tables = answer(app, client, 'tables', url, payload)
+    fact = answer(app, client, 'unified', url, payload)
+
+    if 'columns' in tables:
+        assert tables['columns'].keys() == fact['columns'].keys()
+        for key in tables['columns']:
+            assert len(tables['columns'][key]) == len(fact['columns'][key]), key
+    else:
+        assert tables == fact
+
+
+def test_cross_sector_aggregate_covers_every_sector(app, client, unified):
+    per_table = [answer(app, client, 'tables', '/api/aggregate', {'sector': sector, 'group_by': ['year']})
+                 for sector in SECTOR_NAMES]
+    fact = answer(app, client, 'unified', '/api/aggregate', {'group_by': ['sector', 'year']})
+
+    assert math.isclose(sum(sum(document['columns']['sum']) for document in per_table),
+                        sum(fact['columns']['sum']), rel_tol=1e-9)
@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+
+import json
+
+import pytest
+
+from api.config import BaseConfig
+from api.models import EducationData
+
+SELECTION = {'sector': 'Education', 'subsector_1': 'Primary Education', 'province': 'Kampot'}
+
+
+@pytest.fixture
+def education(app, sectors, monkeypatch):
+    app.config['RESULT_CACHE_BACKEND'] = 'none'
+    monkeypatch.setattr(BaseConfig, 'STREAM_CHUNK_SIZE', 10)
+    return SELECTION
+
+
+def by_id(rows):
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def test_streamed_json_is_the_regular_document(client, education):
+    whole = client.post('/api/query-data', json=education).get_json()
+    response = client.post('/api/query-data?stream=json', json=education)
+
+    assert response.content_length is None
+    assert response.mimetype == 'application/json'
+    document = json.loads(response.get_data())
+    assert document['filters'] == whole['filters']
+    assert by_id(document['data']) == by_id(whole['data'])
+
+
+def test_streamed_ndjson_is_filters_then_one_row_per_line(client, education):
+    whole = client.post('/api/query-data', json=education).get_json()
+    response = client.post('/api/query-data?stream=ndjson', json=education)
+
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data().splitlines()
+    assert json.loads(lines[0]) == {'filters': whole['filters']}
+    assert by_id(json.loads(line) for line in lines[1:]) == by_id(whole['data'])
+
+
+@pytest.mark.parametrize('query, accept, mimetype, streamed', [
+    ('', 'application/x-ndjson', 'application/x-ndjson', True),
+    ('', 'application/x-ndjson, application/json;q=0.5', 'application/x-ndjson', True),
+    ('', 'application/json, application/x-ndjson;q=0.5', 'application/json', False),
+    ('', 'application/json', 'application/json', False),
+    ('', '*/*', 'application/json', False),
+    # The query string wins over Accept; an unknown format streams the JSON document
+    ('?stream=json', 'application/x-ndjson', 'application/json', True),
+    ('?stream=csv', '', 'application/json', True),
+])
+def test_accept_negotiation(client, education, query, accept, mimetype, streamed):
+    response = client.post('/api/query-data' + query, json=education, headers={'Accept': accept})
+
+    assert response.status_code == 200
+    assert response.mimetype == mimetype
+    # A streamed body has no length up front
+    assert (response.content_length is None) == streamed
+
+
+@pytest.mark.parametrize('stream_format', ['json', 'ndjson'])
+def test_rows_are_not_buffered(client, education, monkeypatch, stream_format):
+    read = []
+    iter_data = EducationData.iter_data
+
+    def counting_iter_data(selection, **options):
+        for row in iter_data(selection, **options):
+            read.append(row)
+            yield row
+
+    monkeypatch.setattr(EducationData, 'iter_data', counting_iter_data)
+    response = client.post('/api/query-data?stream=' + stream_format, json=education, buffered=False)
+    chunks = iter(response.response)
+
+    # The first chunk with rows goes out after one chunk of rows has been read, not the whole selection
+    while not read:
+        next(chunks)
+    assert len(read) == 10
+    remaining = b''.join(chunks)
+    assert len(read) > 20 and remaining
+    response.close()
@@ -1,4 +1,10 @@
+import click
+
 from api import app, db
+from api.models import EducationData, AgricultureData, EconomicData, FactData
+from api.replicas import use_primary
+
+SECTOR_MODELS = [EducationData, AgricultureData, EconomicData]
 
 @app.shell_context_processor
 def make_shell_context():
@@ -6,5 +12,98 @@ def make_shell_context():
             "db": db
             }
 
+@app.cli.command("migrate")
+def migrate():
+    """Creates missing tables, columns and indexes; run before starting the server."""
+    from api import migrate_database
+
+    migrate_database()
+    click.echo("Database schema is up to date")
+
+@app.cli.command("index-advisor")
+@click.option("--log", "log_path", default=None, help="Query log to replay (defaults to QUERY_LOG_PATH).")
+@click.option("--create-indexes", is_flag=True, help="Create declared indexes missing from existing tables first.")
+@click.option("--verbose", is_flag=True, help="Print every plan, not only the ones with full scans.")
+def index_advisor(log_path, create_indexes, verbose):
+    """Replays logged /api/query-data filters and reports their EXPLAIN plans."""
+    from api.advisor import advise, format_report, load_query_log
+    from api.schema import ensure_indexes
+
+    log_path = log_path or app.config.get('QUERY_LOG_PATH')
+    if not log_path:
+        raise click.UsageError("No query log: pass --log or set QUERY_LOG_PATH.")
+
+    if create_indexes:
+        for name in ensure_indexes(db.metadata.sorted_tables):
+            click.echo(f"Created index {name}")
+
+    click.echo(format_report(advise(load_query_log(log_path), SECTOR_MODELS + [FactData]), verbose=verbose))
+
+@app.cli.command("sync-dimensions")
+def sync_dimensions():
+    """Rebuilds the extra-dimension side tables from the `filters` JSON column."""
+    from api.models import DataVersion
+    from api.schema import upgrade
+
+    use_primary(db.session)
+    upgrade()
+    for model in SECTOR_MODELS + [FactData]:
+        model.sync_dimensions()
+        click.echo(f"Synced {model.dimensions.name}")
+    DataVersion.bump([model.__tablename__ for model in SECTOR_MODELS + [FactData]])
+    db.session.commit()
+
+@app.cli.command("ingest")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--table", "table_name", required=True,
+              type=click.Choice([model.__tablename__ for model in SECTOR_MODELS + [FactData]]),
+              help="Target sector table, or fact_data for the unified storage.")
+@click.option("--sector", default=None, help="Sector value for rows that have none (a new name adds a sector to fact_data).")
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows per bulk statement / commit.")
+@click.option("--format", "file_format", default=None, type=click.Choice(["csv", "xlsx", "parquet"]),
+              help="File format (defaults to the file extension).")
+@click.option("--no-resume", is_flag=True, help="Reload from the first row even if a checkpoint exists.")
+def ingest(paths, table_name, sector, chunk_size, file_format, no_resume):
+    """Bulk-loads CSV/Excel/Parquet files into a sector table."""
+    from api.ingest import analyze, ingest_file
+    from api.schema import upgrade
+
+    model = {model.__tablename__: model for model in SECTOR_MODELS + [FactData]}[table_name]
+
+    # Loads read back what they wrote (checkpoints, row keys): never from a lagging replica
+    use_primary(db.session)
+    upgrade()
+
+    for path in paths:
+        summary = ingest_file(path, model, chunk_size=chunk_size, file_format=file_format,
+                              sector=sector, resume=not no_resume, report=click.echo)
+        click.echo(f"{path}: {summary['rows']} rows loaded, {summary['rejected']} rejected "
+                   f"in {summary['seconds']}s ({summary['rows_per_second']} rows/s)")
+
+    # Planner statistics; the serving workers rebuild their menus from the data_version bump
+    analyze([model])
+
+@app.cli.command("unify-sectors")
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows per bulk statement / commit.")
+def unify_sectors(chunk_size):
+    """Copies the sector tables into the unified fact table (for DATA_STORAGE=unified)."""
+    from api.ingest import analyze, unify_tables
+    from api.routes import SECTORS
+    from api.schema import upgrade
+
+    use_primary(db.session)
+    upgrade()
+    copied = unify_tables(SECTORS, chunk_size=chunk_size, report=click.echo)
+    click.echo(f"{copied} rows in {FactData.__tablename__}")
+
+    analyze([FactData])
+
+@app.cli.command("purge-blocklist")
+def purge_blocklist():
+    """Deletes blocklisted tokens that have expired anyway."""
+    from api.auth import purge_expired_tokens
+
+    click.echo(f"Purged {purge_expired_tokens()} expired tokens")
+
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0")
\ No newline at end of file
+    app.run(debug=True, host="0.0.0.0")